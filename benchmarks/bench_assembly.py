@@ -0,0 +1,51 @@
+'''
+Benchmark of the script assembly in Formatter.get_formatted_script_from_tokens().
+
+Generates scripts with 10 to 10,000 queries, tokenizes them once, and times splicing the formatted queries back into
+the script. Every query is identical and the final yapf pass is skipped, so that the time is dominated by assembly.
+The time per query should stay roughly constant as the number of queries grows.
+
+Usage: python benchmarks/bench_assembly.py
+'''
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysqlformatter.src.formatter import Formatter
+
+QUERY_COUNTS = [10, 100, 1000, 10000]
+
+
+class AssemblyFormatter(Formatter):
+    '''
+    Formatter that skips the final yapf pass, leaving the assembly to measure.
+    '''
+    def reformat_python(self, script, changedLines, changedLinesOnly=False, context=''):
+        return script
+
+
+def make_script(queryCount):
+    lines = []
+    for i in range(queryCount):
+        lines.append("df{i} = spark.sql('select * from t0')".format(i=i))
+        lines.append('df{i}.cache()'.format(i=i))
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    formatter = AssemblyFormatter()
+    print('{:>8} {:>12} {:>16}'.format('queries', 'seconds', 'us per query'))
+    for queryCount in QUERY_COUNTS:
+        script = make_script(queryCount)
+        tokens = formatter.tokenizer.tokenize(script)
+        formatter.get_formatted_script_from_tokens(script, tokens)  # warm up the query cache
+        repeat = max(1, 10000 // queryCount)
+        seconds = min(
+            timeit.repeat(lambda: formatter.get_formatted_script_from_tokens(script, tokens), number=repeat,
+                          repeat=3)) / repeat
+        print('{:>8} {:>12.6f} {:>16.2f}'.format(queryCount, seconds, seconds / queryCount * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+'''
+Benchmark of the two yapf passes of formatting a batch of small files with a custom setup.cfg style, giving yapf the
+path of the config file in every FormatCode() call, as Formatter() did, against resolving the style once and reusing it,
+as Formatter() does. The files are small, so that the time spent resolving the style is not hidden by formatting.
+
+Usage: python benchmarks/bench_python_style.py [--files N] [--repeat N]
+'''
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysqlformatter.src.formatter import Formatter
+
+STYLE_CONFIG = '[yapf]\nbased_on_style = pep8\ncolumn_limit = 100\nspaces_before_comment = 4\n'
+SCRIPT = '''def get_table{0}(spark, date):
+    query = "select * from t{0} where date = '{{date}}'".format(date=date)
+    return spark.sql(query).filter(col("c{0}") > {0})
+'''
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--files', type=int, default=1000, help='Number of files in the batch. Default to 1000.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of times to time each run. Default to 5.')
+    args = parser.parse_args(argv[1:])
+    from yapf.yapflib import yapf_api
+    scripts = [SCRIPT.format(i) for i in range(args.files)]
+    tempDir = tempfile.mkdtemp()
+    try:
+        stylePath = os.path.join(tempDir, 'setup.cfg')
+        with open(stylePath, 'w') as f:
+            f.write(STYLE_CONFIG)
+        formatter = Formatter(pythonStyle=stylePath)
+
+        def format_with_style_path():
+            for script in scripts:
+                formattedScript = yapf_api.FormatCode(script, style_config=stylePath)[0]
+                yapf_api.FormatCode(formattedScript, style_config=stylePath)
+
+        def format_with_resolved_style():
+            for script in scripts:
+                formatter.format_python(formatter.format_python(script))
+
+        for script in scripts[:10]:  # both give the same result
+            assert formatter.format_python(script) == yapf_api.FormatCode(script, style_config=stylePath)[0]
+        runs = [('path in every call', format_with_style_path), ('resolved once', format_with_resolved_style)]
+        timings = [float('inf')] * len(runs)
+        for _ in range(args.repeat):  # alternate the runs, so that both see the same load on the machine
+            for i, (name, run) in enumerate(runs):
+                timings[i] = min(timings[i], timeit.timeit(run, number=1))
+        print('{:<24} {:>10} {:>16}'.format('style', 'seconds', 'ms per file'))
+        for (name, run), seconds in zip(runs, timings):
+            print('{:<24} {:>10.3f} {:>16.3f}'.format(name, seconds, seconds / len(scripts) * 1e3))
+        print('Saved {:.3f} ms per file ({:.1%})'.format((timings[0] - timings[1]) / len(scripts) * 1e3,
+                                                         1 - timings[1] / timings[0]))
+    finally:
+        shutil.rmtree(tempDir)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
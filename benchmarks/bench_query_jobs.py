@@ -0,0 +1,55 @@
+'''
+Benchmark of formatting one large generated script with thousands of queries, formatting its queries in turn in the
+current process against formatting them in a pool of worker processes with Formatter(queryJobs=N). Each run uses a new
+Formatter(), so that no query is served by the query cache of a previous run. The time of the format_queries stage,
+which includes starting the pool, is reported along with the total, since the yapf passes are not parallelized.
+
+Usage: python benchmarks/bench_query_jobs.py [--lines N] [--query-jobs N [N ...]] [--repeat N]
+'''
+import os
+import sys
+import random
+import argparse
+import timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysqlformatter.src.formatter import Formatter
+from pysqlformatter.src.stats import FormatStats
+from run import make_script
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--lines', type=int, default=20000, help='Number of lines of the script. Default to 20000.')
+    parser.add_argument('--query-jobs',
+                        type=int,
+                        nargs='+',
+                        default=[1, 2, 4, 0],
+                        help='Numbers of worker processes to compare, 0 for one per CPU. Default to 1 2 4 0.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to time each run. Default to 3.')
+    args = parser.parse_args(argv[1:])
+    script = make_script(random.Random(0), args.lines, queryDensity=0.5)
+    formatter = Formatter()
+    tokens = formatter.tokenizer.tokenize(formatter.format_python(script))
+    print('{} lines, {} queries, {} distinct, {} CPUs'.format(script.count('\n'), len(tokens),
+                                                              len(set(token.value.strip() for token in tokens)),
+                                                              os.cpu_count()))
+    serialScript = formatter.format(script)
+    timings = {queryJobs: (float('inf'), float('inf')) for queryJobs in args.query_jobs}
+    for _ in range(args.repeat):  # alternate the runs, so that all see the same load on the machine
+        for queryJobs in args.query_jobs:
+            formatter = Formatter(queryJobs=queryJobs)
+            stats = FormatStats()
+            seconds = timeit.timeit(lambda: formatter.format(script, stats), number=1)
+            assert formatter.format(script) == serialScript  # same output as formatting the queries in turn
+            bestSeconds, bestQuerySeconds = timings[queryJobs]
+            timings[queryJobs] = (min(bestSeconds, seconds), min(bestQuerySeconds, stats.stageTimes['format_queries']))
+    print('{:>10} {:>12} {:>18} {:>10}'.format('queryJobs', 'seconds', 'format_queries s', 'speedup'))
+    for queryJobs in args.query_jobs:
+        seconds, querySeconds = timings[queryJobs]
+        print('{:>10} {:>12.3f} {:>18.3f} {:>9.2f}x'.format(queryJobs, seconds, querySeconds,
+                                                            timings[args.query_jobs[0]][0] / seconds))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,43 @@
+'''
+Benchmark of finding queries with growing numbers of query names, e.g., generated from the tables of a data catalog.
+Compares matching names against the query names with str.endswith() on a tuple of them, as Tokenizer() did, which
+tries every query name in turn, with QueryNameMatcher(), which looks up the suffixes of the few distinct lengths of the
+query names in a set. Also times Tokenizer.tokenize() on a script with many assignments, per kilobyte, which should
+stay flat as the number of query names grows.
+
+Usage: python benchmarks/bench_query_names.py
+'''
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysqlformatter.src.tokenizer import Tokenizer, QueryNameMatcher
+
+NAME_COUNTS = [1, 10, 100, 1000]
+NAMES = ['df', 'table7Query', 'mySql', 'rowCount', 'customerOrdersQuery', 'self.result']  # names to match
+SCRIPT = ''.join(("x{0} = f(a, 'b')\ntable{0}Query = 'select * from t{0}'\nname{0} = 'select * from t{0}'\n"
+                  "df = spark.sql('select count(*) from t{0}')\n").format(i) for i in range(1000))
+
+
+def main():
+    print('{:>6} {:>20} {:>20} {:>16}'.format('names', 'endswith us/match', 'matcher us/match', 'tokenize us/KB'))
+    for nameCount in NAME_COUNTS:
+        queryNames = ['table{}Query'.format(i) for i in range(nameCount)]
+        suffixes = tuple(queryName.lower() for queryName in queryNames)
+        matcher = QueryNameMatcher(queryNames)
+        tokenizer = Tokenizer(queryNames=queryNames)
+        for name in NAMES:  # both give the same result
+            assert name.lower().endswith(suffixes) == matcher.match(name)
+        number = 10000
+        endswithSeconds = min(
+            timeit.repeat(lambda: [name.lower().endswith(suffixes) for name in NAMES], number=number, repeat=3))
+        matcherSeconds = min(timeit.repeat(lambda: [matcher.match(name) for name in NAMES], number=number, repeat=3))
+        tokenizeSeconds = min(timeit.repeat(lambda: tokenizer.tokenize(SCRIPT), number=1, repeat=3))
+        print('{:>6} {:>20.3f} {:>20.3f} {:>16.2f}'.format(nameCount, endswithSeconds / number / len(NAMES) * 1e6,
+                                                           matcherSeconds / number / len(NAMES) * 1e6,
+                                                           tokenizeSeconds / len(SCRIPT) * 1024 * 1e6))
+
+
+if __name__ == '__main__':
+    main()
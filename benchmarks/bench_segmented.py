@@ -0,0 +1,96 @@
+'''
+Benchmark of the peak memory of formatting one large generated file in place, whole against one segment at a time with
+--segmented. Each run is a separate process, whose peak resident set size is reported, so that the runs do not share
+allocations. The peak of the whole run grows with the size of the file, that of the segmented run with the size of the
+largest segment; both give the same file.
+
+Usage: python benchmarks/bench_segmented.py [--megabytes N] [--segment-lines N]
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysqlformatter.src import api
+from pysqlformatter.src.segments import SEGMENT_LINES
+
+BLOCK = '''def f{i}(a, b):
+    query = """
+    select a, b, count(c) from t{i} left join t1 on t{i}.id = t1.id where t1.date = '{{date}}' group by a, b
+    """
+    df = spark.sql('select * from t{i}')
+    df.write.saveAsTable( 'db.t{i}' )
+
+'''
+
+
+def make_script(megabytes):
+    blocks = []
+    size = 0
+    i = 0
+    while size < megabytes * 1024 * 1024:
+        block = BLOCK.format(i=i)
+        blocks.append(block)
+        size += len(block)
+        i += 1
+    return ''.join(blocks)
+
+
+def format_in_child(filePath, segmentLines):
+    '''
+    Format a file in place in this process, and print the time taken and the peak resident set size as JSON.
+    '''
+    import resource
+    startTime = time.perf_counter()
+    result = api.format_files([filePath], inPlace=True, segmentLines=segmentLines or None)[0]
+    seconds = time.perf_counter() - startTime
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        json.dumps({
+            'seconds': seconds,
+            'maxRss': maxRss if sys.platform == 'darwin' else maxRss * 1024,  # bytes on macOS, kilobytes on Linux
+            'error': result.error
+        }))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--megabytes', type=float, default=1, help='Size of the file. Default to 1.')
+    parser.add_argument('--segment-lines',
+                        type=int,
+                        default=SEGMENT_LINES,
+                        help='Lines per segment. Default to {}.'.format(SEGMENT_LINES))
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)  # file path and segment lines, 0 for whole
+    args = parser.parse_args(argv[1:])
+    if args.child:
+        format_in_child(args.child[0], int(args.child[1]))
+        return
+    script = make_script(args.megabytes)
+    tempDir = tempfile.mkdtemp()
+    try:
+        formattedScripts = []
+        print('{} MB, {} lines'.format(round(len(script) / 1024 / 1024, 1), script.count('\n')))
+        print('{:<24} {:>10} {:>16}'.format('run', 'seconds', 'peak RSS MB'))
+        for name, segmentLines in [('whole', 0), ('segmented', args.segment_lines)]:
+            filePath = os.path.join(tempDir, name + '.py')
+            with open(filePath, 'w') as f:
+                f.write(script)
+            command = [sys.executable, os.path.abspath(__file__), '--child', filePath, str(segmentLines)]
+            output = subprocess.check_output(command)
+            result = json.loads(output.decode('utf-8').strip().split('\n')[-1])
+            assert result['error'] is None, result['error']
+            with open(filePath) as f:
+                formattedScripts.append(f.read())
+            print('{:<24} {:>10.3f} {:>16.1f}'.format(name, result['seconds'], result['maxRss'] / 1024 / 1024))
+        assert formattedScripts[0] == formattedScripts[1]  # same output
+    finally:
+        shutil.rmtree(tempDir)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,64 @@
+'''
+Benchmark of the startup time of pysqlformatter.
+
+Measures, in fresh interpreters, the time to import pysqlformatter as reported by python -X importtime, and the wall
+time of `pysqlformatter --help` against that of an empty interpreter. Each is the minimum over several runs. Importing
+pysqlformatter should not import yapf or sparksqlformatter, which are only loaded once there is something to format;
+the modules taking the longest to import are listed to spot regressions.
+
+Usage: python benchmarks/bench_startup.py [runs]
+'''
+import os
+import sys
+import time
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RUNS = 10
+TOP_IMPORT_COUNT = 10
+
+
+def get_import_times():
+    '''
+    Return: list
+        (cumulative microseconds, module name) of every module imported by `import pysqlformatter`.
+    '''
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', 'import pysqlformatter'],
+        cwd=ROOT_DIR,
+        stderr=subprocess.STDOUT,
+    ).decode('utf-8')
+    importTimes = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, moduleName = line[len('import time:'):].split('|')
+        importTimes.append((int(cumulative), moduleName.strip()))
+    return importTimes
+
+
+def get_wall_time(args):
+    startTime = time.time()
+    subprocess.check_call([sys.executable] + args, cwd=ROOT_DIR, stdout=subprocess.DEVNULL)
+    return time.time() - startTime
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RUNS
+    importTimes = min((get_import_times() for _ in range(runs)), key=lambda importTimes: importTimes[-1][0])
+    moduleNames = set(moduleName for _, moduleName in importTimes)
+    print('import pysqlformatter: {:.1f} ms'.format(importTimes[-1][0] / 1000))
+    for dependency in ['yapf', 'sparksqlformatter', 'multiprocessing']:
+        print('  imports {}: {}'.format(dependency, dependency in moduleNames))
+    print('  slowest imports:')
+    for cumulative, moduleName in sorted(importTimes, reverse=True)[1:TOP_IMPORT_COUNT + 1]:
+        print('    {:>8.1f} ms  {}'.format(cumulative / 1000, moduleName))
+    emptyTime = min(get_wall_time(['-c', 'pass']) for _ in range(runs))
+    helpTime = min(get_wall_time(['-m', 'pysqlformatter', '--help']) for _ in range(runs))
+    print('python -c pass: {:.1f} ms'.format(emptyTime * 1000))
+    print('pysqlformatter --help: {:.1f} ms ({:.1f} ms over an empty interpreter)'.format(
+        helpTime * 1000, (helpTime - emptyTime) * 1000))
+
+
+if __name__ == '__main__':
+    main()
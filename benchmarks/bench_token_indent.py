@@ -0,0 +1,36 @@
+'''
+Benchmark of Tokenizer.tokenize() on scripts with thousands of matches on long lines, where looking up each token's
+indentation used to scan the line character by character.
+
+Usage: python benchmarks/bench_token_indent.py
+'''
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysqlformatter.src.tokenizer import Tokenizer
+
+MATCH_COUNTS = [100, 1000, 5000]
+LINE_LENGTH = 2000  # approximate length of the line containing every query
+
+
+def make_script(matchCount):
+    arguments = ', '.join(['1'] * (LINE_LENGTH // 3))
+    lines = ['def f():']
+    for i in range(matchCount):
+        lines.append("    df{i} = f({arguments}, spark.sql('select * from t{i}'))".format(i=i, arguments=arguments))
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    tokenizer = Tokenizer(queryNames=['query'])
+    print('{:>8} {:>12} {:>14}'.format('matches', 'seconds', 'us per match'))
+    for matchCount in MATCH_COUNTS:
+        script = make_script(matchCount)
+        seconds = min(timeit.repeat(lambda: tokenizer.tokenize(script), number=1, repeat=3))
+        print('{:>8} {:>12.6f} {:>14.2f}'.format(matchCount, seconds, seconds / matchCount * 1e6))
+
+
+if __name__ == '__main__':
+    main()
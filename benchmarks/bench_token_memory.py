@@ -0,0 +1,58 @@
+'''
+Benchmark of the memory used by the tokens of a large script.
+
+Generates a synthetic script of about 50 MB (or the given number of megabytes), tokenizes it, and reports the memory
+allocated while tokenizing, beyond the script itself, and per token, as measured by tracemalloc. Tokens only hold
+offsets into the script, so the memory per token should not depend on the length of the queries.
+
+Usage: python benchmarks/bench_token_memory.py [megabytes]
+'''
+import os
+import sys
+import time
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysqlformatter.src.tokenizer import Tokenizer
+
+DEFAULT_MEGABYTES = 50
+
+BLOCK = '''def f{i}(a, b):
+    query = """
+    select a, b, count(c) from t{i} left join t1 on t{i}.id = t1.id where t1.date = '{{date}}' group by a, b
+    """
+    df = spark.sql('select * from t{i}')
+    df.write.saveAsTable('db.t{i}')
+
+'''
+
+
+def make_script(megabytes):
+    blocks = []
+    size = 0
+    i = 0
+    while size < megabytes * 1024 * 1024:
+        block = BLOCK.format(i=i)
+        blocks.append(block)
+        size += len(block)
+        i += 1
+    return ''.join(blocks)
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MEGABYTES
+    script = make_script(megabytes)
+    tokenizer = Tokenizer(queryNames=['query'])
+    tracemalloc.start()
+    startTime = time.time()
+    tokens = tokenizer.tokenize(script)
+    seconds = time.time() - startTime
+    currSize, peakSize = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('script: {:.1f} MB, {} tokens, {:.2f} s'.format(len(script) / 1024 / 1024, len(tokens), seconds))
+    print('retained: {:.1f} MB ({:.0f} bytes per token)'.format(currSize / 1024 / 1024, currSize / len(tokens)))
+    print('peak: {:.1f} MB ({:.0f} bytes per token)'.format(peakSize / 1024 / 1024, peakSize / len(tokens)))
+
+
+if __name__ == '__main__':
+    main()
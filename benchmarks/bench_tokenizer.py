@@ -0,0 +1,43 @@
+'''
+Benchmark of Tokenizer.tokenize() on pathological inputs that made the former spark.sql() regex backtrack, e.g.,
+thousands of unclosed spark.sql(' calls, and on an ordinary script, at doubling sizes. The time per kilobyte should stay
+flat as the size grows; a growing time per kilobyte means the scan is no longer linear.
+
+Usage: python benchmarks/bench_tokenizer.py
+'''
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysqlformatter.src.tokenizer import Tokenizer
+
+SIZES = [5000, 10000, 20000, 40000]  # number of repetitions of each case's unit
+CASES = {
+    'unclosed spark.sql(':
+    lambda size: "spark.sql('a " * size,
+    'unclosed string':
+    lambda size: "query = '" + 'query = ' * size + '\n',
+    'unclosed triple quotes':
+    lambda size: "spark.sql('''" + "spark.sql('a') " * size,
+    'nested parentheses':
+    lambda size: "df = spark.sql('" + '(' * size + "')\n",
+    'ordinary script':
+    lambda size: ("x = f(a, 'b')  # it's\nquery = 'select * from t'\n"
+                  "df = spark.sql('select count(*) from t')\n") * (size // 10),
+}
+
+
+def main():
+    tokenizer = Tokenizer(queryNames=['query'])
+    print('{:<24} {:>10} {:>12} {:>12}'.format('case', 'chars', 'seconds', 'us per KB'))
+    for caseName, make_script in CASES.items():
+        for size in SIZES:
+            script = make_script(size)
+            seconds = min(timeit.repeat(lambda: tokenizer.tokenize(script), number=1, repeat=3))
+            print('{:<24} {:>10} {:>12.6f} {:>12.2f}'.format(caseName, len(script), seconds,
+                                                             seconds / len(script) * 1024 * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+'''
+Benchmark harness timing every stage of formatting over synthetic and real-world corpora.
+
+For each corpus, every script is formatted once by a Formatter() whose stages are timed call by call:
+    tokenize          Tokenizer.tokenize()
+    format_query      sparksqlformatter.api.format_query(), i.e., the queries not served by the query cache
+    yapf_first_pass   yapf FormatCode() before the queries are formatted
+    yapf_second_pass  yapf FormatCode() after the formatted queries are spliced in
+Then every file is formatted end-to-end by api.format_file() (stage format_file), and the largest file once more under
+tracemalloc to measure the peak memory allocated while formatting it.
+
+The synthetic corpora vary in file size and query density; --corpus adds directories or files of real scripts, and the
+pysqlformatter source itself is included as a real-world corpus without queries. The results are written as JSON,
+together with the commit, Python and yapf versions, so that runs on different commits can be compared with --compare.
+
+Usage: python benchmarks/run.py [--output FILE] [--compare FILE] [--corpus PATH [PATH ...]] [--only NAME [NAME ...]]
+'''
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import collections
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysqlformatter.src import api
+from pysqlformatter.src.files import collect_files
+from pysqlformatter.src.formatter import Formatter
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_FORMAT_VERSION = 1
+STAGES = ['tokenize', 'format_query', 'yapf_first_pass', 'yapf_second_pass', 'format_file']
+SyntheticCorpus = collections.namedtuple('SyntheticCorpus', ['name', 'fileCount', 'lineCount', 'queryDensity'])
+SYNTHETIC_CORPORA = [
+    SyntheticCorpus(name='small-sparse', fileCount=20, lineCount=100, queryDensity=0.02),
+    SyntheticCorpus(name='small-dense', fileCount=20, lineCount=100, queryDensity=0.3),
+    SyntheticCorpus(name='large-sparse', fileCount=2, lineCount=1500, queryDensity=0.02),
+    SyntheticCorpus(name='large-dense', fileCount=2, lineCount=1500, queryDensity=0.3),
+]
+SOURCE_CORPUS = 'pysqlformatter-source'
+
+STATEMENTS = [
+    "x{i} = {{'a': 1, 'b': [1,2,3], 'c': foo(bar, baz)}}",
+    "print( 'hello',  {i}+2 )",
+    'result{i} = some_module.some_function(argument_number_one, argument_number_two, another_argument_value_{i})',
+    'if x{i}:\n    y{i} = x{i}*2\nelse:\n    y{i} = None',
+    "df{i}.write.mode('overwrite').saveAsTable('db.t{i}')",
+]
+QUERIES = [
+    'select a, b, count(*) from t{i} group by a, b',
+    "select * from t0 left join t{i} on t0.id = t{i}.id where t{i}.date = '{{date}}'",
+    'insert overwrite table audit select a, b from t{i}',
+    'drop table if exists t{i}',
+]
+QUERY_STATEMENTS = [
+    'query{i} = "{query}"',
+    "query{i} = '''\n{query}\n'''",
+    'df{i} = spark.sql("{query}")',
+    'df{i} = some_module.some_function(argument_number_one, spark.sql("{query}"), another_argument)',
+]
+
+
+def make_script(rng, lineCount, queryDensity):
+    '''
+    Generate a script of about lineCount lines, a queryDensity fraction of whose statements contain a query.
+    '''
+    lines = []
+    i = 0
+    while len(lines) < lineCount:
+        lines.append('def f{i}(a, b):'.format(i=i))
+        for _ in range(rng.randint(3, 10)):
+            i += 1
+            if rng.random() < queryDensity:
+                statement = rng.choice(QUERY_STATEMENTS).format(i=i, query=rng.choice(QUERIES).format(i=i))
+            else:
+                statement = rng.choice(STATEMENTS).format(i=i)
+            lines.extend('    ' + line for line in statement.split('\n'))
+        lines.append('')
+    return '\n'.join(lines) + '\n'
+
+
+def load_corpora(corpusPaths, seed):
+    '''
+    Return: collections.OrderedDict
+        Corpus name -> list of (file name, script).
+    '''
+    rng = random.Random(seed)
+    corpora = collections.OrderedDict()
+    for corpus in SYNTHETIC_CORPORA:
+        corpora['synthetic-' + corpus.name] = [('script{}.py'.format(i),
+                                                make_script(rng, corpus.lineCount, corpus.queryDensity))
+                                               for i in range(corpus.fileCount)]
+    sourcePaths = [os.path.join(ROOT_DIR, 'pysqlformatter')]
+    for name, paths in [(SOURCE_CORPUS, sourcePaths)] + [(os.path.basename(os.path.abspath(path)), [path])
+                                                         for path in corpusPaths]:
+        baseDir = os.path.dirname(os.path.abspath(paths[0]))
+        corpora[name] = [(os.path.relpath(filePath, baseDir), api._read_from_file(filePath))
+                         for filePath in collect_files(paths)]
+    return corpora
+
+
+class StageTimer:
+    '''
+    Record the duration of every call to patched functions, by stage.
+    '''
+    def __init__(self):
+        self.durations = collections.defaultdict(list)
+
+    @contextlib.contextmanager
+    def patch(self, owner, attrName, stage, onResult=None):
+        original = getattr(owner, attrName)
+
+        def timed(*args, **kwargs):
+            startTime = time.perf_counter()
+            try:
+                result = original(*args, **kwargs)
+            finally:
+                self.durations[stage].append(time.perf_counter() - startTime)
+            if onResult is not None:
+                onResult(result)
+            return result
+
+        setattr(owner, attrName, timed)
+        try:
+            yield
+        finally:
+            setattr(owner, attrName, original)
+
+
+def time_stages(scripts):
+    '''
+    Format scripts with one Formatter(), timing each stage.
+
+    Return: tuple
+        (StageTimer() object, number of queries, number of errors, query cache info).
+    '''
+    from yapf.yapflib import yapf_api
+    from sparksqlformatter import api as sparksqlformatter_api
+    formatter = Formatter()
+    timer = StageTimer()
+    queryCounts = []
+    errorCount = 0
+    countQueries = lambda tokens: queryCounts.append(len(tokens))
+    with timer.patch(formatter.tokenizer, 'tokenize', 'tokenize', onResult=countQueries), \
+            timer.patch(sparksqlformatter_api, 'format_query', 'format_query'), \
+            timer.patch(yapf_api, 'FormatCode', 'yapf'):
+        for _, script in scripts:
+            try:
+                formatter.format(script)
+            except Exception:
+                errorCount += 1
+            yapfDurations = timer.durations.pop('yapf', [])
+            timer.durations['yapf_first_pass'].extend(yapfDurations[:1])
+            timer.durations['yapf_second_pass'].extend(yapfDurations[1:])
+    return timer, sum(queryCounts), errorCount, formatter.query_cache_info()
+
+
+def time_format_file(filePaths):
+    '''
+    Format files end-to-end with api.format_file(), discarding the output.
+
+    Return: tuple
+        (list of durations, peak memory in bytes allocated while formatting the largest file).
+    '''
+    durations = []
+    peakSize = None
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        for filePath in filePaths:
+            startTime = time.perf_counter()
+            try:
+                api.format_file(filePath)
+            except Exception:
+                pass
+            durations.append(time.perf_counter() - startTime)
+            sys.stdout = io.StringIO()
+        if filePaths:  # separately, since tracemalloc slows formatting down
+            tracemalloc.start()
+            try:
+                api.format_file(max(filePaths, key=os.path.getsize))
+            except Exception:
+                pass
+            peakSize = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        sys.stdout = stdout
+    return durations, peakSize
+
+
+def summarize(durations):
+    '''
+    Return: dict
+        Number of calls and total, mean, median, 95th percentile and maximum duration in seconds.
+    '''
+    if not durations:
+        return {'calls': 0, 'total': 0.0}
+    durations = sorted(durations)
+    callCount = len(durations)
+    return {
+        'calls': callCount,
+        'total': sum(durations),
+        'mean': sum(durations) / callCount,
+        'p50': durations[callCount // 2],
+        'p95': durations[min(callCount - 1, int(callCount * 0.95))],
+        'max': durations[-1]
+    }
+
+
+def run_corpus(scripts):
+    tempDir = tempfile.mkdtemp()
+    try:
+        filePaths = []
+        for i, (_, script) in enumerate(scripts):
+            filePath = os.path.join(tempDir, 'script{}.py'.format(i))
+            with io.open(filePath, mode='w', newline='\n', encoding='utf-8') as f:
+                f.write(script)
+            filePaths.append(filePath)
+        timer, queryCount, errorCount, queryCacheInfo = time_stages(scripts)
+        fileDurations, peakSize = time_format_file(filePaths)
+    finally:
+        shutil.rmtree(tempDir)
+    timer.durations['format_file'] = fileDurations
+    byteCount = sum(len(script.encode('utf-8')) for _, script in scripts)
+    fileTime = sum(fileDurations)
+    return {
+        'files': len(scripts),
+        'bytes': byteCount,
+        'lines': sum(script.count('\n') for _, script in scripts),
+        'queries': queryCount,
+        'errors': errorCount,
+        'queryCacheHits': queryCacheInfo.hits,
+        'stages': dict((stage, summarize(timer.durations[stage])) for stage in STAGES),
+        'filesPerSecond': len(scripts) / fileTime if fileTime else None,
+        'bytesPerSecond': byteCount / fileTime if fileTime else None,
+        'peakMemory': peakSize
+    }
+
+
+def get_environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR,
+                                         stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import yapf
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'yapf': yapf.__version__,
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+
+
+def get_max_rss():
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxRss if sys.platform == 'darwin' else maxRss * 1024  # bytes on macOS, kilobytes on Linux
+
+
+def print_report(results, baseline=None):
+    '''
+    Print a table of the results to stderr, with the ratio of each total time to that in baseline if given.
+    '''
+    lines = []
+    for corpusName, corpusResult in results['corpora'].items():
+        lines.append(
+            '{} ({files} files, {bytes} bytes, {queries} queries, {errors} errors, peak {memory:.1f} MB)'.format(
+                corpusName, memory=(corpusResult['peakMemory'] or 0) / 1024 / 1024, **corpusResult))
+        for stage in STAGES:
+            stats = corpusResult['stages'][stage]
+            line = '  {:<18} {:>7} calls {:>10.4f} s total'.format(stage, stats['calls'], stats['total'])
+            if stats['calls']:
+                line += ' {:>9.3f} ms mean {:>9.3f} ms p95'.format(stats['mean'] * 1000, stats['p95'] * 1000)
+            if baseline is not None:
+                baselineStats = baseline['corpora'].get(corpusName, {}).get('stages', {}).get(stage)
+                if baselineStats and baselineStats['total']:
+                    line += ' {:>6.2f}x baseline'.format(stats['total'] / baselineStats['total'])
+            lines.append(line)
+    sys.stderr.write('\n'.join(lines) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the stages of formatting over several corpora.')
+    parser.add_argument('--output', type=str, default=None, help='File to write the JSON results to. Default: stdout.')
+    parser.add_argument('--compare', type=str, default=None, help='JSON results of a previous run to compare with.')
+    parser.add_argument('--corpus', type=str, nargs='+', default=[], help='Directories or files of real scripts.')
+    parser.add_argument('--only',
+                        type=str,
+                        nargs='+',
+                        default=None,
+                        help='Names of the corpora to run, with or without the synthetic- prefix.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic corpora.')
+    args = parser.parse_args()
+
+    corpora = load_corpora(args.corpus, args.seed)
+    if args.only:
+        onlyNames = set(name if name in corpora else 'synthetic-' + name for name in args.only)
+        unknownNames = [name for name in args.only if name not in corpora and 'synthetic-' + name not in corpora]
+        if unknownNames:
+            parser.error('argument --only: unknown corpora {} (choose from {})'.format(
+                ', '.join(unknownNames), ', '.join(corpora)))
+    results = {'version': RESULT_FORMAT_VERSION, 'environment': get_environment(), 'corpora': collections.OrderedDict()}
+    for corpusName, scripts in corpora.items():
+        if args.only and corpusName not in onlyNames:
+            continue
+        sys.stderr.write('Running ' + corpusName + '...\n')
+        results['corpora'][corpusName] = run_corpus(scripts)
+    results['maxRss'] = get_max_rss()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -31,43 +31,216 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from pysqlformatter.src import api
 from pysqlformatter.src.formatter import Formatter
+from pysqlformatter.src.cache import ResultCache, DEFAULT_MAX_SIZE, get_settings_fingerprint
+from pysqlformatter.src.files import collect_files, get_git_changed_files
+from pysqlformatter.src.manifest import Manifest, DEFAULT_MANIFEST_PATH
+from pysqlformatter.src.segments import SEGMENT_LINES
+from pysqlformatter.src.stats import STAGES, get_slowest
 
 logger = logging.getLogger(__name__)
 log_formatter = '[%(asctime)s] %(levelname)s [%(filename)s:%(lineno)s:%(funcName)s] %(message)s'
-logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=log_formatter)
 
 
 def main(argv):
+    configure_logging()
     args = get_arguments(argv)
     pythonStyle = args['python_style']
     sparksqlStyle = args['sparksql_style']
     filePaths = args['files']
     queryNames = args['query_names']
-    if filePaths:
-        if sparksqlStyle:
-            if pythonStyle:
-                for filePath in filePaths:
-                    api.format_file(filePath=filePath,
-                                    pythonStyle=pythonStyle,
-                                    sparksqlStyle=sparksqlStyle,
-                                    queryNames=queryNames,
-                                    inPlace=args.get('in_place'))
-            else:
-                for filePath in filePaths:
-                    api.format_file(filePath=filePath,
-                                    sparksqlStyle=sparksqlStyle,
-                                    queryNames=queryNames,
-                                    inPlace=args.get('in_place'))
-        else:
-            if pythonStyle:
-                for filePath in filePaths:
-                    api.format_file(filePath=filePath,
-                                    pythonStyle=pythonStyle,
-                                    queryNames=queryNames,
-                                    inPlace=args.get('in_place'))
-            else:
-                for filePath in filePaths:
-                    api.format_file(filePath=filePath, queryNames=queryNames, inPlace=args.get('in_place'))
+    styles = {}  # only pass the styles given in command-line, so that api falls back to its defaults otherwise
+    if pythonStyle:
+        styles['pythonStyle'] = pythonStyle
+    elif args['sql_only']:
+        styles['pythonStyle'] = None  # yapf is not run
+    if sparksqlStyle:
+        styles['sparksqlStyle'] = sparksqlStyle
+    cache = None
+    if args['cache_dir']:
+        cache = ResultCache(cacheDir=args['cache_dir'], maxSize=args['cache_max_size'] * 1024 * 1024)
+    if args['daemon']:
+        from pysqlformatter.src import daemon  # Unix domain sockets are not available on all platforms
+        daemonOptions = {}
+        if args['idle_timeout'] is not None:
+            daemonOptions['idleTimeout'] = args['idle_timeout']
+        daemon.FormatterServer(socketPath=args['socket'], cache=cache, **daemonOptions).serve()
+    elif args['batch']:
+        errorCount = api.format_batch(inStream=sys.stdin.buffer,
+                                      outStream=sys.stdout.buffer,
+                                      queryNames=queryNames,
+                                      jobs=args.get('jobs'),
+                                      cache=cache,
+                                      reformatChangedLinesOnly=args['reformat_changed_lines_only'],
+                                      discovery=args['discovery'],
+                                      queryCallees=args['query_callees'],
+                                      **styles)
+        if errorCount:
+            return 1
+    elif filePaths:
+        filePaths = collect_files(filePaths, exclude=args['exclude'])
+        fileCount = len(filePaths)
+        if args['git_diff']:
+            try:
+                gitChangedFiles = get_git_changed_files(args['git_diff'])
+            except Exception as e:
+                logger.error(e)
+                return 1
+            filePaths = [
+                filePath for filePath in filePaths
+                if filePath == api.STDIN_PATH or os.path.realpath(filePath) in gitChangedFiles
+            ]
+        manifest = None
+        if args['changed_only']:
+            formatOptions = api._get_format_options(args['reformat_changed_lines_only'],
+                                                    args['discovery'],
+                                                    args['query_callees'],
+                                                    sqlOnly=args['sql_only'])
+            settingsFingerprint = get_settings_fingerprint(pythonStyle=styles.get('pythonStyle'),
+                                                           sparksqlStyle=styles.get('sparksqlStyle'),
+                                                           queryNames=queryNames,
+                                                           **formatOptions)
+            manifest = Manifest(manifestPath=args['manifest'], settingsFingerprint=settingsFingerprint)
+            filePaths = [filePath for filePath in filePaths if manifest.is_changed(filePath)]
+        if len(filePaths) < fileCount:
+            logger.info('Skipping ' + str(fileCount - len(filePaths)) + ' unchanged files...')
+        results = format_files(filePaths, styles, queryNames, cache, args)
+        if manifest is not None:
+            for result in results:
+                if result.error is None and result.filePath != api.STDIN_PATH and (args['in_place']
+                                                                                   or not result.changed):
+                    manifest.record(result.filePath)  # the file is formatted now
+            manifest.save()
+        if args['profile']:
+            print_profile(results, args['profile'])
+        return get_exit_status(results, args['check'])
+    return 0
+
+
+def format_files(filePaths, styles, queryNames, cache, args):
+    '''
+    Format files as specified by the command-line arguments.
+
+    Parameters
+    filePaths: list
+        Paths to the files to format.
+    styles: dict
+        The styles given in command-line.
+    queryNames: list
+        Strings used to identify variables that contain the SparkSQL queries.
+    cache: pysqlformatter.src.cache.ResultCache() object
+        Cache of formatted scripts, or None.
+    args: dict
+        Arguments returned by get_arguments().
+
+    Return: list
+        FormatResult tuples of the files, as returned by api.format_files().
+    '''
+    if args['client']:
+        from pysqlformatter.src import daemon
+        settings = dict(queryNames=queryNames,
+                        reformatChangedLinesOnly=args['reformat_changed_lines_only'],
+                        discovery=args['discovery'],
+                        queryCallees=args['query_callees'])
+        for styleName, style in styles.items():  # the daemon may run in another directory
+            settings[styleName] = os.path.abspath(style) if style and os.path.isfile(style) else style
+        try:
+            return daemon.format_files_with_daemon(filePaths=filePaths,
+                                                   socketPath=args['socket'],
+                                                   inPlace=args.get('in_place'),
+                                                   check=args['check'],
+                                                   diff=args['diff'],
+                                                   lines=args['lines'],
+                                                   **settings)
+        except OSError as e:
+            logger.warning('Cannot connect to daemon ({}), formatting in this process instead.'.format(e))
+    return api.format_files(filePaths=filePaths,
+                            queryNames=queryNames,
+                            inPlace=args.get('in_place'),
+                            jobs=args.get('jobs'),
+                            cache=cache,
+                            reformatChangedLinesOnly=args['reformat_changed_lines_only'],
+                            discovery=args['discovery'],
+                            queryCallees=args['query_callees'],
+                            check=args['check'],
+                            diff=args['diff'],
+                            profile=bool(args['profile']),
+                            lines=args['lines'],
+                            queryJobs=args['query_jobs'],
+                            segmentLines=args['segmented'],
+                            **styles)
+
+
+def print_profile(results, count):
+    '''
+    Write the slowest files, with the time spent in each stage, and the slowest queries to stderr.
+
+    Parameters
+    results: list
+        FormatResult tuples of the files, with stats.
+    count: int
+        Number of files and of queries to list.
+    '''
+    slowestFiles, slowestQueries = get_slowest([result.stats for result in results], count)
+    lines = ['Slowest files:']
+    for stats in slowestFiles:
+        stages = ', '.join('{} {:.3f}s'.format(stage, stats.stageTimes[stage]) for stage in STAGES
+                           if stage in stats.stageTimes)
+        note = 'result cache hit' if stats.resultCached else '{} queries'.format(stats.tokenCount)
+        lines.append('{:>9.3f}s  {} ({}; {})'.format(stats.totalTime, stats.filePath, note, stages))
+    lines.append('Slowest queries:')
+    for stats, query in slowestQueries:
+        lines.append('{:>9.3f}s  {}:{} (characters {}-{})'.format(query.duration, stats.filePath, query.line,
+                                                                  query.start, query.end))
+    sys.stderr.write('\n'.join(lines) + '\n')
+
+
+def get_exit_status(results, check):
+    '''
+    Return the exit status of formatting files.
+
+    Parameters
+    results: list
+        FormatResult tuples of the files.
+    check: bool
+        If True, the files were only checked.
+
+    Return: int
+        1 if a file could not be formatted, or if check and a file is not formatted. 0 otherwise.
+    '''
+    if any(result.error for result in results):
+        return 1
+    if check and any(result.changed for result in results):
+        return 1
+    return 0
+
+
+def configure_logging():
+    '''
+    Send log messages to stderr, so that stdout only carries formatted scripts. Called before sparksqlformatter is
+    imported, so that its own logging.basicConfig(stream=sys.stdout) has no effect.
+    '''
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format=log_formatter)
+
+
+def get_line_range(value):
+    '''
+    Parse a line range given in command-line.
+
+    Parameters
+    value: string
+        The range, as START-END, e.g., 10-20, with 1-based line numbers.
+
+    Return: tuple
+        (start, end).
+    '''
+    start, separator, end = value.partition('-')
+    try:
+        lineRange = (int(start), int(end))
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid line range: '{}', expected START-END".format(value))
+    if not separator or lineRange[0] < 1 or lineRange[0] > lineRange[1]:
+        raise argparse.ArgumentTypeError("invalid line range: '{}', expected 1 <= START <= END".format(value))
+    return lineRange
 
 
 def get_arguments(argv):
@@ -83,18 +256,158 @@ def get_arguments(argv):
     '''
     parser = argparse.ArgumentParser(
         description=
-        "Formatter for Pyspark code and SparkSQL queries. The queries should be in the form spark.sql(query) or spark.sql('xxx'). Cases like spark.sql('xxx'.format()), spark.sql('xxx'.replace()) may raise Exceptions."
+        "Formatter for Pyspark code and SparkSQL queries. The queries should be in the form spark.sql(query) or spark.sql('xxx'). Queries in spark.sql('xxx'.format()) are formatted too; queries built from several strings, e.g., spark.sql('xxx' + yyy), and f-strings are left as they are."
     )
 
-    parser.add_argument('-f', '--files', type=str, nargs='+', help='Paths to files to format.')
+    parser.add_argument(
+        '-f',
+        '--files',
+        type=str,
+        nargs='+',
+        help=
+        "Paths to files and directories to format. Directories are searched recursively for .py files. Use '-' to format stdin to stdout."
+    )
+
+    parser.add_argument(
+        '--exclude',
+        type=str,
+        default=[],
+        nargs='+',
+        help=
+        "Glob patterns of files and directories to skip when walking directories given in --files, e.g., 'build' '*_pb2.py' 'tests/*'. Matched against names and paths relative to the walked directory. VCS, virtual environment and cache directories are always skipped."
+    )
+
+    parser.add_argument(
+        '--changed-only',
+        action='store_true',
+        help=
+        'Only format the files that are new or changed since they were last found formatted with the same settings, as recorded in --manifest. Requires --in-place, --check or --diff.'
+    )
+
+    parser.add_argument(
+        '--manifest',
+        type=str,
+        default=DEFAULT_MANIFEST_PATH,
+        help='Path of the manifest used by --changed-only. Default to {}.'.format(DEFAULT_MANIFEST_PATH))
 
-    parser.add_argument('-i', '--in-place', action='store_true', help='Format the files in place.')
+    parser.add_argument(
+        '--git-diff',
+        type=str,
+        default=None,
+        metavar='REF',
+        help=
+        'Only format the files that differ from git revision REF, e.g., origin/master, including untracked files that are not ignored.'
+    )
+
+    parser.add_argument(
+        '--lines',
+        type=get_line_range,
+        action='append',
+        default=None,
+        metavar='START-END',
+        help=
+        'Only format the lines from START to END, 1-based and inclusive, and the queries overlapping them, leaving the rest of the file as it is, e.g., to format the selection in an editor. Can be given several times. Requires a single file in -f/--files.'
+    )
+
+    parser.add_argument('-i',
+                        '--in-place',
+                        action='store_true',
+                        help='Format the files in place. Files that are already formatted are not written.')
+
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help=
+        'Do not write the files; list those that are not formatted and exit with status 1 if there is any. With --diff, show their diffs instead of listing them.'
+    )
+
+    parser.add_argument('--diff',
+                        action='store_true',
+                        help='Do not write the files; write unified diffs of the changes to stdout instead.')
+
+    parser.add_argument(
+        '--batch',
+        action='store_true',
+        help=
+        'Read NUL-delimited scripts from stdin and write each formatted script followed by NUL to stdout as soon as it is formatted. Scripts that cannot be formatted are written back unchanged.'
+    )
+
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help=
+        'Run as a daemon formatting the scripts sent by --client over a Unix domain socket, keeping yapf, sparksqlformatter and the formatters loaded between requests.'
+    )
+
+    parser.add_argument(
+        '--client',
+        action='store_true',
+        help=
+        'Format the files with the daemon started by --daemon. If no daemon is running, format them in this process.')
+
+    parser.add_argument(
+        '--socket',
+        type=str,
+        default=None,
+        help=
+        'Path of the Unix domain socket of the daemon. Default to pysqlformatter.sock in $XDG_RUNTIME_DIR, or in pysqlformatter-<uid> in the temporary directory.'
+    )
+
+    parser.add_argument(
+        '--idle-timeout',
+        type=float,
+        default=None,
+        help='Seconds without requests after which the daemon exits. Use 0 to never exit. Default to 600.')
+
+    parser.add_argument(
+        '--profile',
+        type=int,
+        nargs='?',
+        const=10,
+        default=None,
+        metavar='N',
+        help=
+        'After formatting the files, write to stderr the N slowest files with the time spent in each stage, and the N slowest queries with their lines in the script as formatted by yapf. Default to 10.'
+    )
+
+    parser.add_argument(
+        '--segmented',
+        type=int,
+        nargs='?',
+        const=SEGMENT_LINES,
+        default=None,
+        metavar='N',
+        help=
+        'Format each file one segment of whole top-level statements of about N lines at a time, writing each segment as soon as it is formatted, so that memory use does not grow with the size of the file, e.g., for generated files of hundreds of megabytes. Default to {}.'
+        .format(SEGMENT_LINES))
+
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of worker processes to format the files with. Use 0 for one per CPU. Default to 1.')
+
+    parser.add_argument(
+        '--query-jobs',
+        type=int,
+        default=1,
+        help=
+        'Number of worker processes to format the queries of each file with, for files with thousands of queries. Use 0 for one per CPU. Only used if --jobs is 1. Default to 1.'
+    )
 
     parser.add_argument('--python-style',
                         type=str,
                         default=None,
                         help='Style for Python formatting, interface to https://github.com/google/yapf.')
 
+    parser.add_argument(
+        '--sql-only',
+        action='store_true',
+        help=
+        'Only format the queries, leaving the rest of the code exactly as it is, without running yapf, e.g., for code formatted by another tool such as black. Much faster.'
+    )
+
     parser.add_argument(
         '--sparksql-style',
         type=str,
@@ -109,13 +422,81 @@ def get_arguments(argv):
         help="String variables with names containing these strings will be formatted as SQL queries. Default to 'query'."
     )
 
+    parser.add_argument(
+        '--discovery',
+        type=str,
+        default='scan',
+        choices=['scan', 'ast'],
+        help=
+        "How queries are found: 'scan' scans the text for strings assigned to query names or passed to spark.sql(); 'ast' parses the script and also finds queries passed to --query-callees on any object, e.g., self.spark.sql(), and in keyword arguments. Scripts that cannot be parsed, and all scripts before Python 3.8, are scanned instead. Default to 'scan'."
+    )
+
+    parser.add_argument(
+        '--query-callees',
+        type=str,
+        default=['spark.sql'],
+        nargs='+',
+        help=
+        "With --discovery ast, dotted names of the functions taking a query as first argument. Calls to functions whose dotted name ends with one of these are formatted, e.g., 'sql' for any method named sql(). Default to 'spark.sql'."
+    )
+
+    parser.add_argument(
+        '--reformat-changed-lines-only',
+        action='store_true',
+        help=
+        "After formatting the queries, only run yapf again over the lines of the queries that changed instead of the whole script. Faster, and gives the same result except where yapf's own output is not stable under another yapf run."
+    )
+
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default=None,
+        help=
+        'Directory of the result cache, e.g., ~/.cache/pysqlformatter. Files whose content and styles are unchanged since they were last formatted are read from the cache instead of being formatted again. Default to no cache.'
+    )
+
+    parser.add_argument(
+        '--cache-max-size',
+        type=int,
+        default=DEFAULT_MAX_SIZE // (1024 * 1024),
+        help=
+        'Maximum size of the result cache in megabytes. Least-recently-used entries are evicted first. Default to {}.'.
+        format(DEFAULT_MAX_SIZE // (1024 * 1024)))
+
     args = vars(parser.parse_args(argv[1:]))
+    if args['batch'] and args['files']:
+        parser.error('argument --batch: not allowed with argument -f/--files')
+    if args['batch'] and (args['in_place'] or args['check'] or args['diff'] or args['client'] or args['git_diff']):
+        parser.error(
+            'argument --batch: not allowed with arguments -i/--in-place, --check, --diff, --client or --git-diff')
+    if args['in_place'] and (args['check'] or args['diff']):
+        parser.error('argument -i/--in-place: not allowed with arguments --check or --diff')
+    if args['changed_only'] and not (args['in_place'] or args['check'] or args['diff']):
+        parser.error('argument --changed-only: requires -i/--in-place, --check or --diff')
+    if args['daemon'] and (args['files'] or args['batch'] or args['client']):
+        parser.error('argument --daemon: not allowed with arguments -f/--files, --batch or --client')
+    if args['profile'] is not None and not args['files']:
+        parser.error('argument --profile: requires -f/--files')
+    if args['lines'] and (not args['files'] or len(args['files']) != 1 or os.path.isdir(args['files'][0])):
+        parser.error('argument --lines: requires a single file in -f/--files')
+    if args['sql_only'] and args['python_style']:
+        parser.error('argument --sql-only: not allowed with argument --python-style')
+    if args['lines'] and args['changed_only']:
+        parser.error('argument --lines: not allowed with argument --changed-only')
+    if args['profile'] is not None and args['client']:
+        parser.error('argument --profile: not allowed with argument --client')
+    if args['segmented'] is not None and not args['files']:
+        parser.error('argument --segmented: requires -f/--files')
+    if args['segmented'] is not None and (args['lines'] or args['diff'] or args['client']):
+        parser.error('argument --segmented: not allowed with arguments --lines, --diff or --client')
+    if args['segmented'] is not None and args['segmented'] < 1:
+        parser.error('argument --segmented: N must be at least 1')
 
     return args
 
 
 def run_main():
-    main(sys.argv)
+    sys.exit(main(sys.argv))
 
 
 if __name__ == '__main__':
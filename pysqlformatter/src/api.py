@@ -1,59 +1,280 @@
 # from __future__ import print_function  # for print() in Python 2
 from io import open
+import io
+import os
 import sys
 import re
+import shutil
 import logging
+import tempfile
+import collections
 
 from pysqlformatter.src.formatter import Formatter
-from sparksqlformatter import Style as sparksqlStyle
-from sparksqlformatter import api as sparksqlAPI
+from pysqlformatter.src.segments import SEGMENT_LINES
+from pysqlformatter.src.stats import FormatStats, NO_STATS
+from pysqlformatter.src.styles import STYLE_REGISTRY
 
 logger = logging.getLogger(__name__)
-log_formatter = '[%(asctime)s] %(levelname)s [%(filePath)s:%(lineno)s:%(funcName)s] %(message)s'
-logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=log_formatter)
 
+STDIN_PATH = '-'  # file path standing for stdin, formatted to stdout
+BATCH_DELIMITER = b'\0'  # separates the scripts in format_batch(); cannot occur in Python source
+BATCH_READ_SIZE = 64 * 1024  # maximum number of bytes read from the input of format_batch() at once
 
-def format_file(filePath, pythonStyle='pep8', sparksqlStyle=sparksqlStyle(), queryNames=['query'], inPlace=False):
+FormatResult = collections.namedtuple('FormatResult',
+                                      ['filePath', 'formattedScript', 'error', 'changed', 'diff', 'stats'])
+FormatResult.__new__.__defaults__ = (None, )  # stats is only set when profiling; namedtuple(defaults=) needs 3.7+
+
+_workerFormatter = None  # Formatter() object built once per worker process by _init_worker()
+_workerCache = None  # ResultCache() object of the worker process
+
+
+def format_file(filePath,
+                pythonStyle='pep8',
+                sparksqlStyle=None,
+                queryNames=['query'],
+                inPlace=False,
+                cache=None,
+                reformatChangedLinesOnly=False,
+                discovery='scan',
+                queryCallees=['spark.sql'],
+                lines=None,
+                queryJobs=1):
     '''
     Format file with given settings for python style and sparksql configurations.
 
     Parameters
     filePath: string
-        Path to the file to format.
+        Path to the file to format. If STDIN_PATH, the script is read from stdin and written to stdout.
     pythonStyle: string
         A style name or path to a style config file; interface to https://github.com/google/yapf.
     sparksqlStyle: string, dict, or sparksqlformatter.src.style.Style() object
-        Configurations for the query language; interface to https://github.com/largecats/sparksql-formatter.
+        Configurations for the query language; interface to https://github.com/largecats/sparksql-formatter. If None,
+        use the default Style().
     queryNames: list
 
     inPlace: bool
         If True, will format the file in place.
         Else, will write the formatted file to stdout.
+    cache: pysqlformatter.src.cache.ResultCache() object
+        If given, look up the formatted file in the cache before formatting it, and store it there afterwards.
+    reformatChangedLinesOnly: bool
+        If True, only run yapf again over the lines of the queries that changed; see Formatter().
+    discovery: string
+        How queries are found: 'scan' or 'ast'; see Formatter().
+    queryCallees: list
+        Dotted names of the functions taking a query as first argument, if discovery is 'ast'; see Formatter().
+    lines: list
+        1-based (first, last) line ranges to format, leaving the rest of the file as it is; see Formatter.format().
+        If None, format the whole file.
+    queryJobs: int
+        Number of worker processes to format the queries of the file with; see Formatter().
 
     Return: None
     '''
-    if type(sparksqlStyle) == type(sparksqlStyle):
-        formatter = Formatter(pythonStyle=pythonStyle, sparksqlStyle=sparksqlStyle)
+    formatter = _create_formatter(pythonStyle=pythonStyle,
+                                  sparksqlStyle=sparksqlStyle,
+                                  queryNames=queryNames,
+                                  reformatChangedLinesOnly=reformatChangedLinesOnly,
+                                  discovery=discovery,
+                                  queryCallees=queryCallees,
+                                  queryJobs=queryJobs)
+    _format_file(filePath, formatter, inPlace, cache, lines)
+
+
+def format_files(filePaths,
+                 pythonStyle='pep8',
+                 sparksqlStyle=None,
+                 queryNames=['query'],
+                 inPlace=False,
+                 jobs=1,
+                 cache=None,
+                 reformatChangedLinesOnly=False,
+                 discovery='scan',
+                 queryCallees=['spark.sql'],
+                 check=False,
+                 diff=False,
+                 profile=False,
+                 lines=None,
+                 queryJobs=1,
+                 segmentLines=None):
+    '''
+    Format files with given settings for python style and sparksql configurations, spreading them over a pool of worker
+    processes. Each worker builds its Formatter() object once and reuses it for all the files it is given.
+
+    Parameters
+    filePaths: list
+        Paths to the files to format. STDIN_PATH stands for stdin, which is formatted to stdout.
+    pythonStyle: string
+        A style name or path to a style config file; interface to https://github.com/google/yapf.
+    sparksqlStyle: string, dict, or sparksqlformatter.src.style.Style() object
+        Configurations for the query language; interface to https://github.com/largecats/sparksql-formatter. If None,
+        use the default Style().
+    queryNames: list
+        Strings used to identify variables that contain the SparkSQL queries.
+    inPlace: bool
+        If True, will format the files in place, leaving files that are already formatted untouched.
+        Else, will write the formatted files to stdout, in the order of filePaths.
+    jobs: int
+        Number of worker processes. If 1, format the files in the current process. If None or less than 1, use one
+        worker per CPU.
+    cache: pysqlformatter.src.cache.ResultCache() object
+        If given, look up the formatted files in the cache before formatting them, and store them there afterwards.
+    reformatChangedLinesOnly: bool
+        If True, only run yapf again over the lines of the queries that changed; see Formatter().
+    discovery: string
+        How queries are found: 'scan' or 'ast'; see Formatter().
+    queryCallees: list
+        Dotted names of the functions taking a query as first argument, if discovery is 'ast'; see Formatter().
+    check: bool
+        If True, do not write the files; write the paths of those that are not formatted to stdout instead.
+    diff: bool
+        If True, do not write the files; write unified diffs of the changes to stdout instead, in place of the paths
+        if check is also True.
+    profile: bool
+        If True, time the stages of formatting each file and each of its queries; see pysqlformatter.src.stats.
+    lines: list
+        1-based (first, last) line ranges to format, leaving the rest of the files as it is; see Formatter.format().
+        If None, format the whole files.
+    queryJobs: int
+        Number of worker processes to format the queries of each file with; see Formatter(). Only used if the files
+        are formatted in the current process, i.e., jobs is 1, since worker processes cannot start processes.
+    segmentLines: int
+        If given, format each file one segment of whole top-level statements of about segmentLines lines at a time,
+        writing each formatted segment to the file, which is replaced at the end, or to stdout as soon as it is
+        formatted, so that memory use is bounded by the largest segment instead of the file; see
+        Formatter.format_segments(). The formatted scripts are then not returned, cache is not used, and lines and
+        diff must not be given. Files written to stdout are formatted in the current process, in order.
+
+    Return: list
+        FormatResult(filePath, formattedScript, error, changed, diff, stats) tuples in the order of filePaths. error is
+        None if the file was formatted successfully, else a description of the exception raised; formattedScript and
+        changed are None in that case. changed tells whether the formatted file differs from the file. diff is the
+        unified diff of the change if diff is True, else None. stats is the FormatStats() object of the file if
+        profile is True, else None. formattedScript is None if segmentLines is given.
+    '''
+    if segmentLines and (diff or lines is not None):  # the whole file is never held, so neither can be computed
+        raise Exception('segmentLines is not supported with diff or lines')
+    filePaths = list(filePaths)
+    if jobs is None or jobs < 1:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(filePaths))
+    if STDIN_PATH in filePaths:  # worker processes cannot read the stdin of the main process
+        jobs = 1
+    if segmentLines and not (inPlace or check):  # segments written to stdout by workers would interleave
+        jobs = 1
+    results = []
+    if jobs <= 1:
+        formatter = _create_formatter(pythonStyle=pythonStyle,
+                                      sparksqlStyle=sparksqlStyle,
+                                      queryNames=queryNames,
+                                      reformatChangedLinesOnly=reformatChangedLinesOnly,
+                                      discovery=discovery,
+                                      queryCallees=queryCallees,
+                                      queryJobs=queryJobs)
+        for filePath in filePaths:
+            result = _format_file_safely(filePath, formatter, inPlace, cache, check, diff, profile, lines, segmentLines)
+            results.append(_collect_result(result, inPlace, check, diff))
     else:
-        if type(sparksqlStyle) == str:
-            if sparksqlStyle.startswith('{'):
-                sparksqlStyle = eval(sparksqlStyle)
-                formatter = Formatter(pythonStyle=pythonStyle,
-                                      sparksqlStyle=sparksqlAPI._create_style_from_dict(sparksqlStyle),
-                                      queryNames=queryNames)
-            else:
-                formatter = Formatter(pythonStyle=pythonStyle,
-                                      sparksqlStyle=sparksqlAPI._create_style_from_file(sparksqlStyle))
-        elif type(sparksqlStyle) == dict:
-            formatter = Formatter(pythonStyle=pythonStyle,
-                                  sparksqlStyle=sparksqlAPI._create_style_from_dict(sparksqlStyle),
-                                  queryNames=queryNames)
-        else:
-            raise Exception('Unsupported config type')
-    _format_file(filePath, formatter, inPlace)
+        chunkSize = max(1, len(filePaths) // (jobs * 4))  # small chunks keep workers balanced on skewed file sizes
+        workerArgs = [(filePath, inPlace, check, diff, profile, lines, segmentLines) for filePath in filePaths]
+        sparksqlStyle = STYLE_REGISTRY.get_sparksql_style(sparksqlStyle)  # resolved once, and sent to every worker
+        import multiprocessing  # only needed, and imported, when formatting in worker processes
+        with multiprocessing.Pool(processes=jobs,
+                                  initializer=_init_worker,
+                                  initargs=(pythonStyle, sparksqlStyle, queryNames, cache, reformatChangedLinesOnly,
+                                            discovery, queryCallees)) as pool:
+            for result in pool.imap(_format_file_in_worker, workerArgs, chunkSize):  # imap preserves input order
+                results.append(_collect_result(result, inPlace, check, diff))
+    return results
+
+
+def format_batch(inStream,
+                 outStream,
+                 pythonStyle='pep8',
+                 sparksqlStyle=None,
+                 queryNames=['query'],
+                 jobs=1,
+                 cache=None,
+                 reformatChangedLinesOnly=False,
+                 discovery='scan',
+                 queryCallees=['spark.sql']):
+    '''
+    Format scripts separated by BATCH_DELIMITER read from inStream, writing each formatted script followed by
+    BATCH_DELIMITER to outStream. Scripts are formatted as soon as they are read, and each result is written and flushed
+    as soon as it and all results before it are ready, so that a client can send scripts one at a time over a pipe to a
+    single long-running process.
+
+    Parameters
+    inStream: binary file object
+        Stream of UTF-8 encoded scripts, e.g., sys.stdin.buffer.
+    outStream: binary file object
+        Stream to write the UTF-8 encoded formatted scripts to, e.g., sys.stdout.buffer.
+    pythonStyle: string
+        A style name or path to a style config file; interface to https://github.com/google/yapf.
+    sparksqlStyle: string, dict, or sparksqlformatter.src.style.Style() object
+        Configurations for the query language; interface to https://github.com/largecats/sparksql-formatter. If None,
+        use the default Style().
+    queryNames: list
+        Strings used to identify variables that contain the SparkSQL queries.
+    jobs: int
+        Number of worker processes. If 1, format the scripts in the current process. If None or less than 1, use one
+        worker per CPU.
+    cache: pysqlformatter.src.cache.ResultCache() object
+        If given, look up the formatted scripts in the cache before formatting them, and store them there afterwards.
+    reformatChangedLinesOnly: bool
+        If True, only run yapf again over the lines of the queries that changed; see Formatter().
+    discovery: string
+        How queries are found: 'scan' or 'ast'; see Formatter().
+    queryCallees: list
+        Dotted names of the functions taking a query as first argument, if discovery is 'ast'; see Formatter().
+
+    Return: int
+        Number of scripts that could not be formatted. These are logged and written back unchanged.
+    '''
+    if jobs is None or jobs < 1:
+        jobs = os.cpu_count() or 1
+    pendingScripts = collections.deque()  # scripts read but not yet written, to write back those that fail
 
+    def read_scripts():
+        for script in _read_batch(inStream):
+            pendingScripts.append(script)
+            yield script
 
-def format_script(script, pythonStyle='pep8', sparksqlStyle=sparksqlStyle(), queryNames=['query']):
+    errorCount = 0
+    if jobs <= 1:
+        formatter = _create_formatter(pythonStyle=pythonStyle,
+                                      sparksqlStyle=sparksqlStyle,
+                                      queryNames=queryNames,
+                                      reformatChangedLinesOnly=reformatChangedLinesOnly,
+                                      discovery=discovery,
+                                      queryCallees=queryCallees)
+        results = (_format_script_safely(script, formatter, cache) for script in read_scripts())
+        for scriptIndex, result in enumerate(results):
+            errorCount += _write_batch_result(result, pendingScripts.popleft(), scriptIndex, outStream)
+    else:
+        sparksqlStyle = STYLE_REGISTRY.get_sparksql_style(sparksqlStyle)  # resolved once, and sent to every worker
+        import multiprocessing  # only needed, and imported, when formatting in worker processes
+        with multiprocessing.Pool(processes=jobs,
+                                  initializer=_init_worker,
+                                  initargs=(pythonStyle, sparksqlStyle, queryNames, cache, reformatChangedLinesOnly,
+                                            discovery, queryCallees)) as pool:
+            results = pool.imap(_format_script_in_worker, read_scripts())  # imap preserves input order
+            for scriptIndex, result in enumerate(results):
+                errorCount += _write_batch_result(result, pendingScripts.popleft(), scriptIndex, outStream)
+    return errorCount
+
+
+def format_script(script,
+                  pythonStyle='pep8',
+                  sparksqlStyle=None,
+                  queryNames=['query'],
+                  cache=None,
+                  reformatChangedLinesOnly=False,
+                  discovery='scan',
+                  queryCallees=['spark.sql'],
+                  stats=None,
+                  lines=None,
+                  queryJobs=1):
     '''
     Format script using given settings for python style and sparksql configurations.
 
@@ -63,34 +284,38 @@ def format_script(script, pythonStyle='pep8', sparksqlStyle=sparksqlStyle(), que
     pythonStyle: string
         A style name or path to a style config file; interface to https://github.com/google/yapf.
     sparksqlStyle: string, dict, or sparksqlformatter.src.style.Style() object
-        Configurations for the query language; interface to https://github.com/largecats/sparksql-formatter.
+        Configurations for the query language; interface to https://github.com/largecats/sparksql-formatter. If None,
+        use the default Style().
+    cache: pysqlformatter.src.cache.ResultCache() object
+        If given, look up the formatted script in the cache before formatting it, and store it there afterwards.
+    reformatChangedLinesOnly: bool
+        If True, only run yapf again over the lines of the queries that changed; see Formatter().
+    discovery: string
+        How queries are found: 'scan' or 'ast'; see Formatter().
+    queryCallees: list
+        Dotted names of the functions taking a query as first argument, if discovery is 'ast'; see Formatter().
+    stats: pysqlformatter.src.stats.FormatStats() object
+        If given, record the timings of formatting the script in it; see Formatter.format().
+    lines: list
+        1-based (first, last) line ranges to format, leaving the rest of the script as it is; see Formatter.format().
+        If None, format the whole script.
+    queryJobs: int
+        Number of worker processes to format the queries of the script with; see Formatter().
     
     Return: string
         The formatted script.
     '''
-    if type(sparksqlStyle) == type(sparksqlStyle):
-        formatter = Formatter(pythonStyle=pythonStyle, sparksqlStyle=sparksqlStyle, queryNames=queryNames)
-    else:
-        if type(sparksqlStyle) == str:
-            if sparksqlStyle.startswith('{'):
-                sparksqlStyle = eval(sparksqlStyle)
-                formatter = Formatter(pythonStyle=pythonStyle,
-                                      sparksqlStyle=sparksqlAPI._create_style_from_dict(sparksqlStyle),
-                                      queryNames=queryNames)
-            else:
-                formatter = Formatter(pythonStyle=pythonStyle,
-                                      sparksqlStyle=sparksqlAPI._create_style_from_file(sparksqlStyle),
-                                      queryNames=queryNames)
-        elif type(sparksqlStyle) == dict:
-            formatter = Formatter(pythonStyle=pythonStyle,
-                                  sparksqlStyle=sparksqlAPI._create_style_from_dict(sparksqlStyle),
-                                  queryNames=queryNames)
-        else:
-            raise Exception('Unsupported config type')
-    return _format_script(script, formatter)
+    formatter = _create_formatter(pythonStyle=pythonStyle,
+                                  sparksqlStyle=sparksqlStyle,
+                                  queryNames=queryNames,
+                                  reformatChangedLinesOnly=reformatChangedLinesOnly,
+                                  discovery=discovery,
+                                  queryCallees=queryCallees,
+                                  queryJobs=queryJobs)
+    return _format_script(script, formatter, cache, stats, lines)
 
 
-def _format_file(filePath, formatter, inPlace=False):
+def _format_file(filePath, formatter, inPlace=False, cache=None, lines=None):
     '''
     The I/O helper function for format_file(). Read from given file, format it, and write to specified output.
 
@@ -100,31 +325,99 @@ def _format_file(filePath, formatter, inPlace=False):
     formatter: pysqlformatter.src.formatter.Formatter() object
         Formatter.
     inPlace: bool
-        If True, will format the file in place.
+        If True, will format the file in place, unless it is already formatted.
         Else, will write the formatted file to stdout.
+    cache: pysqlformatter.src.cache.ResultCache() object
+        Cache of formatted scripts.
+    lines: list
+        1-based (first, last) line ranges to format, or None.
     
     Return: None
     '''
     script = _read_from_file(filePath)
-    formattedScript = _format_script(script, formatter)
-    if inPlace:  # overwrite file
-        logger.info('Writing to ' + filePath + '...')
-        _write_to_file(formattedScript, filePath)
+    formattedScript = _format_script(script, formatter, cache, lines=lines)
+    if inPlace and filePath != STDIN_PATH:  # overwrite file
+        if formattedScript != script:
+            logger.info('Writing to ' + filePath + '...')
+            _write_to_file(formattedScript, filePath)
     else:  # write to stdout
         sys.stdout.write(formattedScript)
 
 
+def _format_file_segmented(filePath, formatter, inPlace=False, check=False, segmentLines=SEGMENT_LINES, stats=None):
+    '''
+    Read given file line by line and format it one segment at a time, see Formatter.format_segments(), writing each
+    formatted segment as soon as it is formatted.
+
+    Parameters
+    filePath: string
+        Path to the file to format, or STDIN_PATH.
+    formatter: pysqlformatter.src.formatter.Formatter() object
+        Formatter.
+    inPlace: bool
+        If True, write the formatted segments to a temporary file that replaces the file if it changed. Else, write
+        them to stdout.
+    check: bool
+        If True, do not write the formatted segments, and stop at the first one that changed.
+    segmentLines: int
+        Number of lines after which a segment is cut.
+    stats: pysqlformatter.src.stats.FormatStats() object
+        If given, record the timings of formatting the segments in it.
+
+    Return: bool
+        True if the formatted file differs from the file.
+    '''
+    formattedSegments = formatter.format_segments(_read_lines_from_file(filePath), segmentLines, stats)
+    if check:
+        return any(formattedSegment != segment for segment, formattedSegment in formattedSegments)
+    if inPlace and filePath != STDIN_PATH:
+        return _write_segments_to_file(formattedSegments, filePath)
+    changed = False
+    for segment, formattedSegment in formattedSegments:
+        sys.stdout.write(formattedSegment)
+        changed = changed or formattedSegment != segment
+    return changed
+
+
+def _read_lines_from_file(filePath):
+    '''
+    The input helper function for _format_file_segmented(). Read from given file line by line, as _read_from_file()
+    reads it whole.
+
+    Parameters
+    filePath: string
+        Path to the file to format, or STDIN_PATH to read from stdin.
+
+    Return: generator
+        The lines of the file, with universal newlines.
+    '''
+    if filePath == STDIN_PATH:  # decode as for files, whatever the locale of the terminal
+        stdin = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline=None)
+        try:
+            for line in stdin:
+                yield line
+        finally:
+            stdin.detach()  # leave sys.stdin open
+        return
+    with open(file=filePath, mode='r', newline=None, encoding='utf-8') as f:
+        for line in f:
+            yield line
+
+
 def _read_from_file(filePath):
     '''
     The input helper function for _format_file(). Read from given file and return its content.
 
     Parameters
     filePath: string
-        Path to the file to format.
+        Path to the file to format, or STDIN_PATH to read from stdin.
     
     Return: string
         The file content.
     '''
+    if filePath == STDIN_PATH:  # decode as for files, whatever the locale of the terminal
+        text = sys.stdin.buffer.read().decode('utf-8')
+        return text.replace('\r\n', '\n').replace('\r', '\n')  # universal newlines, as newline=None below
     # see https://docs.python.org/3.5/library/functions.html#open
     with open(file=filePath, mode='r', newline=None, encoding='utf-8') as f:
         text = f.read()
@@ -133,7 +426,8 @@ def _read_from_file(filePath):
 
 def _write_to_file(formattedQuery, filePath):
     '''
-    The output helper function for _format_file(). Write formatted query to given file.
+    The output helper function for _format_file(). Write formatted query to given existing file atomically, so that
+    the file is never seen half-written, keeping its permissions.
 
     Parameters
     formattedQuery: string
@@ -141,12 +435,79 @@ def _write_to_file(formattedQuery, filePath):
     filePath: string
         Path to the file to write to.
     '''
-    # see https://docs.python.org/3.5/library/functions.html#open
-    with open(file=filePath, mode='w', newline='\n', encoding='utf-8') as f:
-        f.write(formattedQuery)
+    filePath = os.path.realpath(filePath)  # replace the target of a symbolic link, not the link
+    fd, tempPath = tempfile.mkstemp(dir=os.path.dirname(filePath), prefix='.' + os.path.basename(filePath) + '.')
+    try:
+        # see https://docs.python.org/3.5/library/functions.html#open
+        with open(file=fd, mode='w', newline='\n', encoding='utf-8') as f:
+            f.write(formattedQuery)
+        shutil.copymode(filePath, tempPath)
+        os.replace(tempPath, filePath)
+    except BaseException:
+        os.remove(tempPath)
+        raise
+
+
+def _write_segments_to_file(formattedSegments, filePath):
+    '''
+    The output helper function for _format_file_segmented(). Write formatted segments to a temporary file as they come,
+    and replace given existing file with it atomically if it changed, keeping its permissions, as _write_to_file().
+
+    Parameters
+    formattedSegments: iterable
+        (segment, formattedSegment) pairs of the file, in order.
+    filePath: string
+        Path to the file to write to.
+
+    Return: bool
+        True if the file changed.
+    '''
+    filePath = os.path.realpath(filePath)  # replace the target of a symbolic link, not the link
+    fd, tempPath = tempfile.mkstemp(dir=os.path.dirname(filePath), prefix='.' + os.path.basename(filePath) + '.')
+    try:
+        changed = False
+        with open(file=fd, mode='w', newline='\n', encoding='utf-8') as f:
+            for segment, formattedSegment in formattedSegments:
+                f.write(formattedSegment)
+                changed = changed or formattedSegment != segment
+        if changed:
+            logger.info('Writing to ' + filePath + '...')
+            shutil.copymode(filePath, tempPath)
+            os.replace(tempPath, filePath)
+        else:
+            os.remove(tempPath)
+    except BaseException:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        raise
+    return changed
 
 
-def _format_script(script, formatter):
+def _get_diff(script, formattedScript, filePath):
+    '''
+    Return the unified diff between a script and its formatted version.
+
+    Parameters
+    script: string
+        The script.
+    formattedScript: string
+        The formatted script.
+    filePath: string
+        Path to the file of the script, used as the file name in the diff.
+
+    Return: string
+        The diff, empty if the scripts are identical.
+    '''
+    import difflib
+    diffLines = []
+    for line in difflib.unified_diff(script.splitlines(True), formattedScript.splitlines(True), filePath, filePath):
+        if not line.endswith('\n'):  # last line of a script not ending with a newline
+            line += '\n\\ No newline at end of file\n'
+        diffLines.append(line)
+    return ''.join(diffLines)
+
+
+def _format_script(script, formatter, cache=None, stats=None, lines=None):
     '''
     The wrapper function for format_script(). Format a given script using given formatter.
 
@@ -155,8 +516,338 @@ def _format_script(script, formatter):
         The script to format.
     formatter: sparksqlformatter.src.formatter.Formatter() object
         Formatter.
+    cache: pysqlformatter.src.cache.ResultCache() object
+        If given, return the cached result on a hit without running the formatter, and store the result on a miss.
+    stats: pysqlformatter.src.stats.FormatStats() object
+        If given, record the timings of formatting the script in it; see Formatter.format().
+    lines: list
+        1-based (first, last) line ranges to format, or None to format the whole script.
     
     Return: string
         The formatted script.
     '''
-    return formatter.format(script)
+    if cache is None:
+        return formatter.format(script, stats, lines)
+    options = _get_format_options(formatter.reformatChangedLinesOnly,
+                                  formatter.discovery,
+                                  formatter.queryCallees,
+                                  sqlOnly=formatter.pythonStyle is None)
+    if lines is not None:
+        options['lines'] = [list(lineRange) for lineRange in lines]
+    key = cache.get_key(script, formatter.pythonStyle, formatter.sparksqlStyle, formatter.tokenizer.queryNames,
+                        **options)
+    formattedScript = cache.get(key)
+    if formattedScript is None:
+        formattedScript = formatter.format(script, stats, lines)
+        cache.put(key, formattedScript)
+    elif stats is not None:
+        stats.resultCached = True
+    return formattedScript
+
+
+def _get_format_options(reformatChangedLinesOnly, discovery, queryCallees, sqlOnly=False):
+    '''
+    Return the Formatter() settings other than styles and query names that affect the formatted result, as passed to
+    ResultCache.get_key() and get_settings_fingerprint().
+
+    Parameters
+    sqlOnly: bool
+        True if yapf is not run, i.e., the Python style is None, which the command line also uses for its default
+        style.
+
+    Return: dict
+        The settings. Those of the default discovery, 'scan', are left out, so that it keeps the cache keys from before
+        discovery could be chosen, and queryCallees, which it does not use; so is sqlOnly unless True.
+    '''
+    options = {'reformatChangedLinesOnly': reformatChangedLinesOnly}
+    if discovery != 'scan':
+        options.update(discovery=discovery, queryCallees=list(queryCallees))
+    if sqlOnly:
+        options['sqlOnly'] = True
+    return options
+
+
+def _read_batch(inStream):
+    '''
+    The input helper function for format_batch(). Split the content of given stream into scripts as it arrives.
+
+    Parameters
+    inStream: binary file object
+        Stream of UTF-8 encoded scripts separated by BATCH_DELIMITER.
+
+    Return: generator
+        The decoded scripts. A trailing BATCH_DELIMITER does not start another script.
+    '''
+    read = getattr(inStream, 'read1', inStream.read)  # read1() returns what is available instead of waiting for more
+    chunks = []  # pieces of the script being read
+    for data in iter(lambda: read(BATCH_READ_SIZE), b''):
+        pieces = data.split(BATCH_DELIMITER)
+        for piece in pieces[:-1]:  # every piece but the last ends a script
+            chunks.append(piece)
+            yield b''.join(chunks).decode('utf-8')
+            chunks = []
+        chunks.append(pieces[-1])
+    if any(chunks):
+        yield b''.join(chunks).decode('utf-8')
+
+
+def _write_batch_result(result, script, scriptIndex, outStream):
+    '''
+    The output helper function for format_batch(). Write a formatted script, or the original one if it could not be
+    formatted, followed by BATCH_DELIMITER.
+
+    Parameters
+    result: FormatResult
+    script: string
+        The script that was formatted.
+    scriptIndex: int
+        0-based position of the script in the batch, to report errors.
+    outStream: binary file object
+        Stream to write to.
+
+    Return: int
+        1 if the script could not be formatted, else 0.
+    '''
+    if result.error:
+        logger.error('Failed to format script ' + str(scriptIndex) + ' in batch: ' + result.error)
+        formattedScript = script
+    else:
+        formattedScript = result.formattedScript
+    outStream.write(formattedScript.encode('utf-8') + BATCH_DELIMITER)
+    outStream.flush()
+    return 1 if result.error else 0
+
+
+def _create_formatter(pythonStyle,
+                      sparksqlStyle,
+                      queryNames,
+                      reformatChangedLinesOnly=False,
+                      discovery='scan',
+                      queryCallees=['spark.sql'],
+                      queryJobs=1):
+    '''
+    Create Formatter() object from given settings for python style and sparksql configurations. The SparkSQL style is
+    resolved by STYLE_REGISTRY, so that styles given as config files or dictionaries are only parsed once.
+
+    Parameters
+    pythonStyle: string
+        A style name or path to a style config file; interface to https://github.com/google/yapf.
+    sparksqlStyle: string, dict, or sparksqlformatter.src.style.Style() object
+        Configurations for the query language; interface to https://github.com/largecats/sparksql-formatter. If None,
+        use the default Style().
+    queryNames: list
+        Strings used to identify variables that contain the SparkSQL queries.
+    reformatChangedLinesOnly: bool
+        If True, only run yapf again over the lines of the queries that changed; see Formatter().
+    discovery: string
+        How queries are found: 'scan' or 'ast'; see Formatter().
+    queryCallees: list
+        Dotted names of the functions taking a query as first argument, if discovery is 'ast'; see Formatter().
+    queryJobs: int
+        Number of worker processes to format the queries of a script with; see Formatter().
+
+    Return: pysqlformatter.src.formatter.Formatter() object
+    '''
+    return Formatter(pythonStyle=pythonStyle,
+                     sparksqlStyle=sparksqlStyle,
+                     queryNames=queryNames,
+                     reformatChangedLinesOnly=reformatChangedLinesOnly,
+                     discovery=discovery,
+                     queryCallees=queryCallees,
+                     queryJobs=queryJobs)
+
+
+def _init_worker(pythonStyle, sparksqlStyle, queryNames, cache, reformatChangedLinesOnly, discovery, queryCallees):
+    '''
+    Initializer of the worker processes of format_files(). Build the worker's Formatter() object once.
+    '''
+    global _workerFormatter, _workerCache
+    _workerFormatter = _create_formatter(pythonStyle=pythonStyle,
+                                         sparksqlStyle=sparksqlStyle,
+                                         queryNames=queryNames,
+                                         reformatChangedLinesOnly=reformatChangedLinesOnly,
+                                         discovery=discovery,
+                                         queryCallees=queryCallees)
+    _workerCache = cache
+
+
+def _format_file_in_worker(args):
+    '''
+    The task run by the worker processes of format_files().
+
+    Parameters
+    args: tuple
+        (filePath, inPlace, check, diff, profile, lines, segmentLines).
+
+    Return: FormatResult
+    '''
+    filePath, inPlace, check, diff, profile, lines, segmentLines = args
+    return _format_file_safely(filePath, _workerFormatter, inPlace, _workerCache, check, diff, profile, lines,
+                               segmentLines)
+
+
+def _format_script_in_worker(script):
+    '''
+    The task run by the worker processes of format_batch().
+
+    Parameters
+    script: string
+        The script to format.
+
+    Return: FormatResult
+    '''
+    return _format_script_safely(script, _workerFormatter, _workerCache)
+
+
+def _format_file_safely(filePath,
+                        formatter,
+                        inPlace=False,
+                        cache=None,
+                        check=False,
+                        diff=False,
+                        profile=False,
+                        lines=None,
+                        segmentLines=None):
+    '''
+    Format given file, capturing any exception in the returned result instead of raising it.
+
+    Parameters
+    filePath: string
+        Path to the file to format.
+    formatter: pysqlformatter.src.formatter.Formatter() object
+        Formatter.
+    inPlace: bool
+        If True, will format the file in place.
+    cache: pysqlformatter.src.cache.ResultCache() object
+        Cache of formatted scripts.
+    check: bool
+        If True, do not write the file.
+    diff: bool
+        If True, do not write the file, and compute the diff of the change.
+    profile: bool
+        If True, time the stages of formatting the file.
+    lines: list
+        1-based (first, last) line ranges to format, or None.
+    segmentLines: int
+        If given, format the file one segment at a time, see _format_file_segmented(), without a result cache.
+
+    Return: FormatResult
+    '''
+    stats = FormatStats(filePath=filePath) if profile else None
+    try:
+        if segmentLines:
+            changed = _format_file_segmented(filePath, formatter, inPlace, check, segmentLines, stats)
+            return FormatResult(filePath=filePath,
+                                formattedScript=None,
+                                error=None,
+                                changed=changed,
+                                diff=None,
+                                stats=stats)
+        with (stats or NO_STATS).time_stage('read'):
+            script = _read_from_file(filePath)
+        formattedScript = _format_script(script, formatter, cache, stats, lines)
+        return _finish_file(filePath, script, formattedScript, inPlace, check, diff, stats)
+    except Exception as e:
+        return FormatResult(filePath=filePath,
+                            formattedScript=None,
+                            error='{}: {}'.format(type(e).__name__, e),
+                            changed=None,
+                            diff=None,
+                            stats=stats)
+
+
+def _finish_file(filePath, script, formattedScript, inPlace=False, check=False, diff=False, stats=None):
+    '''
+    Write a formatted file in place if required and it changed, and describe the result.
+
+    Parameters
+    filePath: string
+        Path to the file.
+    script: string
+        The content of the file.
+    formattedScript: string
+        The formatted content.
+    inPlace: bool
+        If True, will write the formatted content to the file if it differs from the content, unless check or diff.
+    check: bool
+        If True, do not write the file.
+    diff: bool
+        If True, do not write the file, and compute the diff of the change.
+    stats: pysqlformatter.src.stats.FormatStats() object
+        If given, record the time spent writing the file or computing the diff in it, and return it in the result.
+
+    Return: FormatResult
+    '''
+    with (stats or NO_STATS).time_stage('output'):
+        changed = formattedScript != script
+        if changed and inPlace and not (check or diff) and filePath != STDIN_PATH:
+            logger.info('Writing to ' + filePath + '...')
+            _write_to_file(formattedScript, filePath)
+        fileDiff = _get_diff(script, formattedScript, filePath) if diff else None
+    return FormatResult(filePath=filePath,
+                        formattedScript=formattedScript,
+                        error=None,
+                        changed=changed,
+                        diff=fileDiff,
+                        stats=stats)
+
+
+def _format_script_safely(script, formatter, cache=None):
+    '''
+    Format given script, capturing any exception in the returned result instead of raising it.
+
+    Parameters
+    script: string
+        The script to format.
+    formatter: pysqlformatter.src.formatter.Formatter() object
+        Formatter.
+    cache: pysqlformatter.src.cache.ResultCache() object
+        Cache of formatted scripts.
+
+    Return: FormatResult
+        The result, with filePath and diff None.
+    '''
+    try:
+        formattedScript = _format_script(script, formatter, cache)
+    except Exception as e:
+        return FormatResult(filePath=None,
+                            formattedScript=None,
+                            error='{}: {}'.format(type(e).__name__, e),
+                            changed=None,
+                            diff=None,
+                            stats=None)
+    return FormatResult(filePath=None,
+                        formattedScript=formattedScript,
+                        error=None,
+                        changed=formattedScript != script,
+                        diff=None,
+                        stats=None)
+
+
+def _collect_result(result, inPlace, check=False, diff=False):
+    '''
+    Handle a result of format_files() in the main process: report errors and write to stdout the diff if diff, else
+    the path of the file if check and the file changed, else the formatted script if the file is not formatted in place
+    or is stdin.
+
+    Parameters
+    result: FormatResult
+    inPlace: bool
+        If True, the file has already been formatted in place.
+    check: bool
+        If True, the file is only checked.
+    diff: bool
+        If True, the diff of the file has been computed.
+
+    Return: FormatResult
+    '''
+    if result.error:
+        logger.error('Failed to format ' + result.filePath + ': ' + result.error)
+    elif diff:
+        sys.stdout.write(result.diff)
+    elif check:
+        if result.changed:
+            sys.stdout.write(result.filePath + '\n')
+    elif (not inPlace or result.filePath == STDIN_PATH) and result.formattedScript is not None:  # None if segmented
+        sys.stdout.write(result.formattedScript)
+    return result
@@ -0,0 +1,174 @@
+import ast
+import sys
+import logging
+
+from pysqlformatter.src.token import TokenType, Token
+from pysqlformatter.src.line_index import LineIndex
+from pysqlformatter.src.tokenizer import Tokenizer, QueryNameMatcher, STRING_BODY_REGEXES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERY_CALLEES = ['spark.sql']
+# the ast only has the end positions of nodes from Python 3.8, and before that multiline strings have no column offset
+AST_DISCOVERY_SUPPORTED = sys.version_info >= (3, 8)
+
+
+class AstTokenizer:
+    '''
+    Class for finding the queries in the script to be formatted from its syntax tree instead of its text, so that
+    queries passed to any session, e.g., self.spark.sql() or ss.sql(), in any argument layout are found. The script is
+    parsed once, and the string literals holding queries are indexed with their offsets in the script, as Token()
+    objects in the order of the script, like those of Tokenizer.tokenize(). Before Python 3.8, the syntax tree does not
+    locate strings precisely enough, so scripts are tokenized by Tokenizer() instead.
+    '''
+    def __init__(self, queryNames, queryCallees=DEFAULT_QUERY_CALLEES):
+        '''
+        Parameters
+        queryNames: list
+            Strings used to identify variables that contain the SparkSQL queries. String literals assigned to
+            variables, attributes or keyword arguments whose name ends with one of these strings, ignoring case, will be
+            formatted.
+        queryCallees: list
+            Dotted names of the functions taking a query as first argument. A call matches if the dotted name of the
+            called function ends with one of these, e.g., 'spark.sql' matches spark.sql() and self.spark.sql(), and
+            'sql' matches any method named sql().
+        '''
+        self.queryNames = queryNames
+        self.queryCallees = queryCallees
+        self.queryNameMatcher = QueryNameMatcher(queryNames)
+        self.calleeNames = [tuple(callee.split('.')) for callee in queryCallees]
+        self.fallbackTokenizer = Tokenizer(queryNames=queryNames)
+        if not AST_DISCOVERY_SUPPORTED:
+            logger.warning('Finding queries from the syntax tree requires Python 3.8+, scanning scripts instead.')
+
+    def tokenize(self, script):
+        '''
+        Extract all queries from script. Scripts that yapf accepts but ast cannot parse, e.g., with Python 2 print
+        statements, and all scripts before Python 3.8 are tokenized by Tokenizer() instead.
+
+        Parameters
+        script: string
+            The script to format.
+
+        Return: list
+            Query tokens found in the script, in the order they appear in it.
+        '''
+        if not AST_DISCOVERY_SUPPORTED:
+            return self.fallbackTokenizer.tokenize(script)
+        try:
+            tree = ast.parse(script)
+        except SyntaxError as e:
+            logger.warning('Cannot parse script ({}), finding queries by scanning it instead.'.format(e))
+            return self.fallbackTokenizer.tokenize(script)
+        lineIndex = LineIndex(script)
+        tokens = {}  # start -> Token(), as a literal may be found twice, e.g., spark.sql(query='...')
+        for node, tokenType in self.get_query_nodes(tree):
+            token = AstTokenizer.create_token(node, tokenType, script, lineIndex)
+            if token is not None:
+                tokens.setdefault(token.start, token)
+        return [tokens[start] for start in sorted(tokens)]
+
+    def get_query_nodes(self, tree):
+        '''
+        Find the string literals holding queries in a syntax tree.
+
+        Parameters
+        tree: ast.AST object
+            The syntax tree of the script.
+
+        Return: generator
+            (ast.Constant object, TokenType) pairs.
+        '''
+        for node in ast.walk(tree):
+            value = None
+            if isinstance(node, ast.Assign):  # query = '...', self.query = '...', x = query = '...'
+                if any(self.is_query_target(target) for target in node.targets):
+                    value, tokenType = node.value, TokenType.QUERY_VARIABLE
+            elif isinstance(node, ast.AnnAssign):  # query: str = '...'
+                if self.is_query_target(node.target):
+                    value, tokenType = node.value, TokenType.QUERY_VARIABLE
+            elif isinstance(node, ast.keyword):  # f(query='...')
+                if node.arg is not None and self.is_query_name(node.arg):
+                    value, tokenType = node.value, TokenType.QUERY_VARIABLE
+            elif isinstance(node, ast.Call) and node.args and self.is_query_callee(node.func):  # spark.sql('...')
+                value, tokenType = node.args[0], TokenType.QUERY_ARGUMENT
+            literal = AstTokenizer.get_string_literal(value)
+            if literal is not None:
+                yield literal, tokenType
+
+    def is_query_name(self, name):
+        return self.queryNameMatcher.match(name)
+
+    def is_query_target(self, target):
+        '''
+        Return: bool
+            True if an assignment target is a variable or attribute with a query name.
+        '''
+        if isinstance(target, ast.Name):
+            return self.is_query_name(target.id)
+        if isinstance(target, ast.Attribute):
+            return self.is_query_name(target.attr)
+        return False
+
+    def is_query_callee(self, func):
+        '''
+        Return: bool
+            True if the dotted name of a called function ends with one of self.queryCallees.
+        '''
+        names = []  # trailing names of the dotted name, last first; stops at anything else, e.g., get_spark().sql
+        while isinstance(func, ast.Attribute):
+            names.append(func.attr)
+            func = func.value
+        if isinstance(func, ast.Name):
+            names.append(func.id)
+        names.reverse()
+        return any(tuple(names[-len(calleeName):]) == calleeName for calleeName in self.calleeNames)
+
+    @staticmethod
+    def get_string_literal(node):
+        '''
+        Return the string literal of an expression holding a query: the expression itself, or the string whose method is
+        called, e.g., '...'.format().
+
+        Parameters
+        node: ast.AST object
+            The expression, or None.
+
+        Return: ast.Constant object
+            The string literal, or None if the expression is not one, e.g., an f-string or a concatenation.
+        '''
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            node = node.func.value
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):  # f-strings are ast.JoinedStr
+            return node
+        return None
+
+    @staticmethod
+    def create_token(node, tokenType, script, lineIndex):
+        '''
+        Create token of the content of a string literal, converting the UTF-8 offsets of ast to positions in the script.
+
+        Parameters
+        node: ast.Constant object
+            The string literal.
+        tokenType: string
+            TokenType.
+        script: string
+            The script to format.
+        lineIndex: pysqlformatter.src.line_index.LineIndex() object
+            Line index of the script.
+
+        Return: Token() object
+            None if the literal cannot be formatted in place, i.e., it has a prefix or is implicitly concatenated from
+            several strings.
+        '''
+        start = lineIndex.get_position(node.lineno - 1, node.col_offset)
+        end = lineIndex.get_position(node.end_lineno - 1, node.end_col_offset)
+        if script[start] not in '\'"':  # prefixed, e.g., r'...'
+            return None
+        quote = script[start] * 3 if script.startswith(script[start] * 3, start) else script[start]
+        contentStart = start + len(quote)
+        contentEnd = STRING_BODY_REGEXES[quote].match(script, contentStart).end()
+        if contentEnd + len(quote) != end:  # e.g., 'select * ' 'from t0'
+            return None
+        return Token(type=tokenType, start=contentStart, end=contentEnd, lineIndex=lineIndex)
@@ -0,0 +1,303 @@
+from io import open
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import collections
+
+from pysqlformatter.src.styles import STYLE_REGISTRY
+
+CACHE_FORMAT_VERSION = '2'  # bump when the formatting output of pysqlformatter itself changes
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024  # bytes
+EVICTION_TARGET_RATIO = 0.8  # after eviction, the cache is trimmed to this fraction of maxSize
+
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'maxSize', 'currSize'])
+
+_sparksqlformatterVersion = None  # installed version of sparksqlformatter, or '' if unknown; looked up once
+
+
+def get_default_cache_dir():
+    '''
+    Return the default directory of the result cache, following the XDG base directory convention.
+
+    Return: string
+        Path to the default cache directory.
+    '''
+    cacheHome = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cacheHome, 'pysqlformatter')
+
+
+class ResultCache:
+    '''
+    Persistent on-disk cache of formatted scripts, keyed by a hash of the script content and the formatting settings.
+    Entries are evicted in least-recently-used order (by file modification time) when the total size exceeds maxSize.
+    '''
+    def __init__(self, cacheDir=None, maxSize=DEFAULT_MAX_SIZE):
+        '''
+        Parameters
+        cacheDir: string
+            Directory to store the cache entries in. Default to get_default_cache_dir().
+        maxSize: int
+            Maximum total size of the cache entries in bytes.
+        '''
+        self.cacheDir = os.path.expanduser(cacheDir) if cacheDir else get_default_cache_dir()
+        self.maxSize = maxSize
+        self.size = None  # total size of the entries, computed on first write
+
+    def get_key(self, script, pythonStyle, sparksqlStyle, queryNames, **options):
+        '''
+        Compute the cache key of a script formatted with given settings.
+
+        Parameters
+        script: string
+            The script to format.
+        pythonStyle: string
+            A style name or path to a style config file; interface to https://github.com/google/yapf.
+        sparksqlStyle: string, dict, or sparksqlformatter.src.style.Style() object
+            Configurations for the query language; interface to https://github.com/largecats/sparksql-formatter.
+        queryNames: list
+            Strings used to identify variables that contain the SparkSQL queries.
+        options: dict
+            Other Formatter() settings that affect the formatted result.
+
+        Return: string
+            Hex digest identifying the formatted result.
+        '''
+        digest = hashlib.sha256()
+        digest.update(get_settings_fingerprint(pythonStyle, sparksqlStyle, queryNames, **options).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(script.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        '''
+        Look up a formatted script in the cache.
+
+        Parameters
+        key: string
+            Cache key returned by get_key().
+
+        Return: string
+            The cached formatted script, or None if there is no entry for key.
+        '''
+        entryPath = self._get_entry_path(key)
+        try:
+            with open(file=entryPath, mode='r', newline='', encoding='utf-8') as f:
+                formattedScript = f.read()
+            os.utime(entryPath, None)  # mark as recently used
+        except (IOError, OSError):
+            return None
+        return formattedScript
+
+    def put(self, key, formattedScript):
+        '''
+        Store a formatted script in the cache, evicting least-recently-used entries if the cache grows beyond maxSize.
+
+        Parameters
+        key: string
+            Cache key returned by get_key().
+        formattedScript: string
+            The formatted script.
+        '''
+        entryPath = self._get_entry_path(key)
+        entryDir = os.path.dirname(entryPath)
+        data = formattedScript.encode('utf-8')
+        try:
+            if not os.path.isdir(entryDir):
+                os.makedirs(entryDir)
+        except OSError:  # created concurrently by another process
+            pass
+        fd, tempPath = tempfile.mkstemp(dir=entryDir, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tempPath, entryPath)  # atomic, so concurrent readers never see partial entries
+        except BaseException:
+            os.remove(tempPath)
+            raise
+        if self.size is None:
+            self.size = sum(size for _, _, size in self._list_entries())
+        else:
+            self.size += len(data)
+        if self.size > self.maxSize:
+            self.evict()
+
+    def evict(self):
+        '''
+        Remove least-recently-used entries until the cache fits in EVICTION_TARGET_RATIO * maxSize.
+        '''
+        entries = sorted(self._list_entries())  # oldest access time first
+        size = sum(entrySize for _, _, entrySize in entries)
+        targetSize = int(self.maxSize * EVICTION_TARGET_RATIO)
+        for _, entryPath, entrySize in entries:
+            if size <= targetSize:
+                break
+            try:
+                os.remove(entryPath)
+            except OSError:  # already evicted by another process
+                pass
+            size -= entrySize
+        self.size = size
+
+    def _get_entry_path(self, key):
+        return os.path.join(self.cacheDir, key[:2], key)
+
+    def _list_entries(self):
+        '''
+        Return: list
+            (mtime, path, size) of every entry in the cache.
+        '''
+        entries = []
+        if not os.path.isdir(self.cacheDir):
+            return entries
+        for subDir in os.listdir(self.cacheDir):
+            subDirPath = os.path.join(self.cacheDir, subDir)
+            if not os.path.isdir(subDirPath):
+                continue
+            for name in os.listdir(subDirPath):
+                if name.startswith('.tmp-'):
+                    continue
+                entryPath = os.path.join(subDirPath, name)
+                try:
+                    stat = os.stat(entryPath)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, entryPath, stat.st_size))
+        return entries
+
+
+class LRUCache:
+    '''
+    In-memory mapping bounded to maxSize entries, discarding the least-recently-used entry when full. Safe to use from
+    several threads.
+    '''
+    def __init__(self, maxSize):
+        '''
+        Parameters
+        maxSize: int
+            Maximum number of entries. If 0, nothing is cached.
+        '''
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Look up a value, marking it as recently used.
+
+        Parameters
+        key: hashable
+            Key of the entry.
+
+        Return: object
+            The cached value, or None if there is no entry for key.
+        '''
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return value
+
+    def __contains__(self, key):
+        '''
+        Tell whether there is an entry for key, without counting a hit or miss or marking it as recently used.
+        '''
+        with self.lock:
+            return key in self.entries
+
+    def put(self, key, value):
+        '''
+        Store a value, discarding the least-recently-used entry if the cache is full.
+
+        Parameters
+        key: hashable
+            Key of the entry.
+        value: object
+            Value to cache, must not be None.
+        '''
+        if self.maxSize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+
+    def info(self):
+        '''
+        Return: CacheInfo
+            Hit and miss counts, maximum and current number of entries.
+        '''
+        with self.lock:
+            return CacheInfo(hits=self.hits, misses=self.misses, maxSize=self.maxSize, currSize=len(self.entries))
+
+    def clear(self):
+        '''
+        Remove all entries and reset the counters.
+        '''
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def get_settings_fingerprint(pythonStyle, sparksqlStyle, queryNames, **options):
+    '''
+    Compute a fingerprint of the settings a script is formatted with, which changes whenever they, the content of the
+    style config files, or the versions of yapf, sparksqlformatter or pysqlformatter's output change.
+
+    Parameters
+    pythonStyle: string
+        A style name or path to a style config file; interface to https://github.com/google/yapf.
+    sparksqlStyle: string, dict, or sparksqlformatter.src.style.Style() object
+        Configurations for the query language; interface to https://github.com/largecats/sparksql-formatter.
+    queryNames: list
+        Strings used to identify variables that contain the SparkSQL queries.
+    options: dict
+        Other Formatter() settings that affect the formatted result.
+
+    Return: string
+        Hex digest identifying the settings.
+    '''
+    global _sparksqlformatterVersion
+    import yapf
+    if _sparksqlformatterVersion is None:  # looked up once, as it takes longer than hashing the settings
+        _sparksqlformatterVersion = _get_distribution_version('sparksqlformatter') or ''
+    settings = [
+        CACHE_FORMAT_VERSION, yapf.__version__, _sparksqlformatterVersion,
+        STYLE_REGISTRY.get_fingerprint(pythonStyle),
+        STYLE_REGISTRY.get_fingerprint(sparksqlStyle),
+        list(queryNames), options
+    ]
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=repr).encode('utf-8')).hexdigest()
+
+
+def _get_distribution_version(name):
+    '''
+    Return the version of an installed distribution, which is needed when the package does not define __version__.
+
+    Parameters
+    name: string
+        Name of the distribution.
+
+    Return: string
+        The version, or None if the distribution is not installed, e.g., if the package is imported from a source tree.
+    '''
+    try:
+        from importlib import metadata  # Python 3.8+
+        try:
+            return metadata.version(name)
+        except metadata.PackageNotFoundError:
+            return None
+    except ImportError:
+        import pkg_resources
+        try:
+            return pkg_resources.get_distribution(name).version
+        except pkg_resources.DistributionNotFound:
+            return None
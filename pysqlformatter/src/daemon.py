@@ -0,0 +1,410 @@
+import os
+import json
+import stat
+import time
+import socket
+import logging
+import tempfile
+import threading
+import socketserver
+
+from pysqlformatter.src import api
+from pysqlformatter.src.cache import LRUCache
+from pysqlformatter.src.styles import STYLE_REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IDLE_TIMEOUT = 600  # seconds without requests after which the daemon exits
+MAX_FORMATTERS = 16  # number of Formatter() objects with different settings kept warm
+DEFAULT_CLIENT_TIMEOUT = 300  # seconds the client waits for the daemon to connect or answer
+CONNECT_RETRY_INTERVAL = 0.01  # seconds the client waits before connecting again while the daemon's backlog is full
+DEFAULT_SETTINGS = {  # as in api.format_script()
+    'pythonStyle': 'pep8',
+    'sparksqlStyle': None,
+    'queryNames': ['query'],
+    'reformatChangedLinesOnly': False,
+    'discovery': 'scan',
+    'queryCallees': ['spark.sql']
+}
+
+# Protocol: the client sends one JSON object per line, {"script": ..., <setting>: ...} with any of DEFAULT_SETTINGS, and
+# the daemon answers each with one JSON object per line, {"formattedScript": ...} or {"error": ...}. Styles must be given
+# as style names, paths to config files, or dictionaries.
+
+
+def get_default_socket_path():
+    '''
+    Return the default path of the daemon's socket, private to the current user.
+
+    Return: string
+        Path to the socket in $XDG_RUNTIME_DIR if set, else in the directory pysqlformatter-<uid> of the temporary
+        directory, which the daemon creates accessible only to the current user.
+    '''
+    runtimeDir = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtimeDir:
+        runtimeDir = os.path.join(tempfile.gettempdir(), 'pysqlformatter-{}'.format(os.getuid()))
+    return os.path.join(runtimeDir, 'pysqlformatter.sock')
+
+
+class FormatterServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''
+    Daemon formatting scripts sent over a Unix domain socket, each connection in its own thread. Formatter() objects are
+    built once per distinct settings and shared by all connections.
+    '''
+    daemon_threads = True  # do not wait for open connections when exiting
+    request_queue_size = socket.SOMAXCONN  # connections waiting to be accepted, e.g., from many hooks at once
+
+    def __init__(self, socketPath=None, idleTimeout=DEFAULT_IDLE_TIMEOUT, cache=None):
+        '''
+        Parameters
+        socketPath: string
+            Path to listen on. Default to get_default_socket_path().
+        idleTimeout: float
+            Exit after this many seconds without requests. If 0 or None, run until interrupted.
+        cache: pysqlformatter.src.cache.ResultCache() object
+            If given, look up the formatted scripts in the cache before formatting them, and store them there
+            afterwards.
+        '''
+        if socketPath is None:
+            socketPath = get_default_socket_path()
+            _make_private_dir(os.path.dirname(socketPath))
+        self.socketPath = socketPath
+        self.idleTimeout = idleTimeout
+        self.cache = cache
+        self.formatters = LRUCache(maxSize=MAX_FORMATTERS)
+        self.lock = threading.Lock()  # guards activeRequests and lastActivity
+        self.activeRequests = 0
+        self.lastActivity = time.time()
+        self.stopped = threading.Event()
+        _remove_stale_socket(self.socketPath)
+        oldUmask = os.umask(0o077)  # only the current user may connect
+        try:
+            socketserver.UnixStreamServer.__init__(self, self.socketPath, FormatRequestHandler)
+        finally:
+            os.umask(oldUmask)
+
+    def serve(self):
+        '''
+        Handle requests until the daemon has been idle for idleTimeout seconds or shutdown() is called, then remove the
+        socket.
+        '''
+        # loaded before the first requests, which would otherwise import them in several threads at once and may see
+        # them partially initialized
+        from yapf.yapflib import yapf_api, style
+        from sparksqlformatter import api as sparksqlformatter_api
+        logger.info('Listening on ' + self.socketPath + '...')
+        if self.idleTimeout:
+            watcher = threading.Thread(target=self.watch_idle_time)
+            watcher.daemon = True
+            watcher.start()
+        try:
+            self.serve_forever()
+        finally:
+            self.stopped.set()
+            self.server_close()
+            try:
+                os.remove(self.socketPath)
+            except OSError:
+                pass
+
+    def watch_idle_time(self):
+        '''
+        Shut the daemon down once no request has been received or was running for idleTimeout seconds.
+        '''
+        while not self.stopped.wait(min(self.idleTimeout, 1.0)):
+            with self.lock:
+                isIdle = self.activeRequests == 0 and time.time() - self.lastActivity >= self.idleTimeout
+            if isIdle:
+                logger.info('Idle for ' + str(self.idleTimeout) + ' seconds, shutting down...')
+                self.shutdown()
+                return
+
+    def format_request(self, request):
+        '''
+        Format the script in a request.
+
+        Parameters
+        request: dict
+            The script, optionally the line ranges to format, and the settings to format it with.
+
+        Return: dict
+            The response to send back.
+        '''
+        with self.lock:
+            self.activeRequests += 1
+        try:
+            settings = dict(request)
+            script = settings.pop('script')
+            lines = settings.pop('lines', None)
+            if lines is not None:
+                lines = [tuple(lineRange) for lineRange in lines]
+            formatter = self.get_formatter(settings)
+            return {'formattedScript': api._format_script(script, formatter, self.cache, lines=lines)}
+        except Exception as e:
+            return {'error': '{}: {}'.format(type(e).__name__, e)}
+        finally:
+            with self.lock:
+                self.activeRequests -= 1
+                self.lastActivity = time.time()
+
+    def get_formatter(self, settings):
+        '''
+        Return the Formatter() object for given settings, building it on first use.
+
+        Parameters
+        settings: dict
+            Any of DEFAULT_SETTINGS; missing ones take their default.
+
+        Return: pysqlformatter.src.formatter.Formatter() object
+        '''
+        unknownNames = set(settings) - set(DEFAULT_SETTINGS)
+        if unknownNames:
+            raise Exception('Unsupported settings: ' + ', '.join(sorted(unknownNames)))
+        settings = dict(DEFAULT_SETTINGS, **settings)
+        # requests spelling out the defaults share a Formatter, which is built again when a style config file changes
+        styleFingerprints = [
+            STYLE_REGISTRY.get_fingerprint(settings['pythonStyle']),
+            STYLE_REGISTRY.get_fingerprint(settings['sparksqlStyle'])
+        ]
+        key = json.dumps([settings, styleFingerprints], sort_keys=True)
+        formatter = self.formatters.get(key)
+        if formatter is None:
+            formatter = api._create_formatter(pythonStyle=settings['pythonStyle'],
+                                              sparksqlStyle=settings['sparksqlStyle'],
+                                              queryNames=settings['queryNames'],
+                                              reformatChangedLinesOnly=settings['reformatChangedLinesOnly'],
+                                              discovery=settings['discovery'],
+                                              queryCallees=settings['queryCallees'])
+            self.formatters.put(key, formatter)
+        return formatter
+
+
+class FormatRequestHandler(socketserver.StreamRequestHandler):
+    '''
+    Handle the requests of one connection to FormatterServer(), in order.
+    '''
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                if not isinstance(request, dict):
+                    raise ValueError('Request must be a JSON object')
+                response = self.server.format_request(request)
+            except ValueError as e:  # json.JSONDecodeError and UnicodeDecodeError are ValueError
+                response = {'error': '{}: {}'.format(type(e).__name__, e)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class FormatterClient:
+    '''
+    Connection to a FormatterServer() daemon.
+    '''
+    def __init__(self, socketPath=None, timeout=DEFAULT_CLIENT_TIMEOUT):
+        '''
+        Parameters
+        socketPath: string
+            Path of the daemon's socket. Default to get_default_socket_path().
+        timeout: float
+            Seconds to wait for the daemon to connect or answer a request before giving up. If None, wait
+            indefinitely.
+
+        Raise: OSError
+            If no daemon is listening on socketPath, or the socket is not owned by and private to the current user, so
+            that another user cannot answer in place of the daemon.
+        '''
+        self.socketPath = socketPath or get_default_socket_path()
+        _check_private(self.socketPath, stat.S_ISSOCK)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            _connect(self.sock, self.socketPath, timeout)
+        except Exception:
+            self.sock.close()
+            raise
+        self.rfile = self.sock.makefile('rb')
+
+    def format_script(self, script, lines=None, **settings):
+        '''
+        Format script in the daemon.
+
+        Parameters
+        script: string
+            The script to format.
+        lines: list
+            1-based (first, last) line ranges to format, as for api.format_script(). If None, format the whole script.
+        settings: dict
+            Any of DEFAULT_SETTINGS, as for api.format_script(). Styles must be style names, paths to config files, or
+            dictionaries.
+
+        Return: string
+            The formatted script.
+        '''
+        request = dict(settings, script=script)
+        if lines is not None:
+            request['lines'] = [list(lineRange) for lineRange in lines]
+        self.sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        line = self.rfile.readline()
+        if not line:
+            raise Exception('Daemon at ' + self.socketPath + ' closed the connection')
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            raise Exception(response['error'])
+        return response['formattedScript']
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+
+def format_files_with_daemon(filePaths,
+                             socketPath=None,
+                             inPlace=False,
+                             check=False,
+                             diff=False,
+                             timeout=DEFAULT_CLIENT_TIMEOUT,
+                             lines=None,
+                             **settings):
+    '''
+    Format files in a running daemon, reading and writing them in the current process.
+
+    Parameters
+    filePaths: list
+        Paths to the files to format. api.STDIN_PATH stands for stdin, which is formatted to stdout.
+    socketPath: string
+        Path of the daemon's socket. Default to get_default_socket_path().
+    inPlace: bool
+        If True, will format the files in place, leaving files that are already formatted untouched.
+        Else, will write the formatted files to stdout, in the order of filePaths.
+    check: bool
+        If True, do not write the files; write the paths of those that are not formatted to stdout instead.
+    diff: bool
+        If True, do not write the files; write unified diffs of the changes to stdout instead.
+    timeout: float
+        Seconds to wait for the daemon to connect or answer a request before giving up. If None, wait indefinitely.
+    lines: list
+        1-based (first, last) line ranges to format in each file, or None.
+    settings: dict
+        Any of DEFAULT_SETTINGS, as for FormatterClient.format_script().
+
+    Return: list
+        FormatResult(filePath, formattedScript, error, changed, diff, stats) tuples in the order of filePaths, as for
+        api.format_files(), without stats.
+
+    Raise: OSError
+        If no daemon is listening on socketPath.
+    '''
+    results = []
+    with FormatterClient(socketPath=socketPath, timeout=timeout) as client:
+        for filePath in filePaths:
+            try:
+                script = api._read_from_file(filePath)
+                formattedScript = client.format_script(script, lines=lines, **settings)
+                result = api._finish_file(filePath, script, formattedScript, inPlace, check, diff)
+            except Exception as e:
+                result = api.FormatResult(filePath=filePath,
+                                          formattedScript=None,
+                                          error='{}: {}'.format(type(e).__name__, e),
+                                          changed=None,
+                                          diff=None,
+                                          stats=None)
+            results.append(api._collect_result(result, inPlace, check, diff))
+    return results
+
+
+def _connect(sock, socketPath, timeout):
+    '''
+    Connect a socket with a timeout to a Unix domain socket. A connection with a timeout does not wait for the listener
+    to accept it, but fails with BlockingIOError when its backlog is full, so connect again until timeout has passed.
+
+    Parameters
+    sock: socket.socket object
+        The socket to connect.
+    socketPath: string
+        Path of the socket to connect to.
+    timeout: float
+        The timeout of sock, or None.
+
+    Raise: OSError
+        If no daemon is listening on socketPath, or socket.timeout if its backlog stays full for timeout seconds.
+    '''
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        try:
+            sock.connect(socketPath)
+            return
+        except BlockingIOError:
+            if deadline is not None and time.time() >= deadline:
+                raise socket.timeout('Timed out connecting to daemon at ' + socketPath)
+            time.sleep(CONNECT_RETRY_INTERVAL)
+
+
+def _make_private_dir(dirPath):
+    '''
+    Create a directory accessible only to the current user, unless it exists.
+
+    Parameters
+    dirPath: string
+        Path of the directory.
+
+    Raise: OSError
+        If the directory exists but is not owned by or private to the current user.
+    '''
+    try:
+        os.mkdir(dirPath, 0o700)
+    except FileExistsError:
+        pass
+    _check_private(dirPath, stat.S_ISDIR)
+
+
+def _check_private(path, isFileType):
+    '''
+    Check that a path is owned by the current user and not accessible to other users, without following symlinks.
+
+    Parameters
+    path: string
+        Path to check.
+    isFileType: function
+        Function of stat, e.g., stat.S_ISSOCK, that the mode of path must satisfy.
+
+    Raise: OSError
+        If path does not exist or fails the check.
+    '''
+    pathStat = os.lstat(path)
+    if not isFileType(pathStat.st_mode) or pathStat.st_uid != os.getuid() or pathStat.st_mode & 0o077:
+        raise PermissionError(path + ' is not private to the current user')
+
+
+def _remove_stale_socket(socketPath):
+    '''
+    Remove the socket left behind by a daemon that did not exit cleanly.
+
+    Parameters
+    socketPath: string
+        Path of the socket.
+
+    Raise: Exception
+        If another daemon is listening on socketPath, or socketPath is not a socket, e.g., a file given by mistake,
+        which is left as it is.
+    '''
+    try:
+        pathStat = os.lstat(socketPath)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(pathStat.st_mode):
+        raise Exception(socketPath + ' exists and is not a socket')
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socketPath)
+    except OSError:  # nobody is listening
+        os.remove(socketPath)
+        return
+    finally:
+        probe.close()
+    raise Exception('Another daemon is listening on ' + socketPath)
@@ -0,0 +1,101 @@
+import os
+import fnmatch
+import subprocess
+
+from pysqlformatter.src.api import STDIN_PATH
+
+DEFAULT_EXCLUDE = ['.git', '.hg', '.svn', '.tox', '.nox', '.venv', '.eggs', '__pycache__']  # never walked into
+PYTHON_FILE_PATTERN = '*.py'
+
+
+def collect_files(paths, exclude=[]):
+    '''
+    Expand given paths into the files to format. Directories are walked recursively for Python files, skipping those
+    matching the exclude patterns; files are kept as given.
+
+    Parameters
+    paths: list
+        Paths to files and directories.
+    exclude: list
+        Glob patterns of files and directories to skip when walking directories, in addition to DEFAULT_EXCLUDE. A
+        pattern is matched against the name of each file and directory, and against its path relative to the walked
+        directory with '/' separators. E.g., 'build', '*_pb2.py', 'tests/*'.
+
+    Return: list
+        Paths to the files, in the order of paths, each directory's files sorted.
+    '''
+    patterns = DEFAULT_EXCLUDE + list(exclude)
+    filePaths = []
+    for path in paths:
+        if path != STDIN_PATH and os.path.isdir(path):
+            filePaths.extend(_walk_directory(path, patterns))
+        else:
+            filePaths.append(path)
+    return filePaths
+
+
+def is_excluded(relPath, patterns):
+    '''
+    Determine whether a file or directory found when walking a directory is excluded.
+
+    Parameters
+    relPath: string
+        Path relative to the walked directory, with '/' separators.
+    patterns: list
+        Glob patterns of files and directories to skip.
+
+    Return: bool
+        True if its name or relPath matches any of the patterns.
+    '''
+    name = relPath.rsplit('/', 1)[-1]
+    return any(fnmatch.fnmatchcase(name, pattern) or fnmatch.fnmatchcase(relPath, pattern) for pattern in patterns)
+
+
+def get_git_changed_files(ref, cwd=None):
+    '''
+    Return the files that differ between the working tree and a git revision, including untracked files that are not
+    ignored, and excluding deleted files.
+
+    Parameters
+    ref: string
+        The revision to compare with, e.g., 'origin/master' or 'HEAD~1'.
+    cwd: string
+        A directory in the git repository. Default to the current directory.
+
+    Return: set
+        Absolute paths to the files with symlinks resolved, as git resolves those of the repository, to compare with
+        os.path.realpath() of other paths.
+    '''
+    topLevel = _run_git(['rev-parse', '--show-toplevel'], cwd).strip()
+    output = _run_git(['diff', '--name-only', '--diff-filter=d', '-z', ref, '--'], cwd)
+    output += _run_git(['ls-files', '--others', '--exclude-standard', '--full-name', '-z'], cwd)
+    return set(os.path.realpath(os.path.join(topLevel, name)) for name in output.split('\0') if name)
+
+
+def _walk_directory(directory, patterns):
+    '''
+    Return the Python files in a directory and its subdirectories that are not excluded, sorted within each directory.
+    '''
+    filePaths = []
+    for root, dirNames, fileNames in os.walk(directory):
+        relRoot = os.path.relpath(root, directory).replace(os.sep, '/')
+        relRoot = '' if relRoot == '.' else relRoot + '/'
+        dirNames[:] = sorted(dirName for dirName in dirNames if not is_excluded(relRoot + dirName, patterns))  # prune
+        for fileName in sorted(fileNames):
+            if fnmatch.fnmatchcase(fileName, PYTHON_FILE_PATTERN) and not is_excluded(relRoot + fileName, patterns):
+                filePaths.append(os.path.join(root, fileName))
+    return filePaths
+
+
+def _run_git(args, cwd=None):
+    '''
+    Run a git command and return its output.
+
+    Raise: Exception
+        If git fails, with its error message.
+    '''
+    process = subprocess.Popen(['git'] + args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        raise Exception('git {} failed: {}'.format(' '.join(args), stderr.decode('utf-8', 'replace').strip()))
+    return stdout.decode('utf-8')
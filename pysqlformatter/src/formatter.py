@@ -1,68 +1,461 @@
 from __future__ import print_function  # for print() in Python 2
+import os
 import re
-from yapf.yapflib import yapf_api
-from sparksqlformatter import Style
-from sparksqlformatter import api as sparksqlformatter_api
+import threading
+from bisect import bisect_right
 from pysqlformatter.src.tokenizer import Tokenizer
+from pysqlformatter.src.line_index import LineIndex
+from pysqlformatter.src.segments import get_statement_starts, split_segments, SEGMENT_LINES
+from pysqlformatter.src.cache import LRUCache
+from pysqlformatter.src.stats import NO_STATS
+from pysqlformatter.src.styles import STYLE_REGISTRY
+
+NON_BLANK_REGEX = re.compile(r'\S+')
+_yapfLock = threading.Lock()  # yapf keeps the style of a FormatCode() call globally, so calls must not interleave
+MIN_PARALLEL_QUERIES = 64  # fewer distinct queries are formatted faster in this process than by starting a pool
 
 
 class Formatter:
     '''
-    Format a script with Python code and SparkSQL queries.
+    Format a script with Python code and SparkSQL queries. The state of a format() call is kept local to the call, so
+    one Formatter can be shared by several threads.
     '''
-    def __init__(self, pythonStyle='pep8', sparksqlStyle=Style(), queryNames=['query']):
+    def __init__(self,
+                 pythonStyle='pep8',
+                 sparksqlStyle=None,
+                 queryNames=['query'],
+                 queryCacheSize=1024,
+                 reformatChangedLinesOnly=False,
+                 discovery='scan',
+                 queryCallees=['spark.sql'],
+                 queryJobs=1):
         '''
         Parameters
         pythonStyle: string
-            A style name or path to a style config file; interface to https://github.com/google/yapf.
+            A style name or path to a style config file; interface to https://github.com/google/yapf. If None, yapf is
+            not run: only the queries are formatted, and the rest of the script is left as it is, e.g., for code
+            formatted by another tool.
         sparksqlStyle: string, dict, or sparksqlformatter.src.style.Style() object
-            Configurations for the query language; interface to https://github.com/largecats/sparksql-formatter.
+            Configurations for the query language; interface to https://github.com/largecats/sparksql-formatter. If
+            None, use the default Style(). Resolved by pysqlformatter.src.styles.STYLE_REGISTRY.
+        queryNames: list
+            Strings used to identify variables that contain the SparkSQL queries.
+        queryCacheSize: int
+            Maximum number of formatted queries to memoize across all scripts formatted by this Formatter. If 0, every
+            query is formatted anew.
+        reformatChangedLinesOnly: bool
+            If True, after splicing the formatted queries into the yapf output, only run yapf again over the lines of
+            the queries that changed, and skip it if none did. This gives the same result as reformatting the whole
+            script whenever yapf's output is stable under another yapf run, which is the case except for rare comment
+            placements.
+        discovery: string
+            How queries are found in the script: 'scan' scans its text for strings assigned to query names or passed to
+            spark.sql(), see Tokenizer(); 'ast' parses it and also finds queries passed to queryCallees on any object
+            and in keyword arguments, see AstTokenizer().
+        queryCallees: list
+            Dotted names of the functions taking a query as first argument, e.g., 'sql' for any method named sql(). Only
+            used if discovery is 'ast'.
+        queryJobs: int
+            Number of worker processes to format the queries of a script with. If 1, format them in the current
+            process. If None or less than 1, use one worker per CPU. Only scripts with at least MIN_PARALLEL_QUERIES
+            distinct queries that are not in the query cache are formatted in a pool, which is started for each of
+            them, and never in a worker process, e.g., of api.format_files(), since these cannot start processes.
         '''
         self.pythonStyle = pythonStyle
-        self.sparksqlStyle = sparksqlStyle
-        self.pointer = 0  # next position to read
-        self.tokenizer = Tokenizer(queryNames=queryNames)
+        # resolved once, instead of by yapf for every FormatCode() call, which reads config files again
+        self.yapfStyle = None if pythonStyle is None else STYLE_REGISTRY.get_python_style(pythonStyle)
+        self.sparksqlStyle = STYLE_REGISTRY.get_sparksql_style(sparksqlStyle)  # resolved once for all queries
+        if discovery == 'scan':
+            self.tokenizer = Tokenizer(queryNames=queryNames)
+        elif discovery == 'ast':
+            from pysqlformatter.src.ast_tokenizer import AstTokenizer  # imported on first use, as only needed here
+            self.tokenizer = AstTokenizer(queryNames=queryNames, queryCallees=queryCallees)
+        else:
+            raise Exception('Unsupported discovery: ' + str(discovery))
+        self.discovery = discovery
+        self.queryCallees = queryCallees
+        self.queryCache = LRUCache(maxSize=queryCacheSize)
+        self.reformatChangedLinesOnly = reformatChangedLinesOnly
+        self.queryJobs = queryJobs
+
+    def format(self, script, stats=None, lines=None):
+        '''
+        Format the given script.
+
+        Parameters
+        script: string
+            The script to format.
+        stats: pysqlformatter.src.stats.FormatStats() object
+            If given, record in it the time spent in each stage, the number of queries, and the time spent formatting
+            each query. Time spent waiting for another thread's yapf call is counted in the yapf stages.
+        lines: list
+            1-based (first, last) line ranges of the script to format, e.g., the selection in an editor. If given, only
+            these lines and the queries overlapping them are formatted, and the rest of the script is left as it is; see
+            format_lines(). If None, the whole script is formatted.
+
+        Return: string
+            The formatted script.
+        '''
+        if stats is None:
+            stats = NO_STATS
+        if lines is not None:
+            return self.format_lines(script, lines, stats)
+        return self.format_segment(script, stats=stats)
+
+    def format_segments(self, lines, segmentLines=SEGMENT_LINES, stats=None):
+        '''
+        Format a script read line by line one segment of whole top-level statements at a time, see
+        pysqlformatter.src.segments.split_segments(), so that only a segment of the script and of the formatted script
+        are held at once, e.g., for generated scripts of hundreds of megabytes. Each segment is formatted with the last
+        statement before it as context, which gives the same result as formatting the whole script except for rare
+        comment placements and yapf directives spanning segments, e.g., # yapf: disable.
+
+        Parameters
+        lines: iterable
+            Lines of the script with their newlines, e.g., a file object.
+        segmentLines: int
+            Number of lines after which a segment is cut, if a top-level statement starts in them.
+        stats: pysqlformatter.src.stats.FormatStats() object
+            If given, record in it the time spent in each stage and the queries of all segments, whose lines are
+            counted from the start of their segment.
+
+        Return: generator
+            (segment, formattedSegment) pairs, in the order of the script.
+        '''
+        if stats is None:
+            stats = NO_STATS
+        for context, segment in split_segments(lines, segmentLines):
+            yield segment, self.format_segment(segment, context, stats)
+
+    def format_segment(self, script, context='', stats=NO_STATS):
+        '''
+        Format a script, or a segment of whole top-level statements of one.
+
+        Parameters
+        script: string
+            The script or segment to format.
+        context: string
+            The last top-level statement before the segment, or ''; see format_python().
+        stats: pysqlformatter.src.stats.FormatStats() object
+            Timings to record in, or NO_STATS.
+
+        Return: string
+            The formatted script or segment.
+        '''
+        with stats.time_stage('format_python'):
+            pythonReformatted = self.format_python(script, context=context)
+        with stats.time_stage('tokenize'):
+            tokens = self.tokenizer.tokenize(pythonReformatted)  # get all strings passed to spark.sql() in the script
+        stats.tokenCount += len(tokens)
+        return self.get_formatted_script_from_tokens(pythonReformatted, tokens, stats, context=context)
+
+    def format_lines(self, script, lines, stats=NO_STATS):
+        '''
+        Format given line ranges of the script. Only the top-level statements containing the ranges are passed to yapf,
+        which formats the lines in the ranges, so that the time taken does not grow with the length of the script. The
+        queries overlapping the ranges are then formatted, and yapf runs again over the lines of those that changed.
+
+        Parameters
+        script: string
+            The script to format.
+        lines: list
+            1-based (first, last) line ranges to format.
+        stats: pysqlformatter.src.stats.FormatStats() object
+            Timings to record in, or NO_STATS. The lines of the queries are counted from the first formatted statement.
 
-    def format(self, script):
-        pythonReformatted = yapf_api.FormatCode(script, style_config=self.pythonStyle)[0]
-        tokens = self.tokenizer.tokenize(pythonReformatted)  # get all strings passed to spark.sql() in the .py script
-        return self.get_formatted_script_from_tokens(pythonReformatted, tokens)
+        Return: string
+            The script with the lines formatted.
+        '''
+        with stats.time_stage('tokenize'):
+            lineIndex = LineIndex(script)
+            statementStarts = get_statement_starts(script)
+        lineCount = len(lineIndex.lineStarts)
+        firstLine = min(first for first, _ in lines) - 1  # 0-based
+        lastLine = max(last for _, last in lines) - 1
+        segmentStart = statementStarts[max(bisect_right(statementStarts, firstLine) - 1, 0)] if statementStarts else 0
+        nextStatement = bisect_right(statementStarts, lastLine)
+        segmentEnd = statementStarts[nextStatement] if nextStatement < len(statementStarts) else lineCount
+        startPos = lineIndex.get_line_start(min(segmentStart, firstLine))
+        endPos = lineIndex.get_line_start(segmentEnd) if segmentEnd < lineCount else len(script)
+        code = script[startPos:endPos].rstrip()  # the blank lines before the next statement are kept as they are
+        codeStart = lineIndex.get_line_number(startPos)
+        codeLineCount = code.count('\n') + 1
+        codeLines = [(max(first - codeStart, 1), min(last - codeStart, codeLineCount)) for first, last in lines
+                     if last - codeStart >= 1 and first - codeStart <= codeLineCount]
+        if not code or not codeLines:  # only blank lines to format
+            return script
+        with stats.time_stage('format_python'):
+            pythonReformatted = self.format_python(code + '\n', lines=codeLines)
+        with stats.time_stage('tokenize'):
+            tokens = self.tokenizer.tokenize(pythonReformatted)
+            reformattedLines = Formatter.map_lines(code + '\n', pythonReformatted, codeLines)
+            tokens = Formatter.get_tokens_in_lines(tokens, reformattedLines)
+        stats.tokenCount = len(tokens)
+        formattedCode = self.get_formatted_script_from_tokens(pythonReformatted, tokens, stats, changedLinesOnly=True)
+        return script[:startPos] + formattedCode.rstrip('\n') + script[startPos + len(code):]
 
-    def get_formatted_script_from_tokens(self, script, tokens):
+    def get_formatted_script_from_tokens(self, script, tokens, stats=NO_STATS, changedLinesOnly=False, context=''):
         '''
         Format the given script.
 
         Parameters
         scirpt: string
             The script to format.
+        tokens: list
+            Token() objects of the queries in script.
+        stats: pysqlformatter.src.stats.FormatStats() object
+            Timings to record in, or NO_STATS.
+        changedLinesOnly: bool
+            If True, only run yapf again over the lines of the queries that changed, as if
+            self.reformatChangedLinesOnly.
+        context: string
+            The last top-level statement before script if it is a segment of a script, or ''; see format_python().
         
         Return: string
             The formatted script.
         '''
-        formattedScript = ''
+        pointer = 0  # next position to read
+        chunks = []  # pieces of the formatted script, joined once at the end so that assembly is linear in its length
+        lineCount = 0  # number of newlines in chunks
+        changedLines = []  # 1-based (first, last) line ranges in the formatted script of the queries that are changed
+        with stats.time_stage('format_queries'):
+            formattedQueries = self.format_queries_in_parallel(tokens)
+            for token in tokens:
+                with stats.time_query(token):
+                    # will get rid of starting/trailling blank spaces
+                    formattedQuery = formattedQueries.get(token.value.strip()) or self.format_query(token.value)
+
+                formattedQuery = Formatter.indent_query(formattedQuery, token.indent)
+                if not script[(token.start - 3):token.start] in [
+                        "'''", '"""'
+                ]:  # handle queries quoted by '' or "" that are possibly formatted to multiline
+                    if '\n' in formattedQuery:  # if query is multiline
+                        spliceStart = token.start - 1  # remove starting ' or " and replace with triple single quotes
+                        spliceEnd = token.end + 1  # skip pointer over ending ' or "
+                        replacement = "'''\n" + formattedQuery + '\n' + token.indent + "'''"  # add ending triple quotes on a separate line
+                    else:  # if query is single line
+                        spliceStart = token.start
+                        spliceEnd = token.end
+                        replacement = formattedQuery.lstrip()  # remove added indent
+                else:
+                    spliceStart = token.start
+                    spliceEnd = token.end
+                    replacement = '\n' + formattedQuery + '\n' + token.indent  # properly format between triple quotes
+                unchanged = script[pointer:spliceStart]
+                chunks.append(unchanged)
+                chunks.append(replacement)
+                lineCount += unchanged.count('\n')
+                if script[spliceStart:spliceEnd] != replacement:
+                    changedLines.append((lineCount + 1, lineCount + 1 + replacement.count('\n')))
+                lineCount += replacement.count('\n')
+                pointer = spliceEnd
+        chunks.append(script[pointer:])
+        with stats.time_stage('reformat_python'):
+            return self.reformat_python(''.join(chunks), changedLines, changedLinesOnly, context)
+
+    def reformat_python(self, script, changedLines, changedLinesOnly=False, context=''):
+        '''
+        Run yapf again after splicing in the formatted queries, e.g., to re-wrap a call whose quoted query became
+        multiline. If self.reformatChangedLinesOnly, only the changed lines are reformatted, since the rest of the
+        script is already yapf output.
+
+        Parameters
+        script: string
+            The script with the formatted queries spliced in.
+        changedLines: list
+            1-based (first, last) line ranges of the changed queries.
+        changedLinesOnly: bool
+            If True, only reformat the changed lines even if not self.reformatChangedLinesOnly.
+        context: string
+            The last top-level statement before script if it is a segment of a script, or ''; see format_python().
+
+        Return: string
+            The formatted script.
+        '''
+        if not (changedLinesOnly or self.reformatChangedLinesOnly):
+            return self.format_python(script, context=context)
+        if not changedLines:  # nothing was changed, the script is already yapf output
+            return script
+        return self.format_python(script, lines=changedLines, context=context)
+
+    def format_python(self, script, lines=None, context=''):
+        '''
+        Format the Python code in given script with yapf.
+
+        Parameters
+        script: string
+            The script to format.
+        lines: list
+            1-based (first, last) line ranges to format. If None, the whole script is formatted.
+        context: string
+            If script is a segment of whole top-level statements of a script, the last top-level statement before it,
+            with which yapf decides the blank lines and comments before the segment as it would in the whole script.
+            The context is formatted with the segment, and then removed from the result. If '', script is formatted on
+            its own.
+
+        Return: string
+            The formatted script, or the script itself if self.pythonStyle is None.
+        '''
+        if self.pythonStyle is None:  # only the queries are formatted
+            return script
+        if context:
+            contextLineCount = context.count('\n')
+            if lines is not None:
+                lines = [(first + contextLineCount, last + contextLineCount) for first, last in lines]
+            script = context + script
+        from yapf.yapflib import yapf_api, style
+        with _yapfLock:
+            style.SetGlobalStyle(self.yapfStyle)  # used by FormatCode() when given no style_config
+            formattedScript = yapf_api.FormatCode(script, style_config=None, lines=lines)[0]
+        if not context:
+            return formattedScript
+        # yapf only changes blank spaces, so the formatted context ends on the line of its last non-blank character,
+        # and is followed by the segment, which starts on a line of its own
+        contextLength = sum(map(len, context.split()))  # number of non-blank characters
+        contextEnd = 0
+        for matchObj in NON_BLANK_REGEX.finditer(formattedScript):
+            if contextLength <= 0:
+                break
+            contextLength -= len(matchObj.group())
+            contextEnd = matchObj.end()
+        contextEnd = formattedScript.find('\n', contextEnd) + 1 or len(formattedScript)
+        if contextLength != 0 or ''.join(formattedScript[:contextEnd].split()) != ''.join(context.split()):
+            raise Exception('Cannot format segment apart from the statement before it')
+        return formattedScript[contextEnd:]
+
+    def format_query(self, query):
+        '''
+        Format given query, reusing the result of an identical query formatted before.
+
+        Parameters
+        query: string
+            The query to format.
+
+        Return: string
+            The formatted query, without starting and trailing blank spaces.
+        '''
+        key = (query.strip(), self.sparksqlStyle)  # the formatted query does not depend on surrounding blank spaces
+        formattedQuery = self.queryCache.get(key)
+        if formattedQuery is None:
+            from sparksqlformatter import api as sparksqlformatter_api
+            formattedQuery = sparksqlformatter_api.format_query(query, self.sparksqlStyle)
+            self.queryCache.put(key, formattedQuery)
+        return formattedQuery
+
+    def format_queries_in_parallel(self, tokens):
+        '''
+        Format the distinct queries of given tokens that are not in the query cache in a pool of self.queryJobs worker
+        processes, if there are enough of them to make up for starting the pool. Each query is formatted as
+        format_query() would, so that the script is formatted the same as in the current process.
+
+        Parameters
+        tokens: list
+            Token() objects of the queries in a script.
+
+        Return: dict
+            Query without starting and trailing blank spaces -> formatted query, for the queries formatted in the pool,
+            which are also stored in the query cache. Empty if the queries are to be formatted in the current process.
+        '''
+        if self.queryJobs == 1 or len(tokens) < MIN_PARALLEL_QUERIES:
+            return {}
+        import multiprocessing  # only needed, and imported, when formatting in worker processes
+        if multiprocessing.current_process().daemon:  # a worker process, which cannot start processes
+            return {}
+        queries = {}  # query without surrounding blank spaces -> first such query in the script, in order
+        for token in tokens:
+            key = token.value.strip()
+            if key not in queries and (key, self.sparksqlStyle) not in self.queryCache:
+                queries[key] = token.value
+        if len(queries) < MIN_PARALLEL_QUERIES:
+            return {}
+        jobs = self.queryJobs if self.queryJobs is not None and self.queryJobs >= 1 else os.cpu_count() or 1
+        jobs = min(jobs, len(queries))
+        chunkSize = max(1, len(queries) // (jobs * 4))  # small chunks keep workers balanced on skewed query sizes
+        with multiprocessing.Pool(processes=jobs, initializer=_init_query_worker,
+                                  initargs=(self.sparksqlStyle, )) as pool:
+            formattedQueries = dict(zip(queries, pool.map(_format_query_in_worker, queries.values(), chunkSize)))
+        for key, formattedQuery in formattedQueries.items():
+            self.queryCache.put((key, self.sparksqlStyle), formattedQuery)
+        return formattedQueries
+
+    def query_cache_info(self):
+        '''
+        Return: pysqlformatter.src.cache.CacheInfo
+            Hits, misses, maximum and current size of the memo of formatted queries.
+        '''
+        return self.queryCache.info()
+
+    @staticmethod
+    def map_lines(script, formattedScript, lines):
+        '''
+        Find where given line ranges of a script are in the script formatted by yapf over these ranges, which only
+        changes the lines in them, and possibly their number.
+
+        Parameters
+        script: string
+            The script.
+        formattedScript: string
+            The script formatted over lines.
+        lines: list
+            1-based (first, last) line ranges in script.
+
+        Return: list
+            1-based (first, last) line ranges in formattedScript of the same lines.
+        '''
+        import difflib  # imported on first use, as it is only needed to format line ranges
+        scriptLines = script.split('\n')
+        formattedLines = formattedScript.split('\n')
+        # lines before the first and after the last difference are the same in both, so that difflib only has to match
+        # the lines in between, which are few when the ranges are
+        prefixLength = 0
+        maxLength = min(len(scriptLines), len(formattedLines))
+        while prefixLength < maxLength and scriptLines[prefixLength] == formattedLines[prefixLength]:
+            prefixLength += 1
+        suffixLength = 0
+        while (suffixLength < maxLength - prefixLength
+               and scriptLines[-1 - suffixLength] == formattedLines[-1 - suffixLength]):
+            suffixLength += 1
+        matcher = difflib.SequenceMatcher(None,
+                                          scriptLines[prefixLength:len(scriptLines) - suffixLength],
+                                          formattedLines[prefixLength:len(formattedLines) - suffixLength],
+                                          autojunk=False)
+        # (scriptStart, scriptEnd, formattedStart, formattedEnd) 0-based line blocks of the script, in order
+        blocks = [(0, prefixLength, 0, prefixLength)]
+        blocks.extend((i1 + prefixLength, i2 + prefixLength, j1 + prefixLength, j2 + prefixLength)
+                      for _, i1, i2, j1, j2 in matcher.get_opcodes())
+        blocks.append((len(scriptLines) - suffixLength, len(scriptLines), len(formattedLines) - suffixLength,
+                       len(formattedLines)))
+
+        def map_line(lineNumber, isLast):
+            for scriptStart, scriptEnd, formattedStart, formattedEnd in blocks:
+                if scriptStart <= lineNumber < scriptEnd:
+                    if scriptEnd - scriptStart == formattedEnd - formattedStart:  # lines of the block match one to one
+                        return formattedStart + lineNumber - scriptStart
+                    # a changed block maps as a whole
+                    return max(formattedEnd - 1, formattedStart) if isLast else formattedStart
+            return len(formattedLines) - 1  # past the end of the script
+
+        return [(map_line(first - 1, False) + 1, map_line(last - 1, True) + 1) for first, last in lines]
+
+    @staticmethod
+    def get_tokens_in_lines(tokens, lines):
+        '''
+        Parameters
+        tokens: list
+            Token() objects of the queries in a script.
+        lines: list
+            1-based (first, last) line ranges in the script.
+
+        Return: list
+            The tokens with a line in any of the ranges.
+        '''
+        tokensInLines = []
         for token in tokens:
-            formattedScript += script[self.pointer:token.start]
-            formattedQuery = sparksqlformatter_api.format_query(
-                token.value, self.sparksqlStyle)  # will get rid of starting/trailling blank spaces
-
-            formattedQuery = Formatter.indent_query(formattedQuery, token.indent)
-            if not script[(token.start - 3):token.start] in [
-                    "'''", '"""'
-            ]:  # handle queries quoted by '' or "" that are possibly formatted to multiline
-                if '\n' in formattedQuery:  # if query is multiline
-                    formattedScript = formattedScript[:-1] + "'''\n"  # remove starting ' or " and replace with triple single quotes
-                    formattedScript += formattedQuery
-                    formattedScript += '\n' + token.indent + "'''"  # add ending triple quotes on a separate line
-                    self.pointer = token.end + 1  # skip pointer over ending ' or "
-                else:  # if query is single line
-                    formattedScript += formattedQuery.lstrip()  # remove added indent
-                    self.pointer = token.end
-            else:
-                formattedScript += '\n' + formattedQuery + '\n' + token.indent  # properly format between triple quotes
-                self.pointer = token.end
-        formattedScript += script[self.pointer:]
-        self.reset()
-        return yapf_api.FormatCode(formattedScript, style_config=self.pythonStyle)[0]
+            firstLine = token.lineIndex.get_line_number(token.start) + 1
+            lastLine = token.lineIndex.get_line_number(token.end) + 1
+            if any(firstLine <= last and lastLine >= first for first, last in lines):
+                tokensInLines.append(token)
+        return tokensInLines
 
     @staticmethod
     def indent_query(query, indent):
@@ -83,8 +476,25 @@ class Formatter:
         indentedQuery = '\n'.join(lines)
         return indentedQuery
 
-    def reset(self):
-        '''
-        Reset the formatter after finishing formatting a script.
-        '''
-        self.pointer = 0
+
+def _init_query_worker(sparksqlStyle):
+    '''
+    Initializer of the worker processes of Formatter.format_queries_in_parallel().
+    '''
+    global _workerSparksqlStyle
+    _workerSparksqlStyle = sparksqlStyle
+
+
+def _format_query_in_worker(query):
+    '''
+    The task run by the worker processes of Formatter.format_queries_in_parallel().
+
+    Parameters
+    query: string
+        The query to format.
+
+    Return: string
+        The formatted query, as returned by Formatter.format_query().
+    '''
+    from sparksqlformatter import api as sparksqlformatter_api
+    return sparksqlformatter_api.format_query(query, _workerSparksqlStyle)
@@ -0,0 +1,134 @@
+from bisect import bisect_right
+from itertools import accumulate
+
+if hasattr(str, 'isascii'):
+    _is_ascii = str.isascii
+else:  # Python < 3.7
+
+    def _is_ascii(text):
+        return all(ord(char) < 128 for char in text)
+
+
+class LineIndex:
+    '''
+    Index of the line boundaries of a script, so that the line and indentation of any position can be found in
+    O(log n) instead of by scanning the script character by character.
+    '''
+    def __init__(self, script):
+        '''
+        Parameters
+        script: string
+            The script to index.
+        '''
+        self.script = script
+        self.lineStarts = [0]  # positions of the first character of every line, in increasing order
+        self.lineStarts.extend(accumulate(len(line) + 1 for line in script.split('\n')))
+        self.lineStarts.pop()  # the last one is past the end of the script
+        self.indents = {}  # line number -> indentation string, filled on demand
+
+    def get_line_number(self, pos):
+        '''
+        Get the 0-based number of the line containing given position. A '\n' belongs to the line it ends.
+
+        Parameters
+        pos: int
+            Position in the script.
+
+        Return: int
+            The line number.
+        '''
+        return bisect_right(self.lineStarts, pos) - 1
+
+    def get_line_start(self, lineNumber):
+        '''
+        Get position of the first character of given line.
+
+        Parameters
+        lineNumber: int
+            0-based line number.
+
+        Return: int
+            Position of the start of the line.
+        '''
+        return self.lineStarts[lineNumber]
+
+    def get_position(self, lineNumber, byteOffset):
+        '''
+        Get position of a character given by its line and the offset of its UTF-8 encoding in the line, as in the
+        col_offset of ast nodes.
+
+        Parameters
+        lineNumber: int
+            0-based line number.
+        byteOffset: int
+            Offset in bytes from the start of the line.
+
+        Return: int
+            Position in the script.
+        '''
+        lineStart = self.lineStarts[lineNumber]
+        if _is_ascii(self.script[lineStart:lineStart + byteOffset]):  # as many characters as bytes
+            return lineStart + byteOffset
+        lineEnd = self.lineStarts[lineNumber + 1] if lineNumber + 1 < len(self.lineStarts) else len(self.script)
+        lineBytes = self.script[lineStart:lineEnd].encode('utf-8')
+        return lineStart + len(lineBytes[:byteOffset].decode('utf-8'))
+
+    def get_line_indent(self, pos):
+        '''
+        Get indentation of the line of given position in script.
+
+        Parameters
+        pos: int
+            Position to get indentation for.
+
+        Return: string
+            Indentation of the line containing given position.
+        '''
+        lineNumber = self.get_line_number(pos)
+        indent = self.indents.get(lineNumber)
+        if indent is None:
+            script = self.script
+            startOfLine = self.get_line_start(lineNumber)
+            endOfIndent = startOfLine
+            # find position of the first non-space character in the line
+            while endOfIndent < len(script) and script[endOfIndent] != '\n' and script[endOfIndent].isspace():
+                endOfIndent += 1
+            indent = script[startOfLine:endOfIndent]
+            self.indents[lineNumber] = indent
+        return indent
+
+    def get_query_start(self, pos):
+        '''
+        Get position of the start of the first line of the actual query in a query match.
+
+        Parameters
+        pos: int
+            Position to get indentation for.
+
+        Return: int
+            Position of the start of the first line of the query.
+        '''
+        startOfQuery = pos
+        # skip \n after the opening '''/"""
+        while startOfQuery < len(self.script) and self.script[startOfQuery] == '\n':
+            startOfQuery += 1
+        return startOfQuery
+
+    def get_prev_line_end(self, pos):
+        '''
+        Get position of the end of the previous non-empty line.
+
+        Parameters
+        pos: int
+            Position to get indentation for.
+
+        Return: int
+            Position of the last character in the previous non-empty line, or 0 if there is none.
+        '''
+        lineNumber = self.get_line_number(pos) - 1
+        # skip empty lines
+        while lineNumber >= 0 and self.lineStarts[lineNumber + 1] - self.lineStarts[lineNumber] == 1:
+            lineNumber -= 1
+        if lineNumber < 0:
+            return 0
+        return self.lineStarts[lineNumber + 1] - 2  # the character before the '\n' ending the line
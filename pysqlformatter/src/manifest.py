@@ -0,0 +1,101 @@
+from io import open
+import os
+import json
+import hashlib
+import tempfile
+
+MANIFEST_FORMAT_VERSION = 1
+DEFAULT_MANIFEST_PATH = '.pysqlformatter-manifest.json'
+
+
+class Manifest:
+    '''
+    Record of the files known to be formatted with given settings, so that later runs can skip them. A file is
+    recorded with its modification time, size and content hash: it is unchanged if its modification time and size are
+    the same, or else if its content hash is, e.g., after a fresh checkout.
+    '''
+    def __init__(self, manifestPath=DEFAULT_MANIFEST_PATH, settingsFingerprint=None):
+        '''
+        Parameters
+        manifestPath: string
+            Path to the manifest file. It is read if it exists and was written with the same settings.
+        settingsFingerprint: string
+            Fingerprint of the formatting settings, e.g., from pysqlformatter.src.cache.get_settings_fingerprint().
+            Files recorded with other settings are not formatted with these.
+        '''
+        self.manifestPath = manifestPath
+        self.settingsFingerprint = settingsFingerprint
+        self.entries = {}  # absolute path -> [mtime, size, hash]
+        try:
+            with open(file=manifestPath, mode='r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):  # missing or corrupt
+            return
+        if manifest.get('version') == MANIFEST_FORMAT_VERSION and manifest.get('settings') == settingsFingerprint:
+            self.entries = manifest.get('files', {})
+
+    def is_changed(self, filePath):
+        '''
+        Determine whether a file may need formatting.
+
+        Parameters
+        filePath: string
+            Path to the file.
+
+        Return: bool
+            False if the file is unchanged since it was recorded, else True.
+        '''
+        key = os.path.abspath(filePath)
+        entry = self.entries.get(key)
+        if entry is None:
+            return True
+        try:
+            stat = os.stat(filePath)
+        except OSError:
+            return True
+        mtime, size, contentHash = entry
+        if stat.st_mtime == mtime and stat.st_size == size:
+            return False
+        if stat.st_size != size or _hash_file(filePath) != contentHash:
+            return True
+        entry[0] = stat.st_mtime  # touched but not modified
+        return False
+
+    def record(self, filePath):
+        '''
+        Record a file as formatted, as it is now.
+
+        Parameters
+        filePath: string
+            Path to the file.
+        '''
+        stat = os.stat(filePath)
+        self.entries[os.path.abspath(filePath)] = [stat.st_mtime, stat.st_size, _hash_file(filePath)]
+
+    def save(self):
+        '''
+        Write the manifest file atomically, forgetting files that no longer exist.
+        '''
+        entries = dict((key, entry) for key, entry in self.entries.items() if os.path.isfile(key))
+        manifest = {'version': MANIFEST_FORMAT_VERSION, 'settings': self.settingsFingerprint, 'files': entries}
+        manifestDir = os.path.dirname(os.path.abspath(self.manifestPath))
+        fd, tempPath = tempfile.mkstemp(dir=manifestDir, prefix='.tmp-manifest-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(manifest, f, sort_keys=True)
+            os.replace(tempPath, self.manifestPath)
+        except BaseException:
+            os.remove(tempPath)
+            raise
+
+
+def _hash_file(filePath):
+    '''
+    Return: string
+        Hex digest of the content of given file.
+    '''
+    digest = hashlib.sha256()
+    with open(file=filePath, mode='rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,186 @@
+import re
+
+from pysqlformatter.src.tokenizer import STRING_BODY_REGEXES
+
+SCAN_REGEX = re.compile(r'[\'"#()\[\]{}\\\n]')  # characters that may change the lexical state of the scan
+OPENING_BRACKETS = '([{'
+CLOSING_BRACKETS = ')]}'
+CONTINUATION_KEYWORDS = ('else', 'elif', 'except', 'finally')  # clauses continuing the statement before them
+SEGMENT_LINES = 1000  # default number of lines after which split_segments() cuts a segment
+
+
+def get_statement_starts(script):
+    '''
+    Find the lines where the top-level statements of a script start, so that the script can be split there into pieces
+    that yapf formats as it would format them in the whole script. Like Tokenizer.get_queries(), the scan jumps from one
+    string, comment or bracket to the next, and is linear in the length of the script.
+
+    A line starts a top-level statement if it starts with code at the first column, outside of any string or bracket
+    and not after a backslash continuation, unless it continues the statement before it, e.g., with else:, or that
+    statement is a decorator.
+
+    Parameters
+    script: string
+        The script.
+
+    Return: list
+        0-based numbers of the lines starting a top-level statement, in increasing order. Only the lines before the
+        first unterminated string are considered.
+    '''
+    statementStarts = []
+    afterDecorator = False  # True if the last top-level statement is a decorator, which the next one belongs with
+    for lineNumber, pos in get_line_starts(script):
+        char = script[pos]
+        if not (char.isspace() or char == '#' or char in CLOSING_BRACKETS or is_continuation(script, pos)):
+            if not afterDecorator:
+                statementStarts.append(lineNumber)
+            afterDecorator = char == '@'
+    return statementStarts
+
+
+def get_line_starts(script):
+    '''
+    Find the lines of a script that start outside of any string or bracket and not after a backslash continuation.
+
+    Parameters
+    script: string
+        The script.
+
+    Return: generator
+        (lineNumber, pos) of the lines found, with 0-based line numbers, in increasing order, except an empty last
+        line. Only the lines before the first unterminated string are considered.
+    '''
+    depth = 0  # number of open brackets
+    lineNumber = 0
+    pos = 0
+    atLineStart = True  # True if pos is at the start of a line, not after a backslash continuation
+    while True:
+        if atLineStart and depth == 0 and pos < len(script):
+            yield lineNumber, pos
+        atLineStart = False
+        matchObj = SCAN_REGEX.search(script, pos)
+        if matchObj is None:
+            break
+        start = matchObj.start()
+        char = script[start]
+        if char == '\n':
+            lineNumber += 1
+            pos = start + 1
+            atLineStart = True
+        elif char == '#':
+            end = script.find('\n', start)
+            if end == -1:
+                break
+            pos = end
+        elif char == '\\':  # escapes the next character, e.g., a newline continuing the line
+            lineNumber += script.count('\n', start + 1, start + 2)
+            pos = start + 2
+        elif char in OPENING_BRACKETS:
+            depth += 1
+            pos = start + 1
+        elif char in CLOSING_BRACKETS:
+            depth = max(depth - 1, 0)
+            pos = start + 1
+        else:
+            quote = char * 3 if script.startswith(char * 3, start) else char
+            contentEnd = STRING_BODY_REGEXES[quote].match(script, start + len(quote)).end()
+            if not script.startswith(quote, contentEnd):  # unterminated
+                break
+            lineNumber += script.count('\n', start, contentEnd)
+            pos = contentEnd + len(quote)
+
+
+def is_continuation(script, pos):
+    '''
+    Return: bool
+        True if the line at pos starts with a keyword continuing the statement before it, e.g., else:.
+    '''
+    for keyword in CONTINUATION_KEYWORDS:
+        if script.startswith(keyword, pos):
+            nextPos = pos + len(keyword)
+            if nextPos == len(script) or not (script[nextPos].isalnum() or script[nextPos] == '_'):
+                return True
+    return False
+
+
+def split_segments(lines, segmentLines=SEGMENT_LINES):
+    '''
+    Split a script read line by line into segments of whole top-level statements, so that it can be formatted one
+    segment at a time without holding all of it. Lines are buffered until there are segmentLines of them, and the
+    buffer is then cut before the last top-level statement in it, together with the blank lines and comments at the
+    first column before that statement, which yapf formats with it. A statement longer than the buffer is read whole
+    before cutting, rescanning it each time its length doubles, so that the scan stays linear.
+
+    Parameters
+    lines: iterable
+        Lines of the script with their newlines, e.g., a file object.
+    segmentLines: int
+        Number of lines after which a segment is cut, if a top-level statement starts in them.
+
+    Return: generator
+        (context, segment) pairs, at least one. The segments joined together are the script. context is the last
+        top-level statement before the segment, '' for the first one, which decides how yapf separates the segment
+        from it.
+    '''
+    buffer = []  # lines read and not yielded yet
+    scanLineCount = segmentLines  # length of the buffer at which to look for a cut
+    context = ''
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) < scanLineCount:
+            continue
+        cut = get_cut(buffer)
+        if cut is None:  # a single statement so far
+            scanLineCount = 2 * len(buffer)
+            continue
+        contextStart, cutLine = cut
+        yield context, ''.join(buffer[:cutLine])
+        context = ''.join(buffer[contextStart:cutLine])
+        del buffer[:cutLine]
+        scanLineCount = len(buffer) + segmentLines
+    yield context, ''.join(buffer)  # the buffer keeps the last statement, and is only empty if the script is
+
+
+def get_cut(lines):
+    '''
+    Find where to cut buffered lines of a script into a segment of whole top-level statements and the rest. The blank
+    lines and comments after the last statement of the segment go with the next statement if yapf attaches them to it,
+    i.e., unless they are comments indented at least as much as the block of a compound statement, which belong to it.
+
+    Parameters
+    lines: list
+        Lines of the script from the start of a segment, with their newlines.
+
+    Return: tuple
+        (contextStart, cutLine): 0-based line numbers of the last top-level statement of the segment and of the end of
+        the segment, i.e., the first of the blank lines and comments that go with the next statement. None if no
+        statement can end a segment.
+    '''
+    statementStarts = get_statement_starts(''.join(lines))
+    if len(statementStarts) < 2:
+        return None
+    contextStart, cutLine = statementStarts[-2:]
+    # lines of the last statement of the segment that start outside of strings and brackets, so that its blank and
+    # comment lines can be told from those of a multiline string
+    lineStarts = [contextStart + lineNumber for lineNumber, _ in get_line_starts(''.join(lines[contextStart:cutLine]))]
+    blockIndent = min([
+        get_indent(lines[lineNumber])
+        for lineNumber in lineStarts if lines[lineNumber][0] in ' \t' and not lines[lineNumber].lstrip().startswith('#')
+    ] or [None])
+    lineStarts = set(lineStarts)
+    while cutLine - 1 in lineStarts:
+        line = lines[cutLine - 1]
+        if line.strip() and not (line.lstrip().startswith('#') and
+                                 (blockIndent is None or get_indent(line) < blockIndent)):
+            break
+        cutLine -= 1
+    return contextStart, cutLine
+
+
+def get_indent(line):
+    '''
+    Return: int
+        Width of the indentation of a line, with tabs to multiples of 8 columns as in the tokenizer of yapf.
+    '''
+    line = line.expandtabs(8)
+    return len(line) - len(line.lstrip(' '))
@@ -0,0 +1,128 @@
+import time
+import contextlib
+import collections
+
+# stages of formatting a file, in order; those of Formatter.format() are between read and output
+STAGES = ['read', 'format_python', 'tokenize', 'format_queries', 'reformat_python', 'output']
+
+QueryStats = collections.namedtuple('QueryStats', ['start', 'end', 'line', 'duration'])
+
+
+class FormatStats:
+    '''
+    Timings of formatting one script, filled in when passed to Formatter.format() or api.format_files(profile=True).
+    Only holds plain data, so that it can be sent back from worker processes.
+    '''
+    def __init__(self, filePath=None):
+        '''
+        Parameters
+        filePath: string
+            Path to the file of the script, if any.
+        '''
+        self.filePath = filePath
+        self.stageTimes = collections.OrderedDict()  # stage -> seconds, in the order the stages ran
+        self.tokenCount = 0  # number of queries found in the script
+        self.queries = []  # QueryStats of every query, in the order of the script
+        self.resultCached = False  # True if the formatted script was read from the result cache
+
+    @contextlib.contextmanager
+    def time_stage(self, stage):
+        '''
+        Time the enclosed block as given stage, adding to the time already spent in it.
+
+        Parameters
+        stage: string
+            One of STAGES.
+        '''
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stageTimes[stage] = self.stageTimes.get(stage, 0.0) + time.perf_counter() - startTime
+
+    @contextlib.contextmanager
+    def time_query(self, token):
+        '''
+        Time the enclosed block as the formatting of the query of given token.
+
+        Parameters
+        token: pysqlformatter.src.token.Token() object
+            The query, with its offsets in the script as formatted by the first yapf pass.
+        '''
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.queries.append(
+                QueryStats(start=token.start,
+                           end=token.end,
+                           line=token.lineIndex.get_line_number(token.start) + 1,
+                           duration=time.perf_counter() - startTime))
+
+    @property
+    def totalTime(self):
+        '''
+        Seconds spent in all stages.
+        '''
+        return sum(self.stageTimes.values())
+
+    def get_slowest_queries(self, count):
+        '''
+        Parameters
+        count: int
+            Maximum number of queries to return.
+
+        Return: list
+            QueryStats of the slowest queries, slowest first.
+        '''
+        return sorted(self.queries, key=lambda query: query.duration, reverse=True)[:count]
+
+
+class NoStats:
+    '''
+    Stand-in for FormatStats() when no timings are wanted, so that callers need not check for None.
+    '''
+    filePath = None
+    tokenCount = 0  # read by stats.tokenCount += ..., whose result is then dropped
+
+    def time_stage(self, stage):
+        return _NULL_CONTEXT
+
+    def time_query(self, token):
+        return _NULL_CONTEXT
+
+    def __setattr__(self, name, value):  # e.g., tokenCount and resultCached
+        pass
+
+
+class _NullContext:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *excInfo):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+NO_STATS = NoStats()
+
+
+def get_slowest(statsList, count):
+    '''
+    Find the slowest files and queries among the timings of several files.
+
+    Parameters
+    statsList: list
+        FormatStats() objects; None entries, e.g., of files that failed, are skipped.
+    count: int
+        Maximum number of files and of queries to return.
+
+    Return: tuple
+        (FormatStats() objects of the slowest files, (FormatStats() object, QueryStats) pairs of the slowest queries),
+        slowest first.
+    '''
+    statsList = [stats for stats in statsList if stats is not None]
+    slowestFiles = sorted(statsList, key=lambda stats: stats.totalTime, reverse=True)[:count]
+    queries = [(stats, query) for stats in statsList for query in stats.get_slowest_queries(count)]
+    slowestQueries = sorted(queries, key=lambda pair: pair[1].duration, reverse=True)[:count]
+    return slowestFiles, slowestQueries
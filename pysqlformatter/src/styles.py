@@ -0,0 +1,132 @@
+from io import open
+import os
+import ast
+import stat
+
+
+class StyleRegistry:
+    '''
+    Resolve styles given as names, paths to config files, dictionaries or dictionaries in strings once, instead of for
+    every file or query formatted with them. Resolved styles and fingerprints are kept until the config file they were
+    read from changes, as told by its modification time and size, so that a long-running process picks up edits.
+    '''
+    def __init__(self):
+        self.pythonStyles = {}  # style key -> (file stamp, yapf style dict)
+        self.sparksqlStyles = {}  # style key -> (file stamp, sparksqlformatter.src.style.Style() object)
+        self.fingerprints = {}  # style key -> (file stamp, fingerprint)
+        self.defaultSparksqlStyle = None  # Style() object used for None, created on first use
+
+    def get_python_style(self, style):
+        '''
+        Resolve a Python style, as yapf would for every FormatCode() call given the style.
+
+        Parameters
+        style: string or dict
+            A style name, a path to a style config file, a dictionary in string, or a dictionary; interface to
+            https://github.com/google/yapf.
+
+        Return: dict
+            The resolved yapf style, to pass to yapf.yapflib.style.SetGlobalStyle(). The same object is returned for
+            the same style as long as its config file is unchanged.
+        '''
+        from yapf.yapflib import style as yapfStyle  # imported on first use, to keep importing pysqlformatter fast
+        if not isinstance(style, (str, dict)):
+            raise Exception('Unsupported style type: ' + type(style).__name__)
+        key = get_style_key(style)
+        stamp = get_file_stamp(style)
+        entry = self.pythonStyles.get(key)
+        if entry is None or entry[0] != stamp:
+            entry = (stamp, yapfStyle.CreateStyleFromConfig(style))
+            self.pythonStyles[key] = entry
+        return entry[1]
+
+    def get_sparksql_style(self, style):
+        '''
+        Resolve a SparkSQL style.
+
+        Parameters
+        style: string, dict, or sparksqlformatter.src.style.Style() object
+            Configurations for the query language: a path to a config file, a dictionary in string, a dictionary, or a
+            Style() object, which is returned as it is. If None, use the default Style(), shared by all such calls.
+
+        Return: sparksqlformatter.src.style.Style() object
+            The resolved style. The same object is returned for the same style as long as its config file is unchanged.
+        '''
+        from sparksqlformatter import Style  # imported on first use, to keep importing pysqlformatter fast
+        from sparksqlformatter import api as sparksqlAPI
+        if style is None:
+            if self.defaultSparksqlStyle is None:
+                self.defaultSparksqlStyle = Style()
+            return self.defaultSparksqlStyle
+        if isinstance(style, Style):
+            return style
+        if not isinstance(style, (str, dict)):
+            raise Exception('Unsupported style type: ' + type(style).__name__)
+        key = get_style_key(style)
+        stamp = get_file_stamp(style)
+        entry = self.sparksqlStyles.get(key)
+        if entry is None or entry[0] != stamp:
+            if isinstance(style, dict):
+                resolvedStyle = sparksqlAPI._create_style_from_dict(style)
+            elif style.startswith('{'):  # dictionary in string
+                resolvedStyle = sparksqlAPI._create_style_from_dict(ast.literal_eval(style))
+            else:  # path to config file
+                resolvedStyle = sparksqlAPI._create_style_from_file(style)
+            entry = (stamp, resolvedStyle)
+            self.sparksqlStyles[key] = entry  # another thread may resolve the same style meanwhile, which is harmless
+        return entry[1]
+
+    def get_fingerprint(self, style):
+        '''
+        Return a JSON-serializable fingerprint of a Python or SparkSQL style, which changes when the style changes.
+
+        Parameters
+        style: string, dict, or object
+            A style name, a path to a style config file, a dictionary in string, a dictionary, or a style object.
+
+        Return: string, dict, or list
+            The style itself if it is a name or dictionary; the path and content of the config file if it is a path to
+            a file; the attributes of the style object otherwise.
+        '''
+        if style is None or isinstance(style, dict):
+            return style
+        if not isinstance(style, str):
+            return {name: repr(value) for name, value in sorted(vars(style).items())}
+        stamp = get_file_stamp(style)
+        if stamp is None:
+            return style
+        entry = self.fingerprints.get(style)
+        if entry is None or entry[0] != stamp:
+            with open(file=style, mode='r', encoding='utf-8') as f:
+                entry = (stamp, [style, f.read()])
+            self.fingerprints[style] = entry
+        return entry[1]
+
+
+def get_style_key(style):
+    '''
+    Return: string
+        A hashable key identifying a style given as a string or dictionary.
+    '''
+    if isinstance(style, dict):
+        return repr(sorted(style.items()))
+    return style
+
+
+def get_file_stamp(style):
+    '''
+    Return: tuple
+        (modification time, size) of the config file if style is a path to one, else None.
+    '''
+    if not isinstance(style, str) or style.startswith('{'):
+        return None
+    try:
+        fileStat = os.stat(style)
+    except OSError:
+        return None
+    if not stat.S_ISREG(fileStat.st_mode):
+        return None
+    return (fileStat.st_mtime_ns, fileStat.st_size)
+
+
+STYLE_REGISTRY = StyleRegistry()  # shared by all formatters of the process
@@ -4,111 +4,63 @@ class TokenType:
 
 
 class Token:
-    def __init__(self, type, value, start, end, script):
+    '''
+    A query found in a script. Only the offsets are stored, since there would be many instances of Token; the value and
+    indentation are looked up from the script on first access.
+    '''
+    __slots__ = 'type', 'start', 'end', 'lineIndex', '_indent'
+
+    def __init__(self, type, start, end, lineIndex):
         '''
         Parameters:
         type: string
             TokenType.
-        value: string
         start: int
             Position of the token's first character.
         end: int
-            Position of the token's last character.
-        script: string
-            The script containing the token.
+            Position after the token's last character.
+        lineIndex: pysqlformatter.src.line_index.LineIndex() object
+            Line index of the script containing the token.
         '''
-        __slots__ = 'value', 'start', 'end', 'type'  # saves space since there would be many instances of Token
-        self.value = value
+        self.type = type
         self.start = start
         self.end = end
-        self.type = type
-        self.indent = self.get_token_indent(start, script)
+        self.lineIndex = lineIndex
+        self._indent = None
+
+    @property
+    def value(self):
+        '''
+        The query, i.e., the content of the script between start and end.
+        '''
+        return self.lineIndex.script[self.start:self.end]
+
+    @property
+    def indent(self):
+        '''
+        The token's indentation when formatting the script, computed on first access.
+        '''
+        if self._indent is None:
+            self._indent = self.get_token_indent(self.start, self.lineIndex)
+        return self._indent
 
-    def get_token_indent(self, start, script):
+    @staticmethod
+    def get_token_indent(start, lineIndex):
         '''
         Determine the token's indentation when formatting the script.
 
         Parameters
         start: int
             Start of the token.
-        script: string
-            The script containing the token.
+        lineIndex: pysqlformatter.src.line_index.LineIndex() object
+            Line index of the script containing the token.
         
         Return: string
             The token's indentation.
         '''
-        queryStart = Token.get_query_start(start, script)
-        currLineIndent = Token.get_line_indent(queryStart, script)
-        prevLineEnd = Token.get_prev_line_end(queryStart, script)
-        prevLineIndent = Token.get_line_indent(prevLineEnd, script)
+        queryStart = lineIndex.get_query_start(start)
         if queryStart == start:  # if there are no starting \n, align with current line
-            indent = currLineIndent
+            indent = lineIndex.get_line_indent(queryStart)
         else:  # align with previous line
-            indent = prevLineIndent
-        # indent = currLineIndent if len(currLineIndent) > len(prevLineIndent) else prevLineIndent
+            indent = lineIndex.get_line_indent(lineIndex.get_prev_line_end(queryStart))
         return indent
-
-    @staticmethod
-    def get_line_indent(pos, script):
-        '''
-        Get indentation of the line of given position in script.
-
-        Parameters
-        pos: int
-            Position to get indentation for.
-        script: string
-            Script to format.
-        
-        Return: string
-            Indentation of the line containing given position.
-        '''
-        startOfLine = pos
-        while startOfLine > 0 and (script[startOfLine] != '\n'):  # find start of line
-            startOfLine -= 1
-        startOfLine += 1
-        indent = 0
-        # find position of the first non-space character in the line
-        while (script[startOfLine + indent] != '\n') and script[startOfLine + indent].isspace():
-            indent += 1
-        indentString = script[startOfLine:startOfLine + indent]
-        return indentString
-
-    @staticmethod
-    def get_query_start(pos, script):
-        '''
-        Get position of the start of the first line of the actual query in a query match.
-
-        Parameters
-        pos: int
-            Position to get indentation for.
-        script: string
-            Script to format.
-        
-        Return: int
-            Position of the start of the first line of the query.
-        '''
-        startOfQuery = pos
-        while script[startOfQuery] == '\n':  # skip \n after the opening '''/"""
-            startOfQuery += 1
-        return startOfQuery
-
-    @staticmethod
-    def get_prev_line_end(pos, script):
-        '''
-        Get position of the end of the previous non-empty line.
-
-        Parameters
-        pos: int
-            Position to get indentation for.
-        script: string
-            Script to format.
-
-        Return: int
-            Position of the last character in the previous line.
-        '''
-        endOfPrevLine = pos
-        while endOfPrevLine > 0 and script[endOfPrevLine] != '\n':
-            endOfPrevLine -= 1
-        while script[endOfPrevLine] == '\n':
-            endOfPrevLine -= 1
-        return endOfPrevLine
\ No newline at end of file
@@ -1,6 +1,61 @@
 import re
 
 from pysqlformatter.src.token import TokenType, Token
+from pysqlformatter.src.line_index import LineIndex
+
+SPARK_SQL_CALL = 'spark.sql('
+QUERY_ARGUMENT_FOLLOWERS = '),.'  # characters that may follow a query in spark.sql(), e.g., spark.sql('...'.format())
+MAX_ENDSWITH_QUERY_NAMES = 50  # more query names are matched by set lookups, see QueryNameMatcher()
+
+# Scanning patterns. Each is matched at a given position and cannot fail or backtrack, so the scan is linear in the
+# length of the script whatever it contains, e.g., unterminated strings or thousands of parentheses.
+LITERAL_START_REGEX = re.compile(r'[\'"#]')  # start of a string or comment
+STRING_BODY_REGEXES = {  # content of a string up to its closing quotes, a newline ending a single-quoted string, or EOF
+    "'": re.compile(r"[^'\\\n]*(?:\\.[^'\\\n]*)*", flags=re.DOTALL),
+    '"': re.compile(r'[^"\\\n]*(?:\\.[^"\\\n]*)*', flags=re.DOTALL),
+    "'''": re.compile(r"[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*", flags=re.DOTALL),
+    '"""': re.compile(r'[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*', flags=re.DOTALL),
+}
+
+
+class QueryNameMatcher:
+    '''
+    Match names ending with one of the query names, ignoring case. Many query names are kept in a set, and a name is
+    matched by looking up its suffixes of the lengths of the query names, so that matching takes time proportional to
+    the number of distinct lengths, which is small, instead of to the number of query names, which may be hundreds. A
+    few query names are tried in turn with str.endswith(), which is faster for them.
+    '''
+    def __init__(self, queryNames):
+        '''
+        Parameters
+        queryNames: list
+            Strings used to identify variables that contain the SparkSQL queries. Empty strings are ignored.
+        '''
+        self.queryNames = set(queryName.lower() for queryName in queryNames if queryName)
+        self.lengths = sorted(set(len(queryName) for queryName in self.queryNames))  # distinct lengths, increasing
+        self.maxLength = self.lengths[-1] if self.lengths else 0
+        # tuple for str.endswith() if there are few query names, else None
+        self.suffixes = tuple(self.queryNames) if len(self.queryNames) <= MAX_ENDSWITH_QUERY_NAMES else None
+
+    def match(self, name):
+        '''
+        Parameters
+        name: string
+            The name, or text ending with it.
+
+        Return: bool
+            True if the name ends with one of the query names, ignoring case.
+        '''
+        name = name.lower()
+        if self.suffixes is not None:
+            return name.endswith(self.suffixes)
+        nameLength = len(name)
+        for length in self.lengths:
+            if length > nameLength:
+                break
+            if name[nameLength - length:] in self.queryNames:
+                return True
+        return False
 
 
 class Tokenizer:
@@ -10,10 +65,11 @@ class Tokenizer:
 
         Parameters
         queryNames: list
-            Strings used to identify variables that contain the SparkSQL queries. 
-            All string variables whose name contain these strings will be formatted.
+            Strings used to identify variables that contain the SparkSQL queries.
+            All string variables whose name ends with one of these strings, ignoring case, will be formatted.
         '''
         self.queryNames = queryNames
+        self.queryNameMatcher = QueryNameMatcher(queryNames)
 
     def tokenize(self, script):
         '''
@@ -22,7 +78,7 @@ class Tokenizer:
         Parameters
         script: string
             The script to format.
-        
+
         Return: list
             Query tokens found in the script.
         '''
@@ -30,80 +86,117 @@ class Tokenizer:
         return queryMatchTokens
 
     def get_queries(self, script):
-        queryVariableTokens = self.get_query_variable(script=script)
-        queryArgumentTokens = self.get_query_argument(script=script)
-        queryTokens = queryArgumentTokens + queryVariableTokens
-        queryTokens.sort(key=lambda token: token.start)
-        return queryTokens
-
-    def get_query_variable(self, script):
         '''
-        Find queries stored in variables with designated set of variable names in self.queryNames.
+        Find queries stored in variables with designated set of variable names in self.queryNames and queries in
+        spark.sql() in one scan of the script. The scan jumps from one string or comment to the next, skipping each
+        as a whole, so that quotes, parentheses and names inside strings and comments are never mistaken for code. A
+        query is a string literal without prefix, e.g., not an f-string, that is either assigned to a variable whose name
+        ends with a query name, or passed as first argument of spark.sql() and followed by ')', ',' or '.'.
 
         Paramters
         script: string
             The script to format.
-        
+
         Return: list
-            Tokens of matched queries.
-        '''
-        queryVariableNames = '|'.join(self.queryNames)
-        queryRegexSingleQuotes = '{queryVariableNames}\s*=\s*\'(.*?)\''.format(queryVariableNames=queryVariableNames)
-        queryRegexDoubleQuotes = '{queryVariableNames}\s*=\s*"(.*?)"'.format(queryVariableNames=queryVariableNames)
-        queryRegexTipleSingleQuotes = '{queryVariableNames}\s*=\s*\'\'\'(.*?)\'\'\''.format(
-            queryVariableNames=queryVariableNames)
-        queryRegexTripleDoubleQuotes = '{queryVariableNames}\s*=\s*"""(.*?)"""'.format(
-            queryVariableNames=queryVariableNames)
-        queryRegex = '|'.join(
-            [queryRegexTipleSingleQuotes, queryRegexTripleDoubleQuotes, queryRegexSingleQuotes, queryRegexDoubleQuotes])
-        queryMatchObjs = re.finditer(pattern=queryRegex, string=script, flags=re.IGNORECASE | re.DOTALL)
-        queryMatchList = [
-            Tokenizer.create_token_from_match(matchObj=m, script=script, type=TokenType.QUERY_VARIABLE)
-            for m in queryMatchObjs
-        ]
-        return queryMatchList
-
-    def get_query_argument(self, script):
-        '''
-        Find queries in spark.sql() in the script.
+            Tokens of matched queries, in the order they appear in the script.
+        '''
+        lineIndex = LineIndex(script)  # shared by all tokens to look up their indentation
+        queryTokens = []
+        pos = 0  # next position to scan
+        codeStart = 0  # start of the code before pos, i.e., end of the last string or comment
+        while True:
+            matchObj = LITERAL_START_REGEX.search(script, pos)
+            if matchObj is None:
+                break
+            start = matchObj.start()
+            if script[start] == '#':  # comment
+                end = script.find('\n', start)
+                if end == -1:
+                    break
+                pos = codeStart = end
+                continue
+            quote = script[start] * 3 if script.startswith(script[start] * 3, start) else script[start]
+            contentStart = start + len(quote)
+            contentEnd = STRING_BODY_REGEXES[quote].match(script, contentStart).end()
+            if not script.startswith(quote, contentEnd):  # unterminated, up to the end of the line or script
+                if len(quote) == 3 or contentEnd == len(script):
+                    break
+                pos = codeStart = contentEnd
+                continue
+            end = contentEnd + len(quote)
+            if not Tokenizer.is_prefixed(script, start, codeStart):
+                tokenType = self.get_query_type(script, start, end, codeStart)
+                if tokenType is not None:
+                    queryTokens.append(Token(type=tokenType, start=contentStart, end=contentEnd, lineIndex=lineIndex))
+            pos = codeStart = end
+        return queryTokens
 
-        Paramters
+    def get_query_type(self, script, start, end, codeStart):
+        '''
+        Determine whether a string literal is a query from the code around it.
+
+        Parameters
         script: string
             The script to format.
-        
-        Return: list
-            Tokens of matched queries.
-        '''
-        sparkSqlRegex = 'spark\.sql\((.*?)\)'
-        sparkSqlMatchObjs = re.finditer(sparkSqlRegex, script, flags=re.DOTALL)
-        queryMatchTokens = []
-        for matchObj in sparkSqlMatchObjs:
-            matchGroupIndex = 1  # we want the start of the matched group, so need to skip m.start(0), the entire matched string
-            for m in matchObj.groups():
-                if m:
-                    matchGroup = m  # first match group that is not None
-                    break
-                else:
-                    matchGroupIndex += 1
-            if Tokenizer.is_query(matchGroup):  # e.g., spark.sql('select * from t0')
-                if matchGroup.startswith("'''") or matchGroup.startswith('"""'):  # enclosed by triple quotes
-                    matchTokenWithoutQuotes = Token(
-                        type=TokenType.QUERY_ARGUMENT,
-                        value=matchGroup.strip('"').strip("'"),
-                        start=matchObj.start(matchGroupIndex) + 3,  # skip opening triple quotes
-                        end=matchObj.end(matchGroupIndex) - 3,  # skip ending triple quotes
-                        script=script)
-                else:  # enclosed by single quotes
-                    matchTokenWithoutQuotes = Token(
-                        type=TokenType.QUERY_ARGUMENT,
-                        value=matchGroup.strip('"').strip("'"),
-                        start=matchObj.start(matchGroupIndex) + 1,  # skip opening quotes
-                        end=matchObj.end(matchGroupIndex) - 1,  # skip ending quotes
-                        script=script)
-                queryMatchTokens.append(matchTokenWithoutQuotes)
-            else:  # e.g., spark.sql(query)
-                continue  # ignore, because it is already handled by self.get_query_argument()
-        return queryMatchTokens
+        start: int
+            Position of the opening quotes of the string.
+        end: int
+            Position after the closing quotes of the string.
+        codeStart: int
+            Start of the code before the string, which is not part of a previous string or comment.
+
+        Return: string
+            TokenType.QUERY_ARGUMENT if the string is a query in spark.sql(), TokenType.QUERY_VARIABLE if it is assigned
+            to a variable with a query name, else None.
+        '''
+        # blanks before the string are skipped, e.g., in spark.sql(\n    '...') as laid out by black, or in query = '...'
+        pos = Tokenizer.skip_space_backward(script, start, codeStart)
+        if pos - len(SPARK_SQL_CALL) >= codeStart and script.startswith(SPARK_SQL_CALL, pos - len(SPARK_SQL_CALL)):
+            nextPos = end
+            while nextPos < len(script) and script[nextPos].isspace():
+                nextPos += 1
+            if nextPos < len(script) and script[nextPos] in QUERY_ARGUMENT_FOLLOWERS:
+                return TokenType.QUERY_ARGUMENT
+            return None  # e.g., spark.sql('select ' + columns), whose query is not a literal
+        if pos == codeStart or script[pos - 1] != '=':
+            return None
+        nameEnd = Tokenizer.skip_space_backward(script, pos - 1, codeStart)
+        name = script[max(codeStart, nameEnd - self.queryNameMatcher.maxLength):nameEnd]  # enough to match the suffix
+        if self.queryNameMatcher.match(name):
+            return TokenType.QUERY_VARIABLE  # e.g., query = '...', but not query == '...'
+        return None
+
+    @staticmethod
+    def is_prefixed(script, start, codeStart):
+        '''
+        Determine whether a string literal has a prefix, e.g., f'...' or r'...'.
+
+        Parameters
+        script: string
+            The script to format.
+        start: int
+            Position of the opening quotes of the string.
+        codeStart: int
+            Start of the code before the string.
+
+        Return: bool
+            True if the opening quotes directly follow a name character.
+        '''
+        return start > codeStart and Tokenizer.is_name_char(script[start - 1])
+
+    @staticmethod
+    def is_name_char(char):
+        return char.isalnum() or char == '_'
+
+    @staticmethod
+    def skip_space_backward(script, pos, codeStart):
+        '''
+        Return: int
+            The position after the last non-blank character before pos, or codeStart if there is none in the code.
+        '''
+        while pos > codeStart and script[pos - 1].isspace():
+            pos -= 1
+        return pos
 
     @staticmethod
     def is_query(text):
@@ -113,7 +206,7 @@ class Tokenizer:
         Parameters
         text: string
             The content in spark.sql()
-        
+
         Return: bool
             True if the text is a query. E.g., spark.sql('select * from t0').
             False if the text is a variable that stores the query. E.g., spark.sql(query)
@@ -128,36 +221,8 @@ class Tokenizer:
         Parameters
         query: string
             The query to format.
-        
+
         Return: string
             Query without starting and ending quotation marks.
         '''
         return query.strip('"').strip("'")
-
-    @staticmethod
-    def create_token_from_match(matchObj, script, type):
-        '''
-        Create token from re.match object.
-
-        Parameters
-        matchObj: re.match object
-        script: string
-            The script to format.
-        type: string
-            TokenType.
-        
-        Return: Token() object
-        '''
-        matchGroupIndex = 1
-        for m in matchObj.groups():
-            if m:
-                return Token(
-                    type=type,
-                    value=m,
-                    start=matchObj.start(
-                        matchGroupIndex
-                    ),  # start(0) is the start of the whole match, see https://docs.python.org/3/library/re.html re.Match.start([group])
-                    end=matchObj.end(matchGroupIndex),  # end(0) is the end of the whole match
-                    script=script)
-            else:
-                matchGroupIndex += 1
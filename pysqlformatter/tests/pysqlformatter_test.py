@@ -1,10 +1,27 @@
 import unittest
 import sys
 import os
+import io
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 import logging
+import shutil
+import socket
+import tempfile
+import threading
+import subprocess
 
 from pysqlformatter.src import api
+from pysqlformatter.src.ast_tokenizer import AstTokenizer, AST_DISCOVERY_SUPPORTED
+from pysqlformatter.src import cache as cache_module
+from pysqlformatter.src.cache import ResultCache, CacheInfo, get_settings_fingerprint
+from pysqlformatter.src.files import collect_files, get_git_changed_files
+from pysqlformatter.src.formatter import Formatter
+from pysqlformatter.src.manifest import Manifest
+from pysqlformatter.src.segments import get_statement_starts, split_segments
+from pysqlformatter.src.stats import FormatStats
+from pysqlformatter.src.styles import StyleRegistry
+from pysqlformatter.src.tokenizer import Tokenizer, QueryNameMatcher
+from sparksqlformatter import Style as sparksqlStyle
 
 logger = logging.getLogger(__name__)
 log_formatter = '[%(asctime)s] %(levelname)s [%(filename)s:%(lineno)s:%(funcName)s] %(message)s'
@@ -290,6 +307,706 @@ def foo():
         formattedScript = api.format_script(testScript)
         self.assertEqual(formattedScript, key)
 
+    def test_script_with_query_on_first_line(self):
+        msg = 'Testing script whose first line opens a multiline query, with a one-letter variable name'
+        testScript = """
+x = spark.sql('''
+select 1
+''')
+        """.strip() + '\n'
+        key = """
+x = spark.sql('''
+SELECT
+    1
+''')
+        """.strip() + '\n'  # pep8
+        formattedScript = api.format_script(testScript)
+        self.assertEqual(formattedScript, key)
+
+    def test_script_with_multiple_query_names(self):
+        msg = 'Testing script with queries stored in variables matching any of several query names'
+        testScript = """
+query = 'select * from t0'
+mySql = "drop table t1"
+name = 'select * from t2'
+df = spark.sql(query)
+        """
+        key = """
+query = '''
+SELECT
+    *
+FROM
+    t0
+'''
+mySql = "DROP TABLE t1"
+name = 'select * from t2'
+df = spark.sql(query)
+        """.strip() + '\n'  # pep8
+        formattedScript = api.format_script(testScript, queryNames=['query', 'sql'])
+        self.assertEqual(formattedScript, key)
+
+    def test_script_with_query_argument_ending_with_quote(self):
+        msg = 'Testing script with query in spark.sql() whose content ends with a quoted literal'
+        testScript = """
+df = spark.sql("select * from t0 where t0.date = '2020-01-01'")
+        """
+        tokens = Tokenizer(['query']).tokenize(testScript)
+        self.assertEqual(tokens[0].value, "select * from t0 where t0.date = '2020-01-01'")
+        self.assertFalse(hasattr(tokens[0], '__dict__'))
+        key = """
+df = spark.sql('''
+SELECT
+    *
+FROM
+    t0
+WHERE
+    t0.date = '2020-01-01'
+''')
+        """.strip() + '\n'  # pep8
+        formattedScript = api.format_script(testScript)
+        self.assertEqual(formattedScript, key)
+
+    def test_tokenizer_skips_strings_and_comments(self):
+        msg = 'Testing finding queries with parentheses, escapes and quotes, ignoring strings, comments and non-literals'
+        testScript = r"""
+df = spark.sql('select count(*) from t0 where a = \'(\'', hints)
+df = spark.sql("select * from {table}".format(table=table))
+doc = "query = 'select * from t1'"  # query = 'select * from t2'
+x = query == 'select * from t3'
+y = spark.sql('select * from ' + table)
+myQuery = f'select * from {table}'
+self.subquery = ('select 1')
+sql = '''select a from t4 where b = ')' '''
+query = 'unterminated
+        """
+        tokens = Tokenizer(['query', 'sql']).tokenize(testScript)
+        self.assertEqual(
+            [token.value for token in tokens],
+            [r"select count(*) from t0 where a = \'(\'", 'select * from {table}', "select a from t4 where b = ')' "])
+        self.assertEqual([token.type for token in tokens], ['QUERY_ARGUMENT', 'QUERY_ARGUMENT', 'QUERY_VARIABLE'])
+
+    @unittest.skipUnless(AST_DISCOVERY_SUPPORTED, 'requires end positions in the ast')
+    def test_ast_discovery(self):
+        msg = 'Testing finding queries from the syntax tree, in calls on any object, with non-ASCII text before them'
+        testScript = """
+x = ('é', self.spark.sql("select 'ü' from t0", hints))
+df = ss.sql('select * from t1')
+df = spark.sql(f'select * from {table}')
+df = spark.sql('select * ' 'from t2')
+write(mode='overwrite', sqlQuery='drop table t3')
+        """
+        tokens = AstTokenizer(['query'], ['sql']).tokenize(testScript)
+        self.assertEqual([token.value for token in tokens], ["select 'ü' from t0", 'select * from t1', 'drop table t3'])
+        self.assertEqual([token.value for token in AstTokenizer(['query']).tokenize(testScript)],
+                         ["select 'ü' from t0", 'drop table t3'])
+        key = """
+x = ('é', self.spark.sql('''
+SELECT
+    'ü'
+FROM
+    t0
+''', hints))
+df = ss.sql('''
+SELECT
+    *
+FROM
+    t1
+''')
+df = spark.sql(f'select * from {table}')
+df = spark.sql('select * '
+               'from t2')
+write(mode='overwrite', sqlQuery='DROP TABLE t3')
+        """.strip() + '\n'  # pep8
+        formattedScript = api.format_script(testScript, discovery='ast', queryCallees=['sql'])
+        self.assertEqual(formattedScript, key)
+
+    def test_tokenizer_pathological_inputs(self):
+        msg = 'Testing that inputs which made the former regex backtrack are scanned in one pass'
+        tokenizer = Tokenizer(['query'])
+        self.assertEqual(tokenizer.tokenize("spark.sql('a " * 20000), [])
+        self.assertEqual(tokenizer.tokenize('query = ' * 20000 + '"'), [])
+        testScript = "df = spark.sql('" + '(' * 20000 + "')\n" + "query = '''" + 'x' * 20000
+        self.assertEqual([token.value for token in tokenizer.tokenize(testScript)], ['(' * 20000])
+
+    def test_many_query_names(self):
+        msg = 'Testing matching names against many query names of several lengths, ignoring case and empty names'
+        queryNames = ['table{}Query'.format(i) for i in range(1000)] + ['SQL', '']
+        matcher = QueryNameMatcher(queryNames)
+        self.assertEqual(matcher.lengths, [3, 11, 12, 13])
+        self.assertTrue(matcher.match('myTABLE999query'))
+        self.assertTrue(matcher.match('sparkSql'))
+        self.assertFalse(matcher.match('table1000Query'))
+        self.assertFalse(matcher.match('ql'))
+        self.assertTrue(QueryNameMatcher(['query', 'SQL']).match('mySql'))
+        self.assertFalse(QueryNameMatcher(['']).match('query'))
+        testScript = """
+table7Query = 'select * from t0'
+table1000Query = 'select * from t1'
+mySql = 'select * from t2'
+        """
+        for tokenizer in [Tokenizer(queryNames), AstTokenizer(queryNames)]:
+            self.assertEqual([token.value for token in tokenizer.tokenize(testScript)],
+                             ['select * from t0', 'select * from t2'])
+
+    def test_format_files_with_jobs(self):
+        msg = 'Testing formatting multiple files in place with a worker pool, including a file that does not exist'
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir)
+        filePaths = []
+        for i in range(4):
+            filePath = os.path.join(tempDir, 'script{i}.py'.format(i=i))
+            with open(filePath, 'w') as f:
+                f.write("query = 'select * from t{i}'\n".format(i=i))
+            filePaths.append(filePath)
+        filePaths.insert(2, os.path.join(tempDir, 'missing.py'))
+        results = api.format_files(filePaths, inPlace=True, jobs=2)
+        self.assertEqual([result.filePath for result in results], filePaths)
+        self.assertIsNotNone(results[2].error)
+        for i, result in enumerate(results[:2] + results[3:]):
+            key = "query = '''\nSELECT\n    *\nFROM\n    t{i}\n'''\n".format(i=i)
+            self.assertIsNone(result.error)
+            self.assertEqual(result.formattedScript, key)
+            with open(result.filePath) as f:
+                self.assertEqual(f.read(), key)
+
+    def test_format_stats(self):
+        msg = 'Testing timing the stages and queries of formatting a script, and of files formatted by workers'
+        testScript = "x = 1\nquery = 'select * from t0'\ndf = spark.sql('select a from t1')\n"
+        stats = FormatStats()
+        formattedScript = Formatter().format(testScript, stats)
+        self.assertEqual(formattedScript, api.format_script(testScript))
+        self.assertEqual(list(stats.stageTimes), ['format_python', 'tokenize', 'format_queries', 'reformat_python'])
+        self.assertEqual(stats.tokenCount, 2)
+        self.assertEqual([(query.line, testScript[query.start:query.end]) for query in stats.queries],
+                         [(2, 'select * from t0'), (3, 'select a from t1')])
+        self.assertEqual(len(stats.get_slowest_queries(1)), 1)
+        self.assertAlmostEqual(stats.totalTime, sum(stats.stageTimes.values()))
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir)
+        filePaths = [os.path.join(tempDir, 'script{i}.py'.format(i=i)) for i in range(2)]
+        for filePath in filePaths:
+            with open(filePath, 'w') as f:
+                f.write(testScript)
+        results = api.format_files(filePaths, inPlace=True, jobs=2, profile=True)
+        for filePath, result in zip(filePaths, results):
+            self.assertEqual(result.stats.filePath, filePath)
+            self.assertEqual(list(result.stats.stageTimes)[0], 'read')
+            self.assertEqual(list(result.stats.stageTimes)[-1], 'output')
+            self.assertEqual(len(result.stats.queries), 2)
+        self.assertIsNone(api.format_files(filePaths, inPlace=True)[0].stats)
+
+    def test_format_files_check_and_diff(self):
+        msg = 'Testing checking files and showing diffs without writing them, and skipping formatted files in place'
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir)
+        testScripts = ["query = 'select * from t0'", "x = 1\n"]
+        filePaths = []
+        for i, testScript in enumerate(testScripts):
+            filePath = os.path.join(tempDir, 'script{i}.py'.format(i=i))
+            with open(filePath, 'w') as f:
+                f.write(testScript)
+            filePaths.append(filePath)
+        key = """--- {filePath}
++++ {filePath}
+@@ -1 +1,6 @@
+-query = 'select * from t0'
+\\ No newline at end of file
++query = '''
++SELECT
++    *
++FROM
++    t0
++'''
+""".format(filePath=filePaths[0])
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            checkResults = api.format_files(filePaths, check=True)
+            checkOutput = sys.stdout.getvalue()
+            sys.stdout = io.StringIO()
+            diffResults = api.format_files(filePaths, diff=True)
+            diffOutput = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual([result.changed for result in checkResults], [True, False])
+        self.assertEqual(checkOutput, filePaths[0] + '\n')
+        self.assertEqual([result.diff for result in diffResults], [key, ''])
+        self.assertEqual(diffOutput, key)
+        for filePath, testScript in zip(filePaths, testScripts):
+            with open(filePath) as f:
+                self.assertEqual(f.read(), testScript)
+        os.utime(filePaths[1], (0, 0))
+        os.chmod(filePaths[0], 0o640)
+        api.format_files(filePaths, inPlace=True)
+        self.assertEqual(os.stat(filePaths[1]).st_mtime, 0)
+        self.assertEqual(os.stat(filePaths[0]).st_mode & 0o777, 0o640)
+        self.assertEqual(os.listdir(tempDir), ['script0.py', 'script1.py'])
+
+    def test_collect_files_and_manifest(self):
+        msg = 'Testing finding files in directories and skipping those recorded as formatted in the manifest'
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir)
+        for relPath in ['pkg/a.py', 'pkg/sub/b.py', 'pkg/sub/b_pb2.py', 'pkg/notes.txt', 'build/c.py', '.git/d.py']:
+            filePath = os.path.join(tempDir, relPath)
+            if not os.path.isdir(os.path.dirname(filePath)):
+                os.makedirs(os.path.dirname(filePath))
+            with open(filePath, 'w') as f:
+                f.write('x = 1\n')
+        filePaths = collect_files([tempDir, api.STDIN_PATH], exclude=['build', '*_pb2.py'])
+        self.assertEqual(
+            filePaths,
+            [os.path.join(tempDir, 'pkg', 'a.py'),
+             os.path.join(tempDir, 'pkg', 'sub', 'b.py'), api.STDIN_PATH])
+        filePaths = filePaths[:2]
+        manifestPath = os.path.join(tempDir, 'manifest.json')
+        manifest = Manifest(manifestPath=manifestPath, settingsFingerprint='pep8')
+        self.assertEqual([manifest.is_changed(filePath) for filePath in filePaths], [True, True])
+        for filePath in filePaths:
+            manifest.record(filePath)
+        manifest.save()
+        os.utime(filePaths[0], (0, 0))  # touched but not modified
+        with open(filePaths[1], 'a') as f:
+            f.write('y = 2\n')
+        manifest = Manifest(manifestPath=manifestPath, settingsFingerprint='pep8')
+        self.assertEqual([manifest.is_changed(filePath) for filePath in filePaths], [False, True])
+        manifest = Manifest(manifestPath=manifestPath, settingsFingerprint='google')
+        self.assertEqual([manifest.is_changed(filePath) for filePath in filePaths], [True, True])
+
+    @unittest.skipUnless(shutil.which('git'), 'requires git')
+    def test_get_git_changed_files(self):
+        msg = 'Testing finding the files changed since a git revision, including untracked files, through a symlink'
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir)
+        git = ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com']
+        for fileName in ['a.py', 'b.py', 'c.py']:
+            with open(os.path.join(tempDir, fileName), 'w') as f:
+                f.write('x = f( 1 )\n')
+        subprocess.check_call(git + ['init', '-q'], cwd=tempDir)
+        subprocess.check_call(git + ['add', '.'], cwd=tempDir)
+        subprocess.check_call(git + ['commit', '-q', '-m', 'init'], cwd=tempDir)
+        with open(os.path.join(tempDir, 'a.py'), 'w') as f:
+            f.write('x = f( 2 )\n')
+        os.remove(os.path.join(tempDir, 'c.py'))
+        with open(os.path.join(tempDir, 'd.py'), 'w') as f:
+            f.write('x = 1\n')
+        linkDir = tempDir + '-link'  # a checkout seen through a symlink, e.g., /tmp on macOS
+        os.symlink(tempDir, linkDir)
+        self.addCleanup(os.remove, linkDir)
+        self.assertEqual(get_git_changed_files('HEAD', cwd=linkDir),
+                         set([os.path.realpath(os.path.join(linkDir, fileName)) for fileName in ['a.py', 'd.py']]))
+        rootDir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        pythonPath = os.pathsep.join([rootDir] + os.environ.get('PYTHONPATH', '').split(os.pathsep))
+        command = [sys.executable, '-m', 'pysqlformatter', '--git-diff', 'HEAD', '--check', '-f', linkDir]
+        process = subprocess.Popen(command,
+                                   cwd=linkDir,
+                                   env=dict(os.environ, PYTHONPATH=pythonPath),
+                                   stdout=subprocess.PIPE)
+        output = process.communicate()[0].decode('utf-8')
+        self.assertEqual(process.returncode, 1)
+        self.assertEqual([os.path.basename(filePath) for filePath in output.split()], ['a.py'])
+
+    def test_format_stdin(self):
+        msg = 'Testing formatting stdin to stdout'
+        testScript = "query = 'select * from t0'\r\n"
+        key = """
+query = '''
+SELECT
+    *
+FROM
+    t0
+'''
+        """.strip() + '\n'  # pep8
+        stdin, stdout = sys.stdin, sys.stdout
+        sys.stdin = io.TextIOWrapper(io.BytesIO(testScript.encode('utf-8')))
+        sys.stdout = io.StringIO()
+        try:
+            results = api.format_files([api.STDIN_PATH], inPlace=True, jobs=2)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdin, sys.stdout = stdin, stdout
+        self.assertEqual(
+            results,
+            [api.FormatResult(filePath=api.STDIN_PATH, formattedScript=key, error=None, changed=True, diff=None)])
+        self.assertEqual(output, key)
+
+    def test_format_batch(self):
+        msg = 'Testing formatting NUL-delimited scripts, writing back those that cannot be formatted unchanged'
+        testScripts = ["query = 'select * from t0'", 'def f(:\n', 'df = spark.sql("drop table t1")']
+        keys = ["query = '''\nSELECT\n    *\nFROM\n    t0\n'''\n", 'def f(:\n', 'df = spark.sql("DROP TABLE t1")\n']
+        batch = '\0'.join(testScripts).encode('utf-8')
+        for jobs in [1, 2]:
+            outStream = io.BytesIO()
+            errorCount = api.format_batch(io.BytesIO(batch), outStream, jobs=jobs)
+            self.assertEqual(errorCount, 1)
+            self.assertEqual(outStream.getvalue().decode('utf-8').split('\0'), keys + [''])
+
+    def test_format_script_with_cache(self):
+        msg = 'Testing that a cached result is returned without formatting, and that the cache evicts old entries'
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir)
+        cache = ResultCache(cacheDir=tempDir)
+        testScript = "query = 'select * from t0'\n"
+        key = "query = '''\nSELECT\n    *\nFROM\n    t0\n'''\n"
+        self.assertEqual(api.format_script(testScript, cache=cache), key)
+        cacheKey = cache.get_key(testScript, 'pep8', sparksqlStyle(), ['query'], reformatChangedLinesOnly=False)
+        self.assertEqual(cache.get(cacheKey), key)
+        cache.put(cacheKey, 'cached')
+        self.assertEqual(api.format_script(testScript, cache=cache), 'cached')
+        self.assertEqual(api.format_script(testScript, queryNames=['sql'], cache=cache), testScript)
+        fingerprint = get_settings_fingerprint('pep8', None, ['query'])
+        self.assertEqual(get_settings_fingerprint('pep8', None, ['query']), fingerprint)
+        sparksqlformatterVersion = cache_module._sparksqlformatterVersion
+        cache_module._sparksqlformatterVersion = sparksqlformatterVersion + '.post1'  # as if sparksqlformatter changed
+        try:
+            self.assertNotEqual(get_settings_fingerprint('pep8', None, ['query']), fingerprint)
+        finally:
+            cache_module._sparksqlformatterVersion = sparksqlformatterVersion
+        smallCache = ResultCache(cacheDir=tempDir, maxSize=len(key) * 2)
+        for i in range(5):
+            smallCache.put(smallCache.get_key(str(i), 'pep8', sparksqlStyle(), ['query']), key)
+        self.assertLessEqual(smallCache.size, smallCache.maxSize)
+        self.assertLessEqual(sum(size for _, _, size in smallCache._list_entries()), smallCache.maxSize)
+
+    def test_formatter_query_cache(self):
+        msg = 'Testing that identical queries are formatted once per Formatter'
+        formatter = Formatter(queryCacheSize=1)
+        testScript = """
+query = 'select * from t0'
+df = spark.sql('  select * from t0 ')
+df = spark.sql('select * from t1')
+        """
+        key = """
+query = '''
+SELECT
+    *
+FROM
+    t0
+'''
+df = spark.sql('''
+SELECT
+    *
+FROM
+    t0
+''')
+df = spark.sql('''
+SELECT
+    *
+FROM
+    t1
+''')
+        """.strip() + '\n'  # pep8
+        self.assertEqual(formatter.format(testScript), key)
+        self.assertEqual(formatter.query_cache_info(), CacheInfo(hits=1, misses=2, maxSize=1, currSize=1))
+        self.assertEqual(formatter.format(testScript), key)
+        self.assertEqual(formatter.query_cache_info(), CacheInfo(hits=2, misses=4, maxSize=1, currSize=1))
+
+    def test_formatter_query_jobs(self):
+        msg = 'Testing that formatting the queries of a script in a pool gives the same script as formatting them in turn'
+        testScript = ''.join("t{0}Query = 'select a{0}, b from t{0} where c = 1'\n".format(i) for i in range(100))
+        testScript += "query = ' select a0, b from t0 where c = 1'\ndf = spark.sql('select * from t0')\n"
+        key = api.format_script(testScript)
+        formatter = Formatter(queryJobs=2)
+        self.assertEqual(len(formatter.format_queries_in_parallel(formatter.tokenizer.tokenize(testScript))), 101)
+        self.assertEqual(formatter.query_cache_info(), CacheInfo(hits=0, misses=0, maxSize=1024, currSize=101))
+        self.assertEqual(Formatter(queryJobs=2).format(testScript), key)
+        self.assertEqual(Formatter(queryJobs=2, queryCacheSize=0).format(testScript), key)
+        self.assertEqual(api.format_script(testScript, queryJobs=0, reformatChangedLinesOnly=True), key)
+
+    def test_script_reformat_changed_lines_only(self):
+        msg = 'Testing that reformatting only the changed lines gives the same result as reformatting the whole script'
+        testScript = """
+def get_base(date):
+    query = '''
+    select * from
+    t0
+    where t0.date = '{date}'
+    '''
+    df = some_module.some_function(first_argument, spark.sql('select * from t1'), second_argument, third_argument)
+    dropQuery = 'drop table xxx'
+    return df
+        """
+        key = api.format_script(testScript)
+        formattedScript = api.format_script(testScript, reformatChangedLinesOnly=True)
+        self.assertEqual(formattedScript, key)
+        self.assertEqual(api.format_script(key, reformatChangedLinesOnly=True), api.format_script(key))
+
+    def test_format_lines(self):
+        msg = 'Testing that only the statements and queries in the given line ranges are formatted'
+        testScript = """import os
+@decorator
+def get_base( date ):
+    query = 'select * from t0'
+    return spark.sql( query )
+x = [
+1, 2 ]
+df = spark.sql('select * from t1')  # it's
+y = f( a )
+"""
+        key = """import os
+@decorator
+def get_base( date ):
+    query = '''
+    SELECT
+        *
+    FROM
+        t0
+    '''
+    return spark.sql( query )
+x = [
+1, 2 ]
+df = spark.sql('select * from t1')  # it's
+y = f(a)
+"""
+        self.assertEqual(get_statement_starts(testScript), [0, 1, 5, 7, 8])
+        self.assertEqual(get_statement_starts('if a:\n    x = """\nb\n"""\nelse:  # (\n    y = \\\n1\nz\n'), [0, 7])
+        self.assertEqual(api.format_script(testScript, lines=[(4, 4), (9, 9)]), key)
+        self.assertEqual(api.format_script(testScript, lines=[(1, 9)]), api.format_script(testScript))
+        self.assertEqual(api.format_script(testScript + '\n\n', lines=[(11, 11)]), testScript + '\n\n')
+        with tempfile.TemporaryDirectory() as tempDir:
+            cache = ResultCache(cacheDir=tempDir)
+            self.assertEqual(api.format_script(testScript, cache=cache, lines=[(4, 4), (9, 9)]), key)
+            self.assertEqual(api.format_script(testScript, cache=cache), api.format_script(testScript))
+        lineRanges = Formatter.map_lines('a\nb\nc\n', 'a\nb1\nb2\nc\n', [(1, 1), (2, 2), (3, 3)])
+        self.assertEqual(lineRanges, [(1, 1), (2, 3), (4, 4)])
+
+    def test_format_segments(self):
+        msg = 'Testing that formatting a script one segment at a time gives the same script as formatting it whole'
+        testScript = """import os
+x = '''
+# not a comment
+'''
+def f( a ):
+    query = 'select * from t0'
+    return a
+
+# comment before g
+def g( b ):
+    return spark.sql( 'select b from t1' )
+  # comment of g
+y = 1
+"""
+        lines = testScript.splitlines(True)
+        self.assertEqual([segment for _, segment in split_segments(lines, 1)], [
+            'import os\n', "x = '''\n# not a comment\n'''\n",
+            "def f( a ):\n    query = 'select * from t0'\n    return a\n",
+            "\n# comment before g\ndef g( b ):\n    return spark.sql( 'select b from t1' )\n",
+            '  # comment of g\ny = 1\n'
+        ])
+        self.assertEqual([context for context, _ in split_segments(lines, 2)],
+                         ['', 'import os\n', "x = '''\n# not a comment\n'''\n"])
+        self.assertEqual(list(split_segments([], 1)), [('', '')])
+        key = api.format_script(testScript)
+        for segmentLines in [1, 2, 100]:
+            formattedSegments = Formatter().format_segments(lines, segmentLines)
+            self.assertEqual(''.join(formattedSegment for _, formattedSegment in formattedSegments), key)
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir)
+        filePath = os.path.join(tempDir, 'script.py')
+        with open(filePath, 'w') as f:
+            f.write(testScript)
+        self.assertTrue(api.format_files([filePath], check=True, segmentLines=1)[0].changed)
+        result = api.format_files([filePath], inPlace=True, segmentLines=1)[0]
+        self.assertIsNone(result.error)
+        self.assertTrue(result.changed)
+        with open(filePath) as f:
+            self.assertEqual(f.read(), key)
+        self.assertFalse(api.format_files([filePath], inPlace=True, segmentLines=1)[0].changed)
+        self.assertEqual(os.listdir(tempDir), ['script.py'])  # no temporary file left behind
+        self.assertRaises(Exception, api.format_files, [filePath], diff=True, segmentLines=1)
+        self.assertRaises(Exception, api.format_files, [filePath], inPlace=True, lines=[(1, 1)], segmentLines=1)
+
+    def test_sql_only(self):
+        msg = 'Testing that only the queries are formatted when there is no Python style'
+        testScript = """x = f( a,b )
+def g():
+    query = 'select * from t0'
+    return spark.sql( query )
+df = spark.sql('select a from t1 where b = 1').count()
+df = spark.sql(
+    'select a from t2')
+"""
+        key = """x = f( a,b )
+def g():
+    query = '''
+    SELECT
+        *
+    FROM
+        t0
+    '''
+    return spark.sql( query )
+df = spark.sql('''
+SELECT
+    a
+FROM
+    t1
+WHERE
+    b = 1
+''').count()
+df = spark.sql(
+    '''
+    SELECT
+        a
+    FROM
+        t2
+    ''')
+"""
+        self.assertEqual(api.format_script(testScript, pythonStyle=None), key)
+        self.assertEqual(api.format_script(testScript, pythonStyle=None, discovery='ast'), key)
+        self.assertEqual(api.format_script(testScript, pythonStyle=None, lines=[(3, 3)]),
+                         key[:key.index('    return')] + testScript[testScript.index('    return'):])
+
+    def test_style_registry(self):
+        msg = 'Testing that styles are resolved once, applied, and reloaded when their config file changes'
+        registry = StyleRegistry()
+        self.assertIs(registry.get_sparksql_style(None), registry.get_sparksql_style(None))
+        style = registry.get_sparksql_style({'reservedKeywordUppercase': False})
+        self.assertFalse(style.reservedKeywordUppercase)
+        self.assertIs(registry.get_sparksql_style({'reservedKeywordUppercase': False}), style)
+        self.assertFalse(registry.get_sparksql_style("{'reservedKeywordUppercase': False}").reservedKeywordUppercase)
+        self.assertRaises(Exception, registry.get_sparksql_style, 1)
+        tempDir = tempfile.mkdtemp()
+        try:
+            stylePath = os.path.join(tempDir, 'style.cfg')
+            with open(stylePath, 'w') as f:
+                f.write('[sparksqlformatter]\nreservedKeywordUppercase = False\n')
+            style = registry.get_sparksql_style(stylePath)
+            fingerprint = registry.get_fingerprint(stylePath)
+            self.assertFalse(style.reservedKeywordUppercase)
+            self.assertIs(registry.get_sparksql_style(stylePath), style)
+            with open(stylePath, 'w') as f:
+                f.write('[sparksqlformatter]\nreservedKeywordUppercase = True\n')
+            os.utime(stylePath, ns=(0, 0))  # a different modification time, even on file systems with coarse times
+            self.assertTrue(registry.get_sparksql_style(stylePath).reservedKeywordUppercase)
+            self.assertNotEqual(registry.get_fingerprint(stylePath), fingerprint)
+            pythonStylePath = os.path.join(tempDir, 'setup.cfg')
+            with open(pythonStylePath, 'w') as f:
+                f.write('[yapf]\nbased_on_style = pep8\nindent_width = 2\n')
+            self.assertIs(registry.get_python_style(pythonStylePath), registry.get_python_style(pythonStylePath))
+            for pythonStyle in [pythonStylePath, 'pep8', pythonStylePath]:  # the global yapf style is set every time
+                formattedScript = Formatter(pythonStyle=pythonStyle).format('if x:\n    y = 1\n')
+                self.assertEqual(formattedScript, 'if x:\n  y = 1\n' if pythonStyle != 'pep8' else 'if x:\n    y = 1\n')
+        finally:
+            shutil.rmtree(tempDir)
+        formattedScript = api.format_script("query = 'select * from t0'",
+                                            sparksqlStyle={'reservedKeywordUppercase': False})
+        self.assertEqual(formattedScript, "query = '''\nselect\n    *\nfrom\n    t0\n'''\n")
+
+    def test_formatter_shared_by_threads(self):
+        msg = 'Testing that one Formatter gives the same results when used by many threads at once'
+        formatter = Formatter(queryCacheSize=2)  # smaller than the number of distinct queries, so entries are evicted
+        testScripts = [
+            """
+def f{i}(date):
+    query = 'select a, b from t{i} where t{i}.date = "{{date}}"'
+    df = some_module.some_function(first_argument, spark.sql('select * from t{i}'), second_argument, third_argument)
+    return df
+            """.format(i=i) for i in range(8)
+        ]
+        keys = [Formatter().format(testScript) for testScript in testScripts]
+        errors = []
+
+        def format_scripts(threadIndex):
+            try:
+                for j in range(len(testScripts) * 3):
+                    i = (threadIndex + j) % len(testScripts)
+                    formattedScript = formatter.format(testScripts[i])
+                    if formattedScript != keys[i]:
+                        errors.append((i, formattedScript))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=format_scripts, args=(threadIndex, )) for threadIndex in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        def fail(query):
+            raise ValueError(query)
+
+        formatter.format_query = fail  # a call failing midway does not affect later calls
+        self.assertRaises(ValueError, formatter.format, testScripts[0])
+        del formatter.format_query
+        self.assertEqual(formatter.format(testScripts[1]), keys[1])
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'requires Unix domain sockets')
+    def test_daemon(self):
+        msg = 'Testing formatting scripts sent concurrently to the daemon, which exits when idle'
+        from pysqlformatter.src import daemon
+        testScripts = ["query = 'select * from t{}'".format(i) for i in range(4)]
+        keys = [api.format_script(testScript) for testScript in testScripts]
+        tempDir = tempfile.mkdtemp()
+        try:
+            server = daemon.FormatterServer(socketPath=os.path.join(tempDir, 'test.sock'), idleTimeout=1)
+            serverThread = threading.Thread(target=server.serve)
+            serverThread.start()
+            errors = []
+
+            def format_scripts():
+                try:
+                    with daemon.FormatterClient(socketPath=server.socketPath, timeout=30) as client:
+                        for testScript, key in zip(testScripts, keys):
+                            if client.format_script(testScript, queryNames=['query']) != key:
+                                errors.append(testScript)
+                        self.assertRaises(Exception, client.format_script, 'def f(:\n')
+                        testScript = 'x = f( a )\n' + testScripts[0] + '\n'
+                        if client.format_script(testScript, lines=[(2, 2)]) != 'x = f( a )\n' + keys[0]:
+                            errors.append(testScript)
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=format_scripts) for _ in range(64)]  # more than the default backlog
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(server.formatters.info().currSize, 1)
+            serverThread.join(timeout=30)
+            self.assertFalse(serverThread.is_alive())
+            self.assertFalse(os.path.exists(server.socketPath))
+        finally:
+            shutil.rmtree(tempDir)
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'requires Unix domain sockets')
+    def test_daemon_socket_is_private(self):
+        msg = 'Testing that the client only connects to private sockets, and that the daemon only replaces sockets'
+        from pysqlformatter.src import daemon
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir)
+        socketDir = os.path.join(tempDir, 'pysqlformatter')
+        daemon._make_private_dir(socketDir)
+        self.assertEqual(os.stat(socketDir).st_mode & 0o777, 0o700)
+        os.chmod(socketDir, 0o755)
+        self.assertRaises(PermissionError, daemon._make_private_dir, socketDir)
+        socketPath = os.path.join(tempDir, 'test.sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(listener.close)
+        listener.bind(socketPath)
+        listener.listen(1)
+        os.chmod(socketPath, 0o777)
+        self.assertRaises(PermissionError, daemon.FormatterClient, socketPath=socketPath)
+        os.chmod(socketPath, 0o700)
+        daemon.FormatterClient(socketPath=socketPath).close()
+        filePath = os.path.join(tempDir, 'script.py')
+        with open(filePath, 'w') as f:
+            f.write('x = 1\n')
+        self.assertRaises(Exception, daemon.FormatterServer, socketPath=filePath)
+        with open(filePath) as f:
+            self.assertEqual(f.read(), 'x = 1\n')  # not replaced by the socket
+
+    def test_import_is_lazy(self):
+        msg = 'Testing that importing pysqlformatter neither imports the formatting libraries nor configures logging'
+        code = '; '.join([
+            'import sys, logging', 'from pysqlformatter import Formatter',
+            "print([name for name in ['yapf', 'sparksqlformatter', 'multiprocessing'] if name in sys.modules])",
+            'print(logging.getLogger().handlers)'
+        ])
+        rootDir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=rootDir)
+        self.assertEqual(output.decode('utf-8').split(), ['[]', '[]'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -13,11 +13,11 @@ setuptools.setup(name='pysqlformatter',
                  url='https://github.com/largecats/pyspark-sql-formatter',
                  packages=setuptools.find_packages(),
                  install_requires=['yapf', 'sparksqlformatter>=0.1.12', 'configparser'],
+                 python_requires='>=3.6',
                  classifiers=[
                      'Programming Language :: Python',
-                     'Programming Language :: Python :: 2',
-                     'Programming Language :: Python :: 2.7',
                      'Programming Language :: Python :: 3',
+                     'Programming Language :: Python :: 3 :: Only',
                      'Programming Language :: Python :: 3.6',
                      'License :: OSI Approved :: MIT License',
                      'Operating System :: OS Independent',